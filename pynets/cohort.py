@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Nov  7 10:40:07 2017
+Copyright (C) 2018
+@author: Derek Pisner (dPys)
+"""
+import numpy as np
+import warnings
+warnings.simplefilter("ignore")
+
+# Metrics computed by cohort_metrics, as (name, output) with output 'global' or 'nodal'
+cohort_metric_list = [('density', 'global'), ('degree', 'nodal'), ('strength', 'nodal'),
+                      ('local_clustering', 'nodal'), ('average_clustering', 'global'), ('transitivity', 'global'),
+                      ('nodal_efficiency', 'nodal'), ('global_efficiency', 'global'),
+                      ('participation_coefficient', 'nodal'), ('eigenvector_centrality', 'nodal')]
+
+
+def load_est_stack(est_paths, out_path=None):
+    """
+    Stack the connectivity matrices saved at est_paths (.npy, .txt or .npz of utils.save_est, all of the same size)
+    into one (subjects x N x N) array.
+
+    Parameters
+    ----------
+    est_paths : list
+        file paths of the subject matrices.
+    out_path : str
+        optional .npy path of a memory-mapped stack to write, so that cohorts larger than memory can be streamed
+        through cohort_metrics. If None, the stack is held in memory.
+
+    Returns
+    -------
+    stack : SxNxN np.ndarray or np.memmap
+    """
+    from pynets.utils import load_est
+    first = load_est(est_paths[0], mmap_mode='r')
+    shape = (len(est_paths),) + first.shape
+    if out_path is None:
+        stack = np.zeros(shape)
+    else:
+        stack = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float64, shape=shape)
+    stack[0] = first
+    for s, est_path in enumerate(est_paths[1:]):
+        stack[s + 1] = load_est(est_path, mmap_mode='r')
+    if out_path is not None:
+        stack.flush()
+    return stack
+
+
+def _batch_distances(A):
+    """Return the hop-count shortest path distances of a stack of binary adjacency matrices (inf if unreachable),
+    with one unweighted breadth-first search per subject (scipy.sparse.csgraph), i.e. O(S*n*m) for m edges per
+    subject, rather than dense matrix products over the whole stack"""
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import shortest_path
+    D = np.empty(A.shape)
+    for s in range(A.shape[0]):
+        D[s] = shortest_path(csr_matrix(A[s]), directed=True, unweighted=True)
+    return D
+
+
+def _batch_eigenvector_centrality(A):
+    """Leading eigenvector of each binary adjacency matrix of a stack, with a single batched np.linalg.eigh, signed
+    and scaled to unit norm as in netstats.eigenvector_centrality_vector"""
+    A = np.asarray(A, dtype=np.float64)
+    [S, n, _] = A.shape
+    if n == 0:
+        return np.zeros((S, 0))
+    x = np.linalg.eigh(A)[1][:, :, -1]
+    x[np.sum(x, axis=1) < 0] *= -1
+    x /= np.linalg.norm(x, axis=1)[:, np.newaxis]
+    # Graphs without edges, as in netstats.eigenvector_centrality_vector
+    x[~np.any(A, axis=(1, 2))] = 1 / np.sqrt(n)
+    return x
+
+
+def cohort_metrics(stack, ids=None, ci=None, batch_size=16):
+    """
+    Graph metrics of every subject of a cohort, vectorized along the subject axis.
+
+    Metrics follow the conventions of extractnetstats: degree, clustering, efficiency and eigenvector centrality are
+    computed on the binarized graph (without self-loops), strength and participation on the weights.
+
+    Parameters
+    ----------
+    stack : SxNxN np.ndarray or np.memmap
+        symmetric connectivity matrix of each subject (see load_est_stack). Subjects are loaded batch_size at a time.
+    ids : list
+        optional subject ids. Defaults to 0..S-1.
+    ci : Nx1 np.ndarray
+        community affiliation vector shared by all subjects (e.g. of resting-state networks), used for the
+        participation coefficient. If None, the Louvain partition of the cohort mean matrix is used.
+    batch_size : int
+        number of subjects processed at once. default value=16.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        tidy table with columns id, metric, node and value. node is None for global metrics.
+    """
+    import pandas as pd
+    from pynets import netstats
+    from pynets.graph import ArrayGraph
+    [S, n, _] = stack.shape
+    if ids is None:
+        ids = list(range(S))
+    if ci is None:
+        W_mean = np.zeros((n, n))
+        for start in range(0, S, batch_size):
+            W_mean += np.sum(np.nan_to_num(np.asarray(stack[start:start + batch_size], dtype=np.float64)), axis=0)
+        W_mean /= S
+        ci = netstats.modularity_louvain_und_sign(W_mean, gamma=ArrayGraph(W_mean).density())[0]
+    _, ci = np.unique(ci, return_inverse=True)
+    # Dense community indicator matrix, so that node-to-module strengths are one batched product
+    M = np.zeros((n, np.max(ci) + 1))
+    M[np.arange(n), ci] = 1
+
+    results = dict((name, []) for name, _ in cohort_metric_list)
+    for start in range(0, S, batch_size):
+        W = np.nan_to_num(np.array(stack[start:start + batch_size], dtype=np.float64))
+        W[:, np.arange(n), np.arange(n)] = 0
+        A = np.logical_or(W != 0, np.swapaxes(W, 1, 2) != 0)
+
+        degree = np.sum(A, axis=2)
+        results['degree'].append(degree)
+        results['density'].append(np.sum(degree, axis=1) / float(n * (n - 1)) if n > 1 else np.zeros(len(W)))
+        results['strength'].append(np.sum(W, axis=2))
+
+        clustering = netstats.clustering_vector(A, sparse=False)
+        results['local_clustering'].append(clustering)
+        results['average_clustering'].append(np.mean(clustering, axis=1))
+        results['transitivity'].append(np.atleast_1d(netstats.transitivity_vector(A, sparse=False)))
+
+        with np.errstate(divide='ignore'):
+            inv_D = 1 / _batch_distances(A)
+        inv_D[:, np.arange(n), np.arange(n)] = 0
+        results['nodal_efficiency'].append(np.sum(inv_D, axis=2) / (n - 1) if n > 1 else np.zeros((len(W), n)))
+        results['global_efficiency'].append(np.mean(results['nodal_efficiency'][-1], axis=1))
+
+        Snm = np.matmul(W, M)
+        Ko = np.sum(Snm, axis=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            P = 1 - np.sum(np.square(Snm), axis=2) / np.square(Ko)
+        P[Ko == 0] = 0
+        results['participation_coefficient'].append(P)
+
+        results['eigenvector_centrality'].append(_batch_eigenvector_centrality(A))
+
+    # Assemble the long table without looping over subjects
+    ids = np.asarray(ids, dtype=object)
+    tables = []
+    for name, output in cohort_metric_list:
+        values = np.concatenate(results[name])
+        if output == 'nodal':
+            tables.append(pd.DataFrame({'id': np.repeat(ids, n), 'metric': name,
+                                        'node': np.tile(np.arange(n), S).astype(object), 'value': values.ravel()}))
+        else:
+            tables.append(pd.DataFrame({'id': ids, 'metric': name, 'node': None, 'value': values}))
+    return pd.concat(tables, ignore_index=True)[['id', 'metric', 'node', 'value']]
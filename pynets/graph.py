@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Nov  7 10:40:07 2017
+Copyright (C) 2018
+@author: Derek Pisner (dPys)
+"""
+import numpy as np
+import warnings
+warnings.simplefilter("ignore")
+
+
+class ArrayGraph(object):
+    """Lightweight graph backed by a dense or CSR weight matrix
+
+    Structural queries (degree, density, connected components, minimum
+    spanning tree, shortest paths and induced subgraphs) are computed over
+    arrays, so thresholding, pruning and plotting do not need to build a
+    networkx graph. Conventions follow networkx.from_numpy_array: every
+    nonzero entry is an edge (in an undirected graph, W[i, j] or W[j, i]),
+    and a self-loop is an edge that counts twice towards the degree.
+
+    networkx is only imported by the to_networkx/from_networkx adapters,
+    for metrics that have no array implementation.
+
+    Parameters
+    ----------
+    W : NxN np.ndarray or scipy.sparse matrix
+        weight matrix. Stored as CSR if sparse, and without copying if dense.
+    directed : bool
+        If True, W[i, j] is an edge from i to j. default value=False.
+    nodes : list
+        optional node labels, in the order of the rows of W. Defaults to 0..N-1.
+    """
+
+    def __init__(self, W, directed=False, nodes=None):
+        from scipy import sparse
+        if sparse.issparse(W):
+            W = sparse.csr_matrix(W)
+            W.eliminate_zeros()
+        else:
+            W = np.asarray(W)
+        if W.ndim != 2 or W.shape[0] != W.shape[1]:
+            raise ValueError('Adjacency matrix must be square')
+        self.W = W
+        self.directed = bool(directed)
+        self.nodes = list(range(W.shape[0])) if nodes is None else list(nodes)
+        if len(self.nodes) != W.shape[0]:
+            raise ValueError('Number of node labels does not match the adjacency matrix')
+        self._adjacency = None
+
+    def __len__(self):
+        return self.W.shape[0]
+
+    @property
+    def is_sparse(self):
+        from scipy import sparse
+        return sparse.issparse(self.W)
+
+    @property
+    def adjacency(self):
+        """Boolean adjacency matrix (symmetric for undirected graphs), dense or CSR like W"""
+        if self._adjacency is None:
+            if self.is_sparse:
+                A = self.W.astype(bool)
+                if not self.directed:
+                    A = (A + A.T).tocsr()
+            else:
+                A = self.W != 0
+                if not self.directed:
+                    A = np.logical_or(A, A.T)
+            self._adjacency = A
+        return self._adjacency
+
+    def number_of_nodes(self):
+        return len(self)
+
+    def number_of_selfloops(self):
+        return int(np.count_nonzero(self.adjacency.diagonal()))
+
+    def number_of_edges(self):
+        A = self.adjacency
+        nnz = A.nnz if self.is_sparse else int(np.count_nonzero(A))
+        if self.directed:
+            return nnz
+        return (nnz + self.number_of_selfloops()) // 2
+
+    @property
+    def degree(self):
+        """Number of edges incident to each node (in + out for directed graphs)"""
+        A = self.adjacency
+        if self.directed:
+            degree = np.asarray(A.sum(axis=1)).ravel() + np.asarray(A.sum(axis=0)).ravel()
+        else:
+            degree = np.asarray(A.sum(axis=1)).ravel() + A.diagonal()
+        return degree.astype(np.int64)
+
+    @property
+    def strength(self):
+        """Summed weight of the (out) edges of each node"""
+        return np.asarray(self.W.sum(axis=1), dtype=np.float64).ravel()
+
+    def density(self):
+        n = len(self)
+        if n <= 1:
+            return 0
+        density = float(self.number_of_edges()) / (n * (n - 1))
+        return density if self.directed else 2 * density
+
+    def connected_components(self):
+        """Return the number of (weakly) connected components and the component label of each node"""
+        from scipy.sparse.csgraph import connected_components
+        return connected_components(self.adjacency, directed=self.directed, connection='weak')
+
+    def is_connected(self):
+        return len(self) > 0 and self.connected_components()[0] == 1
+
+    def shortest_paths(self, weighted=False):
+        """Return the all-pairs shortest path distance matrix (inf between disconnected nodes)
+
+        If weighted is True, edge weights are used as path lengths. Otherwise, every edge has length 1."""
+        from scipy.sparse.csgraph import shortest_path
+        if weighted is True:
+            return shortest_path(self.W, directed=self.directed)
+        return shortest_path(self.adjacency, directed=self.directed, unweighted=True)
+
+    def minimum_spanning_tree(self, distance=None):
+        """
+        Minimum spanning tree (a forest, if the graph is disconnected) of an undirected graph.
+
+        Parameters
+        ----------
+        distance : NxN np.ndarray
+            optional length of each edge, e.g. an inverse of the weights. If None, the weights are used.
+
+        Returns
+        -------
+        T : ArrayGraph
+            tree whose edges carry their weights in W.
+        """
+        from scipy import sparse
+        from scipy.sparse.csgraph import minimum_spanning_tree
+        if self.directed:
+            raise ValueError('Minimum spanning tree is only defined for undirected graphs')
+        n = len(self)
+        A = sparse.triu(sparse.csr_matrix(self.adjacency), k=1).tocoo()
+        if distance is None:
+            distance = self.W
+        if sparse.issparse(distance):
+            lengths = np.asarray(sparse.csr_matrix(distance)[A.row, A.col]).ravel()
+        else:
+            lengths = np.asarray(distance)[A.row, A.col]
+        # The tree depends only on the ordering of the lengths, so rank them to keep zero and negative lengths
+        ranks = np.empty(len(lengths))
+        ranks[np.argsort(lengths, kind='mergesort')] = np.arange(1, len(lengths) + 1)
+        T = minimum_spanning_tree(sparse.csr_matrix((ranks, (A.row, A.col)), shape=(n, n))).tocoo()
+        if self.is_sparse:
+            weights = np.asarray(self.W[T.row, T.col]).ravel()
+        else:
+            weights = self.W[T.row, T.col]
+        tree = sparse.csr_matrix((weights, (T.row, T.col)), shape=(n, n))
+        return ArrayGraph(tree + tree.T, nodes=self.nodes)
+
+    def subgraph(self, keep):
+        """Return the subgraph induced by the nodes selected by keep (a boolean mask or an array of indices)"""
+        keep = np.asarray(keep)
+        ix = np.where(keep)[0] if keep.dtype == bool else keep
+        if self.is_sparse:
+            W = self.W[ix][:, ix]
+        else:
+            W = self.W[np.ix_(ix, ix)]
+        return ArrayGraph(W, directed=self.directed, nodes=[self.nodes[i] for i in ix])
+
+    def to_array(self):
+        """Return a dense copy of the weight matrix"""
+        return self.W.toarray() if self.is_sparse else np.array(self.W)
+
+    def to_csr(self):
+        from scipy import sparse
+        return sparse.csr_matrix(self.W)
+
+    def info(self):
+        """Summary lines, as printed by networkx.info"""
+        n = len(self)
+        lines = ["%s%s" % ('Number of nodes: ', n), "%s%s" % ('Number of edges: ', self.number_of_edges())]
+        if n > 0:
+            if self.directed:
+                lines.append("%s%8.4f" % ('Average in degree: ', float(self.number_of_edges()) / n))
+                lines.append("%s%8.4f" % ('Average out degree: ', float(self.number_of_edges()) / n))
+            else:
+                lines.append("%s%8.4f" % ('Average degree: ', float(np.sum(self.degree)) / n))
+        return lines
+
+    def to_networkx(self):
+        """Return the equivalent networkx graph, with edge weights in the 'weight' attribute"""
+        import networkx as nx
+        create_using = nx.DiGraph if self.directed else nx.Graph
+        if self.is_sparse:
+            G = nx.from_scipy_sparse_array(self.W, create_using=create_using)
+        else:
+            G = nx.from_numpy_array(self.W, create_using=create_using)
+        if self.nodes != list(range(len(self))):
+            G = nx.relabel_nodes(G, dict(enumerate(self.nodes)))
+        return G
+
+    @classmethod
+    def from_networkx(cls, G, weight='weight'):
+        """Return the ArrayGraph (CSR-backed) of a networkx graph"""
+        import networkx as nx
+        nodes = list(G.nodes())
+        return cls(nx.to_scipy_sparse_array(G, nodelist=nodes, weight=weight), directed=G.is_directed(),
+                   nodes=nodes)
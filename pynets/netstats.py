@@ -9,13 +9,112 @@ import os
 import numpy as np
 import networkx as nx
 import warnings
+from collections import OrderedDict
 warnings.simplefilter("ignore")
 
 
 def average_shortest_path_length_for_all(G):
-    import math
-    subgraphs = [sbg for sbg in nx.connected_component_subgraphs(G) if len(sbg) > 1]
-    return math.fsum(nx.average_shortest_path_length(sg) for sg in subgraphs) / len(subgraphs)
+    """Return the mean of the average shortest path lengths of all non-trivial connected components of G
+
+    Parameters
+    ----------
+    G : NetworkX graph or NxN np.ndarray
+
+    Returns
+    -------
+    average_shortest_path_length : float
+    """
+    from scipy.sparse.csgraph import connected_components
+    if isinstance(G, nx.Graph):
+        W = nx.to_numpy_array(G)
+    else:
+        W = np.asarray(G)
+    D = all_pairs_distances(W)
+    _, labels = connected_components(W, directed=False)
+    return component_path_length(D, labels)
+
+
+def component_path_length(D, labels):
+    """Return the mean over connected components (with >1 node) of each component's average shortest path length
+
+    Parameters
+    ----------
+    D : NxN np.ndarray
+        shortest path distance matrix, with np.inf for unreachable node pairs.
+    labels : Nx1 np.ndarray
+        connected component label of each node.
+
+    Returns
+    -------
+    average_shortest_path_length : float
+    """
+    D_fin = np.where(np.isfinite(D), D, 0)
+    comp_sums = np.bincount(labels, weights=np.sum(D_fin, axis=1))
+    comp_sizes = np.bincount(labels)
+    nontrivial = comp_sizes > 1
+    if not np.any(nontrivial):
+        raise ValueError('Graph has no connected components with more than one node')
+    sizes = comp_sizes[nontrivial]
+    return float(np.mean(comp_sums[nontrivial] / (sizes * (sizes - 1))))
+
+
+def all_pairs_distances(W, weighted=False, directed=False):
+    """Return the all-pairs shortest path distance matrix of an adjacency array
+
+    Parameters
+    ----------
+    W : NxN np.ndarray or scipy.sparse matrix
+        adjacency matrix. Nonzero entries are edges.
+    weighted : bool
+        If True, entries of W are treated as edge lengths and Dijkstra's
+        algorithm is used. Otherwise, distances are hop counts.
+    directed : bool
+        If True, W is treated as a directed adjacency matrix.
+
+    Returns
+    -------
+    D : NxN np.ndarray
+        shortest path distances, with np.inf for unreachable node pairs.
+
+    Notes
+    -----
+    All sources are solved in a single call to compiled code
+    (scipy.sparse.csgraph), rather than one networkx traversal per node.
+    """
+    from scipy.sparse.csgraph import shortest_path
+    if weighted is True:
+        return shortest_path(W, method='D', directed=directed)
+    else:
+        return shortest_path(W, method='D', directed=directed, unweighted=True)
+
+
+def path_length_and_efficiency(D):
+    """Return the characteristic path length and global efficiency from a distance matrix
+
+    Parameters
+    ----------
+    D : NxN np.ndarray
+        shortest path distance matrix, as returned by all_pairs_distances.
+
+    Returns
+    -------
+    L : float
+        mean distance over all reachable (off-diagonal) node pairs.
+    E : float
+        global efficiency, i.e. the mean inverse distance over all node pairs,
+        where unreachable pairs contribute zero.
+    """
+    N = len(D)
+    if N < 2:
+        return np.nan, 0
+    reachable = np.isfinite(D)
+    np.fill_diagonal(reachable, False)
+    d = D[reachable]
+    if len(d) == 0:
+        return np.nan, 0
+    L = np.mean(d)
+    E = np.sum(1 / d) / (N * (N - 1))
+    return L, E
 
 
 def global_efficiency(G, weight=None):
@@ -23,7 +122,11 @@ def global_efficiency(G, weight=None):
 
     Parameters
     ----------
-    G : NetworkX graph
+    G : NetworkX graph or NxN np.ndarray
+        if an array is passed, it is used directly as the adjacency matrix.
+    weight : str
+        edge attribute to use as distance. If G is an array, any value other
+        than None treats the entries of G as edge lengths.
 
     Returns
     -------
@@ -54,29 +157,120 @@ def global_efficiency(G, weight=None):
        in weighted networks. Eur Phys J B 32, 249-263.
 
     """
-    N = len(G)
-    if N < 2:
+    if isinstance(G, nx.Graph):
+        directed = G.is_directed()
+        W = nx.to_numpy_array(G, weight=weight)
+    else:
+        directed = False
+        W = np.asarray(G)
+
+    if len(W) < 2:
         return 0
 
-    inv_lengths = []
-    for node in G:
-        if weight is None:
-            lengths = nx.single_source_shortest_path_length(G, node)
-        else:
-            lengths = nx.single_source_dijkstra_path_length(G, node, weight=weight)
+    D = all_pairs_distances(W, weighted=weight is not None, directed=directed)
+    _, E = path_length_and_efficiency(D)
+    return E
+
+
+def _local_efficiency_nodes(W, nodes, weighted=False, directed=False, batch_size=256):
+    """Return the local efficiency of each of the given nodes of adjacency array W
+
+    Neighborhood submatrices are gathered with index arrays and stacked into
+    block-diagonal sparse matrices of up to ~batch_size rows, so that all
+    neighborhoods in a batch are solved in a single shortest path call.
+    """
+    from scipy.sparse import block_diag
+    from scipy.sparse.csgraph import shortest_path
+    if directed is True:
+        A = W != 0
+    else:
+        A = np.logical_or(W != 0, W.T != 0)
+    np.fill_diagonal(A, False)
+    if weighted is not True:
+        W = A.astype(np.float64)
+
+    nbrs = [np.flatnonzero(A[i]) for i in nodes]
+    eff = np.zeros(len(nodes))
+    todo = [j for j in range(len(nodes)) if len(nbrs[j]) > 1]
+
+    def solve(batch):
+        blocks = [W[np.ix_(nbrs[j], nbrs[j])] for j in batch]
+        M = block_diag(blocks, format='csr')
+        # Explicit zeros in sparse input would be treated as edges
+        M.eliminate_zeros()
+        with np.errstate(divide='ignore'):
+            inv = 1 / shortest_path(M, method='D', directed=directed, unweighted=weighted is not True)
+        inv[~np.isfinite(inv)] = 0
+        offset = 0
+        for j in batch:
+            k = len(nbrs[j])
+            eff[j] = np.sum(inv[offset:offset + k, offset:offset + k]) / (k * (k - 1))
+            offset += k
+
+    batch = []
+    size = 0
+    for j in todo:
+        if batch and size + len(nbrs[j]) > batch_size:
+            solve(batch)
+            batch = []
+            size = 0
+        batch.append(j)
+        size += len(nbrs[j])
+    if batch:
+        solve(batch)
+    return eff
+
+
+def _local_efficiency_chunk(args):
+    return _local_efficiency_nodes(*args)
+
+
+def local_efficiency_vector(W, weighted=False, directed=False, n_jobs=1):
+    """Return the local efficiency of every node of an adjacency array
+
+    Parameters
+    ----------
+    W : NxN np.ndarray
+        adjacency matrix. Nonzero entries are edges.
+    weighted : bool
+        If True, entries of W are treated as edge lengths. Otherwise,
+        distances within each neighborhood are hop counts.
+    directed : bool
+        If True, W is treated as a directed adjacency matrix.
+    n_jobs : int
+        number of processes across which nodes are split. default value=1.
 
-        inv = [1/x for x in lengths.values() if x is not 0]
-        inv_lengths.extend(inv)
+    Returns
+    -------
+    local_efficiency : Nx1 np.ndarray
+    """
+    W = np.asarray(W, dtype=np.float64)
+    n = len(W)
+    if n_jobs is None or int(n_jobs) < 2 or n < 2:
+        return _local_efficiency_nodes(W, np.arange(n), weighted, directed)
 
-    return sum(inv_lengths)/(N*(N-1))
+    import multiprocessing
+    chunks = [c for c in np.array_split(np.arange(n), int(n_jobs)) if len(c) > 0]
+    pool = multiprocessing.Pool(len(chunks))
+    try:
+        results = pool.map(_local_efficiency_chunk, [(W, c, weighted, directed) for c in chunks])
+    finally:
+        pool.close()
+        pool.join()
+    return np.concatenate(results)
 
 
-def local_efficiency(G, weight=None):
+def local_efficiency(G, weight=None, n_jobs=1):
     """Return the local efficiency of each node in the graph G
 
     Parameters
     ----------
-    G : NetworkX graph
+    G : NetworkX graph or NxN np.ndarray
+    weight : str
+        edge attribute to use as distance. If G is an array, any value other
+        than None treats the entries of G as edge lengths.
+    n_jobs : int
+        number of processes across which nodes are split. default value=1.
 
     Returns
     -------
@@ -103,35 +297,30 @@ def local_efficiency(G, weight=None):
        in weighted networks. Eur Phys J B 32, 249-263.
 
     """
-    if G.is_directed():
-        new_graph = nx.DiGraph
+    if isinstance(G, nx.Graph):
+        nodes = list(G.nodes())
+        directed = G.is_directed()
+        W = nx.to_numpy_array(G, nodelist=nodes, weight=weight)
     else:
-        new_graph = nx.Graph
+        W = np.asarray(G)
+        nodes = list(range(len(W)))
+        directed = False
 
-    efficiencies = dict()
-    for node in G:
-        temp_G = new_graph()
-        temp_G.add_nodes_from(G.neighbors(node))
-        for neighbor in G.neighbors(node):
-            for (n1, n2) in G.edges(neighbor):
-                if (n1 in temp_G) and (n2 in temp_G):
-                    temp_G.add_edge(n1, n2)
+    eff = local_efficiency_vector(W, weighted=weight is not None, directed=directed, n_jobs=n_jobs)
+    return dict(zip(nodes, eff))
 
-        if weight is not None:
-            for (n1, n2) in temp_G.edges():
-                temp_G[n1][n2][weight] = G[n1][n2][weight]
 
-        efficiencies[node] = global_efficiency(temp_G, weight)
-
-    return efficiencies
-
-
-def average_local_efficiency(G, weight=None):
+def average_local_efficiency(G, weight=None, efficiencies=None):
     """Return the average local efficiency of all of the nodes in the graph G
 
     Parameters
     ----------
-    G : NetworkX graph
+    G : NetworkX graph or NxN np.ndarray
+    weight : str
+        edge attribute to use as distance.
+    efficiencies : dict
+        precomputed output of local_efficiency for G. If provided, local
+        efficiency is not recomputed.
 
     Returns
     -------
@@ -155,15 +344,137 @@ def average_local_efficiency(G, weight=None):
        in weighted networks. Eur Phys J B 32, 249-263.
 
     """
-    eff = local_efficiency(G, weight)
-    total = sum(eff.values())
-    N = len(eff)
+    if efficiencies is None:
+        efficiencies = local_efficiency(G, weight)
+    total = sum(efficiencies.values())
+    N = len(efficiencies)
     return total/N
 
-def create_random_graph(G, n, p):
-    rG = nx.erdos_renyi_graph(n, p, seed=42)
+# Below this density, clustering and transitivity use sparse matrix products
+sparse_clustering_density = 0.1
+
+
+def _triangle_weights(C, sparse):
+    """Return the diagonal of C^3 for a symmetric matrix C (or a stack of them), i.e. the (weighted) number of
+    closed walks of length 3 through each node"""
+    if sparse is True:
+        from scipy import sparse as sp
+        C = sp.csr_matrix(C)
+        return np.asarray(C.dot(C).multiply(C).sum(axis=1)).ravel()
+    return np.sum(np.matmul(C, C) * C, axis=-1)
+
+
+def _as_symmetric(W, weighted):
+    """Return W (NxN or SxNxN, dense or scipy.sparse) with a zero diagonal, binarized unless weighted"""
+    from scipy import sparse as sp
+    if sp.issparse(W):
+        W = sp.csr_matrix(W, dtype=np.float64, copy=True)
+        W.setdiag(0)
+        W.eliminate_zeros()
+        if weighted is False:
+            W.data[:] = 1
+        return W
+    W = np.array(W, dtype=np.float64)
+    n = W.shape[-1]
+    W[..., np.arange(n), np.arange(n)] = 0
+    if weighted is False:
+        W = (W != 0).astype(np.float64)
+    return W
+
+
+def clustering_vector(W, weighted=False, sparse=None):
+    """
+    Local clustering coefficient of each node of an undirected graph, computed with matrix products rather than by
+    triangle enumeration.
+
+    The weighted coefficient is that of Onnela et al. (2005), i.e. diag(C^3) / (k(k-1)), where C is the element-wise
+    cube root of W normalized by its maximum edge weight and k is the degree. It matches
+    networkx.clustering(G, weight='weight').
+
+    Parameters
+    ----------
+    W : NxN or SxNxN np.ndarray, or scipy.sparse matrix
+        symmetric adjacency matrix, or a stack of S adjacency matrices of the same size.
+    weighted : bool
+        If True, compute the Onnela weighted clustering coefficient. Otherwise, W is binarized. default value=False.
+    sparse : bool | None
+        If True, use sparse matrix products (only for a single graph). If None, they are used for scipy.sparse input
+        and for dense graphs with density < sparse_clustering_density.
+
+    Returns
+    -------
+    clustering : Nx1 or SxN np.ndarray
+        clustering coefficient of each node (0 for nodes with degree < 2).
+
+    References
+    ----------
+    .. [1] Onnela, J. P., Saramaki, J., Kertesz, J., & Kaski, K. (2005).
+       Intensity and coherence of motifs in weighted complex networks.
+       Physical Review E, 71(6), 065103.
+    """
+    from scipy import sparse as sp
+    from pynets.utils import cuberoot
+    W = _as_symmetric(W, weighted)
+    if sp.issparse(W):
+        k = np.diff(W.indptr)
+        sparse = True
+    else:
+        k = np.sum(W != 0, axis=-1)
+        if sparse is None:
+            n = W.shape[-1]
+            sparse = W.ndim == 2 and n > 1 and np.sum(k) / (n * (n - 1.0)) < sparse_clustering_density
+    if weighted is True:
+        if sp.issparse(W):
+            if W.nnz > 0:
+                W.data = cuberoot(W.data / np.max(W.data))
+        else:
+            max_weight = np.max(W, axis=(-2, -1), keepdims=True)
+            max_weight[max_weight == 0] = 1
+            W = cuberoot(W / max_weight)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        clustering = _triangle_weights(W, sparse) / (k * (k - 1.0))
+    clustering[k < 2] = 0
+    return clustering
+
+
+def transitivity_vector(W, sparse=None):
+    """
+    Transitivity (global clustering coefficient) of an undirected graph, i.e. trace(A^3) / sum(k(k-1)), where A is the
+    binarized adjacency matrix and k is the degree.
+
+    Parameters
+    ----------
+    W : NxN or SxNxN np.ndarray, or scipy.sparse matrix
+        adjacency matrix, or a stack of S adjacency matrices of the same size.
+    sparse : bool | None
+        see clustering_vector.
+
+    Returns
+    -------
+    transitivity : float or Sx1 np.ndarray
+        transitivity of each graph (0 for graphs without connected triples).
+    """
+    from scipy import sparse as sp
+    A = _as_symmetric(W, False)
+    if sp.issparse(A):
+        k = np.diff(A.indptr)
+        sparse = True
+    else:
+        k = np.sum(A, axis=-1)
+        if sparse is None:
+            n = A.shape[-1]
+            sparse = A.ndim == 2 and n > 1 and np.sum(k) / (n * (n - 1.0)) < sparse_clustering_density
+    triangles = np.sum(_triangle_weights(A, sparse), axis=-1)
+    triads = np.sum(k * (k - 1.0), axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(triads > 0, triangles / triads, 0.0)[()]
+
+
+def create_random_graph(G, n, p, seed=42):
+    rG = nx.erdos_renyi_graph(n, p, seed=seed)
     return rG
 
+
 def smallworldness_measure(G, rG):
     C_g = nx.algorithms.average_clustering(G)
     C_r = nx.algorithms.average_clustering(rG)
@@ -179,32 +490,381 @@ def smallworldness_measure(G, rG):
     return swm
 
 
-def smallworldness(G, rep=1000):
+def _random_adjacency(n, m, model, seed):
+    """Return the binary adjacency array of one seeded null-model graph with n nodes and (on average) m edges"""
+    rs = np.random.RandomState(seed)
+    iu = np.triu_indices(n, 1)
+    num_pairs = len(iu[0])
+    if model == 'gnp':
+        keep = rs.random_sample(num_pairs) < float(m) / num_pairs
+    elif model == 'gnm':
+        keep = np.zeros(num_pairs, dtype=bool)
+        keep[rs.choice(num_pairs, size=int(m), replace=False)] = True
+    else:
+        raise ValueError('Null model type unknown')
+    A = np.zeros((n, n))
+    A[iu[0][keep], iu[1][keep]] = 1
+    return A + A.T
+
+
+def _null_model_stats(args):
+    """Return the average clustering and average shortest path length of each seeded null-model graph"""
+    from scipy.sparse.csgraph import connected_components
+    n, m, model, seeds = args
+    C = np.zeros(len(seeds))
+    L = np.zeros(len(seeds))
+    for i, seed in enumerate(seeds):
+        A = _random_adjacency(n, m, model, seed)
+        C[i] = np.mean(clustering_vector(A))
+        D = all_pairs_distances(A)
+        n_comp, labels = connected_components(A, directed=False)
+        try:
+            L[i] = path_length_and_efficiency(D)[0] if n_comp == 1 else component_path_length(D, labels)
+        except ValueError:
+            L[i] = np.nan
+    return C, L
+
+
+def null_model_ensemble(n, m, rep=1000, model='gnp', seed=42, n_jobs=None, use_cache=True):
+    """Return clustering and path length statistics for an ensemble of random null-model graphs
+
+    Parameters
+    ----------
+    n : int
+        number of nodes.
+    m : int
+        number of edges.
+    rep : int
+        number of random graphs. default value=1000.
+    model : str
+        'gnp' (Erdos-Renyi with edge probability matching m) or 'gnm'
+        (exactly m edges). default value='gnp'.
+    seed : int
+        root seed from which one independent RNG stream per graph is spawned.
+    n_jobs : int | None
+        number of processes. If None, uses all but one available CPU.
+    use_cache : bool
+        If True, statistics are stored on disk keyed by (n, m, model, seed)
+        and reused (or extended) by subsequent calls.
+
+    Returns
+    -------
+    C : rep x 1 np.ndarray
+        average clustering coefficient of each random graph.
+    L : rep x 1 np.ndarray
+        average shortest path length of each random graph.
+    """
+    import multiprocessing
+    from pynets import utils
+    n = int(n)
+    m = int(m)
+    rep = int(rep)
+    C = np.zeros(0)
+    L = np.zeros(0)
+    cache_path = None
+    if use_cache is True:
+        cache_path = os.path.join(utils.get_cache_dir('null_models'), "%s%s%s%s%s%s%s%s%s" % ('null_', model, '_n', n, '_m', m, '_s', seed, '.npz'))
+        if os.path.isfile(cache_path):
+            try:
+                cached = np.load(cache_path)
+                C = cached['C']
+                L = cached['L']
+            except Exception:
+                # Unreadable cache, start cold
+                C = np.zeros(0)
+                L = np.zeros(0)
+        if len(C) >= rep:
+            return C[:rep], L[:rep]
+
+    # Graph i always draws from the i-th child stream, so a cached ensemble can be extended exactly
+    streams = np.random.SeedSequence(seed).spawn(rep)
+    seeds = [int(s.generate_state(1)[0]) for s in streams[len(C):]]
+    if n_jobs is None:
+        n_jobs = max(multiprocessing.cpu_count() - 1, 1)
+    if multiprocessing.current_process().daemon:
+        n_jobs = 1
+    chunks = [list(c) for c in np.array_split(seeds, min(int(n_jobs), len(seeds))) if len(c) > 0]
+    if len(chunks) > 1:
+        pool = multiprocessing.Pool(len(chunks))
+        try:
+            results = pool.map(_null_model_stats, [(n, m, model, c) for c in chunks])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_null_model_stats((n, m, model, c)) for c in chunks]
+
+    C = np.concatenate([C] + [r[0] for r in results])
+    L = np.concatenate([L] + [r[1] for r in results])
+    if cache_path is not None:
+        utils.atomic_write(cache_path, lambda f: np.savez(f, C=C, L=L))
+    return C, L
+
+
+def smallworldness(G, rep=1000, model='gnp', n_jobs=None, use_cache=True):
     print("%s%s%s" % ('Estimating smallworldness using ', rep, ' random graphs...'))
-    #import multiprocessing
     n = nx.number_of_nodes(G)
     m = nx.number_of_edges(G)
-    p = float(m) * 2 /(n*(n-1))
-    ss = []
-    for bb in range(rep):
-        rG = create_random_graph(G, n, p)
-        swm = smallworldness_measure(G, rG)
-        ss.append(swm)
-    #def small_iters(bb):
-    #    rG = create_random_graph(G, n, p)
-    #    swm = smallworldness_measure(G, rG)
-    #    return swm
-    #number_processes = int(multiprocessing.cpu_count()-1)
-    #pool = multiprocessing.Pool(number_processes)
-    #bb = range(rep)
-    #result = pool.map_async(small_iters, bb)
-    #pool.close()
-    #pool.join()
-    #ss = result.get()
+    graph_cache = GraphCache(nx.to_numpy_array(G), G)
+    C_g = np.mean(graph_cache.clustering)
+    L_g = graph_cache.average_shortest_path_length()
+    [C_r, L_r] = null_model_ensemble(n, m, rep=rep, model=model, n_jobs=n_jobs, use_cache=use_cache)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ss = (float(C_g) / C_r) / (float(L_g) / L_r)
     mean_s = np.mean(ss)
     return mean_s
 
 
+def eigenvector_centrality_vector(W, v0=None, weighted=False, tol=0):
+    """
+    Eigenvector centrality of each node of an undirected graph, i.e. the leading eigenvector of its adjacency matrix,
+    found with a sparse Lanczos solver (scipy.sparse.linalg.eigsh) and scaled to unit norm as in
+    networkx.eigenvector_centrality.
+
+    Parameters
+    ----------
+    W : NxN np.ndarray or scipy.sparse matrix
+        symmetric adjacency matrix.
+    v0 : Nx1 np.ndarray
+        optional starting vector, e.g. the eigenvector centrality of the previous threshold of a sweep or of the
+        previous bootstrap of the same graph, from which the solver converges in a few iterations.
+    weighted : bool
+        If True, edge weights are used. Otherwise, W is binarized (as in networkx by default). default value=False.
+    tol : float
+        relative accuracy of the eigenvector. default value=0 (machine precision).
+
+    Returns
+    -------
+    x : Nx1 np.ndarray
+        eigenvector centrality of each node.
+    """
+    from scipy import sparse
+    from scipy.sparse.linalg import eigsh, ArpackNoConvergence
+    A = sparse.csr_matrix(_as_symmetric(W, weighted), dtype=np.float64)
+    n = A.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    if A.nnz == 0:
+        return np.full(n, 1 / np.sqrt(n))
+    if v0 is not None:
+        v0 = np.asarray(v0, dtype=np.float64)
+        if v0.shape != (n,) or not np.all(np.isfinite(v0)) or not np.any(v0):
+            v0 = None
+    x = None
+    if n > 2:
+        try:
+            x = eigsh(A, k=1, which='LA', v0=v0, tol=tol)[1][:, 0]
+        except ArpackNoConvergence:
+            pass
+    if x is None:
+        x = np.linalg.eigh(A.toarray())[1][:, -1]
+    if np.sum(x) < 0:
+        x = -x
+    return x / np.linalg.norm(x)
+
+
+# Number of sampled sources of approximate communicability betweenness
+communicability_sources = 64
+
+
+def communicability_betweenness(W, n_sources=None, seed=42):
+    """
+    Communicability betweenness centrality of each node (Estrada et al., 2009), computed on the binarized graph and
+    normalized as in networkx.
+
+    For each node r, the communicability exp(A) between every pair of other nodes is compared with the communicability
+    exp(A_r) once r is removed. If n_sources is given, only the columns of exp(A) and exp(A_r) for n_sources randomly
+    sampled source nodes are computed (with scipy's expm_multiply rather than a full expm). The centrality of each
+    node is then the mean of its per-source contributions scaled to all N - 1 sources, and its standard error follows
+    from the sample variance of those contributions (with a finite population correction).
+
+    Parameters
+    ----------
+    W : NxN np.ndarray
+        adjacency matrix.
+    n_sources : int
+        number of sampled source nodes. If None (or >= N), all sources are used and the result is exact.
+    seed : int
+        random seed of the sampled sources.
+
+    Returns
+    -------
+    cbc : Nx1 np.ndarray
+        communicability betweenness centrality of each node.
+    stderr : Nx1 np.ndarray
+        standard error of cbc (zero when exact).
+    """
+    from scipy.linalg import expm
+    from scipy.sparse.linalg import expm_multiply
+    from scipy import sparse
+    A = (np.asarray(W) != 0).astype(np.float64)
+    n = len(A)
+    exact = n_sources is None or n_sources >= n
+    if exact:
+        sources = np.arange(n)
+        expA = expm(A)
+    else:
+        sources = np.sort(np.random.RandomState(seed).choice(n, int(n_sources), replace=False))
+        A = sparse.csr_matrix(A)
+        E = np.eye(n)[:, sources]
+        expA = expm_multiply(A, E)
+    k = len(sources)
+
+    cbc = np.zeros(n)
+    stderr = np.zeros(n)
+    for r in range(n):
+        if exact:
+            row = A[r, :].copy()
+            col = A[:, r].copy()
+            A[r, :] = 0
+            A[:, r] = 0
+            expA_r = expm(A)
+            A[r, :] = row
+            A[:, r] = col
+        else:
+            mask = np.ones(n)
+            mask[r] = 0
+            D = sparse.diags(mask)
+            expA_r = expm_multiply((D @ A @ D).tocsr(), E)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            B = (expA - expA_r) / expA
+        # Exclude walks starting or ending at r, and pairs of a node with itself
+        B[r, :] = 0
+        B[sources, np.arange(k)] = 0
+        contributions = np.nansum(B, axis=0)[sources != r]
+        n_valid = len(contributions)
+        if exact:
+            cbc[r] = np.sum(contributions)
+        elif n_valid > 0:
+            cbc[r] = np.mean(contributions) * (n - 1)
+            if n_valid > 1:
+                stderr[r] = (n - 1) * np.sqrt(np.var(contributions, ddof=1) / n_valid *
+                                              (1 - float(n_valid) / (n - 1)))
+    if n > 2:
+        scale = 1.0 / ((n - 1.0) ** 2 - (n - 1.0))
+        cbc = cbc * scale
+        stderr = stderr * scale
+    return cbc, stderr
+
+
+def number_of_cliques(G, max_cliques=None):
+    """
+    Number of maximal cliques of G.
+
+    If max_cliques is given, enumeration stops after max_cliques cliques, in which case the result is a lower bound.
+    """
+    from itertools import islice
+    cliques = nx.find_cliques(G)
+    if max_cliques is not None:
+        cliques = islice(cliques, int(max_cliques))
+    return sum(1 for _ in cliques)
+
+
+def threshold_sweep_metrics(conn_matrix, thresholds):
+    """
+    Compute incrementally updated graph metrics for every proportional threshold of a matrix in one pass.
+
+    Proportionally thresholded graphs (see thresholding.threshold_proportional) are nested, so the edges are sorted
+    by weight once and added in decreasing weight order, walking the thresholds in increasing density. Connected
+    components (union-find), degrees, strengths and triangle counts are updated per added edge, and the metrics are
+    recorded whenever the edge count of a threshold is reached. Eigenvector centrality is solved at each recorded
+    threshold, starting from the eigenvector of the previous one.
+
+    Parameters
+    ----------
+    conn_matrix : NxN np.ndarray
+        symmetric unthresholded connectivity matrix.
+    thresholds : list
+        proportional thresholds in [0, 1].
+
+    Returns
+    -------
+    sweep : OrderedDict
+        metric name -> array with one entry (or row of N nodal values) per threshold, in the order of thresholds.
+        Contains thresholds, edge_count, density, number_of_components, giant_component_size, transitivity,
+        average_clustering, degree, strength, triangles, clustering and eigenvector_centrality.
+    """
+    from pynets.thresholding import ThresholdSweep
+    W = np.array(conn_matrix, dtype=np.float64)
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=np.float64))
+    if not np.allclose(W, W.T):
+        raise ValueError('Threshold sweeps require a symmetric connectivity matrix')
+    n = len(W)
+
+    # Rank edges once, in the same order as threshold_proportional
+    ranking = ThresholdSweep(W)
+    edge_counts = np.array([ranking.edge_count(p) for p in thresholds])
+    rows = ranking.rows
+    cols = ranking.cols
+    weights = ranking.weights
+
+    T = len(thresholds)
+    sweep = OrderedDict()
+    sweep['thresholds'] = thresholds
+    sweep['edge_count'] = edge_counts
+    for name in ['density', 'number_of_components', 'giant_component_size', 'transitivity', 'average_clustering']:
+        sweep[name] = np.zeros(T)
+    for name in ['degree', 'strength', 'triangles', 'clustering', 'eigenvector_centrality']:
+        sweep[name] = np.zeros((T, n))
+
+    A = np.zeros((n, n), dtype=bool)
+    degree = np.zeros(n)
+    strength = np.zeros(n)
+    triangles = np.zeros(n)
+    parent = np.arange(n)
+    size = np.ones(n, dtype=np.int64)
+    n_components = n
+    giant = 1 if n > 0 else 0
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    m = 0
+    x = None
+    for t in np.argsort(edge_counts, kind='mergesort'):
+        while m < edge_counts[t]:
+            u = rows[m]
+            v = cols[m]
+            common = np.flatnonzero(A[u] & A[v])
+            triangles[common] += 1
+            triangles[u] += len(common)
+            triangles[v] += len(common)
+            A[u, v] = A[v, u] = True
+            degree[u] += 1
+            degree[v] += 1
+            strength[u] += weights[m]
+            strength[v] += weights[m]
+            ru = find(u)
+            rv = find(v)
+            if ru != rv:
+                if size[ru] < size[rv]:
+                    ru, rv = rv, ru
+                parent[rv] = ru
+                size[ru] += size[rv]
+                giant = max(giant, size[ru])
+                n_components -= 1
+            m += 1
+
+        triads = degree * (degree - 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            clustering = np.where(triads > 0, 2 * triangles / triads, 0)
+        sweep['density'][t] = 2.0 * m / (n * (n - 1)) if n > 1 else 0
+        sweep['number_of_components'][t] = n_components
+        sweep['giant_component_size'][t] = giant
+        sweep['transitivity'][t] = 2 * np.sum(triangles) / np.sum(triads) if np.sum(triads) > 0 else 0
+        sweep['average_clustering'][t] = np.mean(clustering) if n > 0 else 0
+        sweep['degree'][t] = degree
+        sweep['strength'][t] = strength
+        sweep['triangles'][t] = triangles
+        sweep['clustering'][t] = clustering
+        x = eigenvector_centrality_vector(A, v0=x)
+        sweep['eigenvector_centrality'][t] = x
+    return sweep
+
+
 def create_communities(node_comm_aff_mat, node_num):
     com_assign = np.zeros((node_num,1))
     for i in range(len(node_comm_aff_mat)):
@@ -215,30 +875,314 @@ def create_communities(node_comm_aff_mat, node_num):
     return com_assign
 
 
+def _rich_club_from_edges(degree, u, v):
+    """Return the rich club coefficient at each degree k from a degree vector and the end nodes of each edge"""
+    degree = np.asarray(degree, dtype=np.int64)
+    n = len(degree)
+    # Number of nodes with degree > k, for each k with more than one such node
+    nk = n - np.cumsum(np.bincount(degree, minlength=1))
+    nk = nk[nk > 1]
+    # Number of edges whose end nodes both have degree > k
+    edge_min = np.minimum(degree[u], degree[v])
+    ek = len(u) - np.cumsum(np.bincount(edge_min, minlength=len(nk)))[:len(nk)]
+    return 2.0 * ek / (nk * (nk - 1.0))
+
+
+def rich_club_vector(W):
+    """
+    Unnormalized rich club coefficient of an undirected graph, computed from its degree vector and edge arrays.
+
+    Parameters
+    ----------
+    W : NxN np.ndarray
+        adjacency matrix. Nonzero entries are edges.
+
+    Returns
+    -------
+    rc : Kx1 np.ndarray
+        rich club coefficient for each degree k, for all k with more than one node of degree > k.
+    """
+    A = np.asarray(W) != 0
+    A = np.logical_or(A, A.T)
+    np.fill_diagonal(A, False)
+    u, v = np.where(np.triu(A, 1))
+    return _rich_club_from_edges(np.sum(A, axis=1), u, v)
+
+
+def _double_edge_swaps(u, v, n, nswap, rng, max_tries=None):
+    """
+    Rewire an undirected simple graph with degree-preserving double edge swaps (Maslov & Sneppen, 2002).
+
+    Swaps are proposed in batches of disjoint edge pairs and all valid swaps of a batch (those creating neither
+    self-loops nor multi-edges) are applied at once.
+    """
+    u = np.array(u, dtype=np.int64)
+    v = np.array(v, dtype=np.int64)
+    m = len(u)
+    if m < 2:
+        return u, v
+    if max_tries is None:
+        max_tries = 10 * nswap
+    A = np.zeros((n, n), dtype=bool)
+    A[u, v] = True
+    A[v, u] = True
+    batch = max(m // 2, 1)
+    swaps = 0
+    tries = 0
+    while swaps < nswap and tries < max_tries:
+        i = rng.randint(0, m, batch)
+        j = rng.randint(0, m, batch)
+        tries += batch
+        # Use each edge in at most one swap of the batch
+        keep = i != j
+        i = i[keep]
+        j = j[keep]
+        used = np.concatenate([i, j])
+        first = np.zeros(m, dtype=np.int64) - 1
+        first[used[::-1]] = np.arange(len(used))[::-1] % len(i)
+        keep = (first[i] == np.arange(len(i))) & (first[j] == np.arange(len(i)))
+        i = i[keep]
+        j = j[keep]
+        a, b = u[i], v[i]
+        flip = rng.rand(len(j)) < 0.5
+        c = np.where(flip, v[j], u[j])
+        d = np.where(flip, u[j], v[j])
+        # New edges (a, d) and (c, b) must not be self-loops or already exist
+        valid = (a != d) & (c != b) & ~A[a, d] & ~A[c, b]
+        # ...nor be created twice within the batch
+        keys = np.concatenate([np.minimum(a, d) * n + np.maximum(a, d), np.minimum(c, b) * n + np.maximum(c, b)])
+        keys[np.concatenate([~valid, ~valid])] = -1 - np.arange(2 * len(valid))[np.concatenate([~valid, ~valid])]
+        _, first_key, counts = np.unique(keys, return_index=True, return_counts=True)
+        dup = np.zeros(len(keys), dtype=bool)
+        dup[np.setdiff1d(np.arange(len(keys)), first_key[counts == 1])] = True
+        valid &= ~dup[:len(valid)] & ~dup[len(valid):]
+        if swaps + np.sum(valid) > nswap:
+            valid &= np.cumsum(valid) <= nswap - swaps
+        i, j, a, b, c, d = i[valid], j[valid], a[valid], b[valid], c[valid], d[valid]
+        A[a, b] = A[b, a] = A[c, d] = A[d, c] = False
+        A[a, d] = A[d, a] = A[c, b] = A[b, c] = True
+        u[i], v[i] = a, d
+        u[j], v[j] = c, b
+        swaps += len(i)
+    if swaps < nswap:
+        print("%s%s%s%s%s" % ('WARNING: only ', swaps, ' of ', nswap, ' edge swaps succeeded...'))
+    return u, v
+
+
+def _rich_club_null_chunk(args):
+    """Return the rich club coefficients of degree-preserving random graphs, one row per seed"""
+    degree, Q, seeds = args
+    n = len(degree)
+    # Start every null graph from the canonical realization of the degree sequence
+    H = nx.havel_hakimi_graph(degree)
+    edges = np.array(H.edges(), dtype=np.int64).reshape(-1, 2)
+    rc = []
+    for seed in seeds:
+        rng = np.random.RandomState(seed)
+        [u, v] = _double_edge_swaps(edges[:, 0], edges[:, 1], n, int(Q * len(edges)), rng)
+        rc.append(_rich_club_from_edges(degree, u, v))
+    return np.array(rc)
+
+
+def rich_club_null_ensemble(degree, rep=10, Q=100, seed=42, n_jobs=None, use_cache=True):
+    """
+    Rich club coefficients of an ensemble of degree-preserving random graphs.
+
+    Parameters
+    ----------
+    degree : Nx1 np.ndarray
+        degree sequence.
+    rep : int
+        number of random graphs. default value=10.
+    Q : int
+        number of double edge swaps per edge. default value=100.
+    seed : int
+        root seed from which one independent RNG stream per graph is spawned.
+    n_jobs : int | None
+        number of processes. If None, uses all but one available CPU.
+    use_cache : bool
+        If True, the ensemble is stored on disk keyed by the sorted degree sequence (and Q and seed), and reused (or
+        extended) by any graph with the same degree sequence.
+
+    Returns
+    -------
+    rc_rand : rep x K np.ndarray
+        rich club coefficients of each random graph.
+    """
+    import hashlib
+    import multiprocessing
+    from pynets import utils
+    degree = np.sort(np.asarray(degree, dtype=np.int64))[::-1]
+    rep = int(rep)
+    K = len(_rich_club_from_edges(degree, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)))
+    rc_rand = np.zeros((0, K))
+    cache_path = None
+    if use_cache is True:
+        key = hashlib.sha1(degree.tobytes() + ("%s_%s" % (Q, seed)).encode()).hexdigest()
+        cache_path = os.path.join(utils.get_cache_dir('rich_club'), "%s%s%s" % ('rc_null_', key, '.npz'))
+        if os.path.isfile(cache_path):
+            try:
+                rc_rand = np.load(cache_path)['rc_rand']
+            except Exception:
+                # Unreadable cache, start cold
+                rc_rand = np.zeros((0, K))
+        if len(rc_rand) >= rep:
+            return rc_rand[:rep]
+
+    # Graph i always draws from the i-th child stream, so a cached ensemble can be extended exactly
+    streams = np.random.SeedSequence(seed).spawn(rep)
+    seeds = [int(s.generate_state(1)[0]) for s in streams[len(rc_rand):]]
+    if n_jobs is None:
+        n_jobs = max(multiprocessing.cpu_count() - 1, 1)
+    if multiprocessing.current_process().daemon:
+        n_jobs = 1
+    chunks = [list(c) for c in np.array_split(seeds, min(int(n_jobs), len(seeds))) if len(c) > 0]
+    if len(chunks) > 1:
+        pool = multiprocessing.Pool(len(chunks))
+        try:
+            results = pool.map(_rich_club_null_chunk, [(degree, Q, c) for c in chunks])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_rich_club_null_chunk((degree, Q, c)) for c in chunks]
+
+    rc_rand = np.vstack([rc_rand] + [r.reshape(-1, K) for r in results])
+    if cache_path is not None:
+        utils.atomic_write(cache_path, lambda f: np.savez(f, rc_rand=rc_rand))
+    return rc_rand
+
+
+def rich_club_coefficient(G, normalized=True, Q=100, rep=10, seed=42, n_jobs=None, use_cache=True):
+    """
+    Rich club coefficient of an undirected graph, optionally normalized by the mean rich club coefficient of an
+    ensemble of degree-preserving random graphs (see rich_club_null_ensemble).
+
+    Parameters
+    ----------
+    G : NetworkX graph or NxN np.ndarray
+    normalized : bool
+        If True, normalize by the random graph ensemble. default value=True.
+    Q, rep, seed, n_jobs, use_cache :
+        see rich_club_null_ensemble.
+
+    Returns
+    -------
+    rc : dict
+        rich club coefficient keyed by degree. Degrees at which every random graph has an empty rich club are NaN.
+    """
+    if isinstance(G, np.ndarray):
+        W = G
+    else:
+        W = nx.to_numpy_array(G)
+    rc = rich_club_vector(W)
+    if normalized is True:
+        A = np.logical_or(W != 0, W.T != 0)
+        np.fill_diagonal(A, False)
+        rc_rand = rich_club_null_ensemble(np.sum(A, axis=1), rep=rep, Q=Q, seed=seed, n_jobs=n_jobs,
+                                          use_cache=use_cache)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rc = rc / np.mean(rc_rand, axis=0)
+        rc[~np.isfinite(rc)] = np.nan
+    return dict(zip(range(len(rc)), rc))
+
+
 def _compute_rc(G):
-    from networkx.utils import accumulate
-    deghist = nx.degree_histogram(G)
-    total = sum(deghist)
-    # Compute the number of nodes with degree greater than `k`, for each
-    # degree `k` (omitting the last entry, which is zero).
-    nks = (total - cs for cs in accumulate(deghist) if total - cs > 1)
-    # Create a sorted list of pairs of edge endpoint degrees.
-    # The list is sorted in reverse order so that we can pop from the
-    # right side of the list later, instead of popping from the left
-    # side of the list, which would have a linear time cost.
-    edge_degrees = sorted((sorted(map(G.degree, e)) for e in G.edges()), reverse=True)
-    ek = G.number_of_edges()
-    k1, k2 = edge_degrees.pop()
-    rc = {}
-    for d, nk in enumerate(nks):
-        while k1 <= d:
-            if len(edge_degrees) == 0:
-                ek = 0
-                break
-            k1, k2 = edge_degrees.pop()
-            ek -= 1
-        rc[d] = 2 * ek / (nk * (nk - 1))
-    return rc
+    return rich_club_coefficient(G, normalized=False)
+
+
+def module_strength(W, ci):
+    """
+    Node-to-module strength matrix, i.e. the summed weight of the connections of each node to each module, computed as
+    the product of W with a sparse NxK community indicator matrix.
+
+    Parameters
+    ----------
+    W : NxN np.ndarray or scipy.sparse matrix
+        connection matrix.
+    ci : Nx1 np.ndarray
+        community affiliation vector.
+
+    Returns
+    -------
+    Snm : NxK np.ndarray
+        strength of each node's connections to each of the K modules.
+    ci : Nx1 np.ndarray
+        community affiliation vector relabelled to 0..K-1, indexing the columns of Snm.
+    """
+    from scipy import sparse
+    _, ci = np.unique(ci, return_inverse=True)
+    n = len(ci)
+    M = sparse.csr_matrix((np.ones(n), (np.arange(n), ci)), shape=(n, np.max(ci) + 1 if n > 0 else 0))
+    # (M^T W^T)^T is dense for dense W, without densifying the indicator matrix
+    Snm = M.T.dot(W.T).T
+    if sparse.issparse(Snm):
+        Snm = Snm.toarray()
+    return np.asarray(Snm, dtype=np.float64), ci
+
+
+def community_connectivity(W, ci, degree='undirected'):
+    """
+    Participation coefficient, positive and negative diversity coefficients and within-module degree z-score of each
+    node, all derived from the node-to-module strength matrices of the positive and negative weights of W (see
+    module_strength), so that memory stays O(NK).
+
+    Parameters
+    ----------
+    W : NxN np.ndarray or scipy.sparse matrix
+        binary/weighted directed/undirected connection matrix, with positive and negative weights.
+    ci : Nx1 np.ndarray
+        community affiliation vector.
+    degree : str
+        'undirected', 'in' (uses the in-degree) or 'out' (uses the out-degree).
+
+    Returns
+    -------
+    stats : OrderedDict
+        Nx1 np.ndarrays 'participation', 'diversity_pos', 'diversity_neg' and 'within_module_zscore', matching
+        participation_coef, diversity_coef_sign and the BCT module_degree_zscore, respectively.
+    """
+    from scipy import sparse
+    if degree == 'in':
+        W = W.T
+    if sparse.issparse(W):
+        W = sparse.csr_matrix(W, dtype=np.float64)
+        W_pos = W.multiply(W > 0)
+        W_neg = -W.multiply(W < 0)
+    else:
+        W = np.asarray(W, dtype=np.float64)
+        W_pos = np.maximum(W, 0)
+        W_neg = np.maximum(-W, 0)
+    [Snm_pos, ci] = module_strength(W_pos, ci)
+    Snm_neg = module_strength(W_neg, ci)[0]
+    Snm = Snm_pos - Snm_neg
+    n = len(ci)
+    m = Snm.shape[1]
+
+    stats = OrderedDict()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Participation coefficient, P=0 for nodes with no (out) neighbors
+        Ko = np.sum(Snm, axis=1)
+        P = 1 - np.sum(np.square(Snm), axis=1) / np.square(Ko)
+        P[Ko == 0] = 0
+        stats['participation'] = P
+
+        # Shannon-entropy based diversity coefficients
+        for sign, S_sign in [('pos', Snm_pos), ('neg', Snm_neg)]:
+            pnm = S_sign / np.sum(S_sign, axis=1)[:, np.newaxis]
+            pnm[np.isnan(pnm)] = 0
+            pnm[pnm == 0] = 1
+            stats['diversity_' + sign] = -np.sum(pnm * np.log(pnm), axis=1) / np.log(m)
+
+        # Within-module degree z-score, 0 where a module's within-module degrees do not vary
+        Koi = Snm[np.arange(n), ci]
+        count = np.bincount(ci, minlength=m)
+        mean = np.bincount(ci, weights=Koi, minlength=m) / count
+        std = np.sqrt(np.bincount(ci, weights=np.square(Koi - mean[ci]), minlength=m) / count)
+        Z = (Koi - mean[ci]) / std[ci]
+        Z[np.isnan(Z)] = 0
+        stats['within_module_zscore'] = Z
+    return stats
 
 
 def participation_coef(W, ci, degree='undirected'):
@@ -261,23 +1205,7 @@ def participation_coef(W, ci, degree='undirected'):
     P : Nx1 np.ndarray
         participation coefficient
     '''
-    if degree == 'in':
-        W = W.T
-
-    _, ci = np.unique(ci, return_inverse=True)
-    ci += 1
-    n = len(W)  # number of vertices
-    Ko = np.sum(W, axis=1)  # (out) degree
-    Gc = np.dot((W != 0), np.diag(ci))  # neighbor community affiliation
-    Kc2 = np.zeros((n,))  # community-specific neighbors
-    for i in range(1, int(np.max(ci)) + 1):
-        Kc2 += np.square(np.sum(W * (Gc == i), axis=1))
-
-    P = np.ones((n,)) - Kc2 / np.square(Ko)
-    # P=0 if for nodes with no (out) neighbors
-    P[np.where(np.logical_not(Ko))] = 0
-
-    return P
+    return community_connectivity(W, ci, degree=degree)['participation']
 
 
 def modularity(W, qtype='sta', seed=42):
@@ -398,30 +1326,88 @@ def diversity_coef_sign(W, ci):
     Hneg : Nx1 np.ndarray
         diversity coefficient based on negative connections
     '''
-    # Number of nodes
-    n = len(W)
-    _, ci = np.unique(ci, return_inverse=True)
-    ci += 1
-    # Number of modules
-    m = np.max(ci)
-    def entropy(w_):
-        # Strength
-        S = np.sum(w_, axis=1)
-        # Node-to-module degree
-        Snm = np.zeros((n, m))
-        for i in range(m):
-            Snm[:, i] = np.sum(w_[:, ci == i + 1], axis=1)
-        pnm = Snm / (np.tile(S, (m, 1)).T)
-        pnm[np.isnan(pnm)] = 0
-        pnm[np.logical_not(pnm)] = 1
-        return -np.sum(pnm * np.log(pnm), axis=1) / np.log(m)
-
-    # Explicitly ignore compiler warning for division by zero
-    with np.errstate(invalid='ignore'):
-        Hpos = entropy(W * (W > 0))
-        Hneg = entropy(-W * (W < 0))
-
-    return Hpos, Hneg
+    stats = community_connectivity(W, ci)
+    return stats['diversity_pos'], stats['diversity_neg']
+
+
+def _link_similarity(W, Ln, Ji, Jo):
+    """Return the sparse similarity of all pairs of links that share a node
+
+    Parameters
+    ----------
+    W : NxN np.ndarray
+        weight matrix.
+    Ln : mx2 np.ndarray
+        end nodes of each link.
+    Ji, Jo : NxN np.ndarray
+        weighted in/out jaccard similarity of node pairs.
+
+    Returns
+    -------
+    ES : mxm scipy.sparse.coo_matrix
+        link similarity, nonzero only for links that share a node.
+    """
+    from scipy import sparse
+    m = len(Ln)
+    # One entry per (node, incident link, other end node) triple, grouped by node
+    nodes = np.concatenate([Ln[:, 0], Ln[:, 1]])
+    links = np.tile(np.arange(m), 2)
+    others = np.concatenate([Ln[:, 1], Ln[:, 0]])
+    order = np.argsort(nodes, kind='mergesort')
+    nodes = nodes[order]
+    links = links[order]
+    others = others[order]
+    counts = np.bincount(nodes, minlength=len(W))
+    starts = np.cumsum(counts) - counts
+
+    # Pair every incident link of each node with every other incident link of the same node
+    group_sizes = counts[nodes]
+    i_idx = np.repeat(np.arange(len(nodes)), group_sizes)
+    offsets = np.arange(len(i_idx)) - np.repeat(np.cumsum(group_sizes) - group_sizes, group_sizes)
+    j_idx = starts[nodes[i_idx]] + offsets
+    keep = links[i_idx] != links[j_idx]
+    i_idx = i_idx[keep]
+    j_idx = j_idx[keep]
+
+    a = nodes[i_idx]
+    b = others[i_idx]
+    c = others[j_idx]
+    es = (W[a, b] * W[a, c] * Ji[b, c] + W[b, a] * W[c, a] * Jo[b, c]) / 2
+    return sparse.coo_matrix((es, (links[i_idx], links[j_idx])), shape=(m, m))
+
+
+def _link_merges(ES, type_clustering):
+    """Return the (link, link, similarity) merges of the link dendrogram, in order of decreasing similarity"""
+    from scipy import sparse
+    m = ES.shape[0]
+    if type_clustering == 'single':
+        # Single-linkage merges are exactly the edges of the maximum spanning tree of the similarity graph
+        from scipy.sparse.csgraph import minimum_spanning_tree
+        ES = sparse.triu(ES, 1).tocoo()
+        pos = ES.data > 0
+        offset = np.max(ES.data[pos]) + 1 if np.any(pos) else 1
+        dist = sparse.coo_matrix((offset - ES.data[pos], (ES.row[pos], ES.col[pos])), shape=(m, m))
+        T = minimum_spanning_tree(dist).tocoo()
+        sims = offset - T.data
+        order = np.argsort(-sims, kind='mergesort')
+        return T.row[order], T.col[order], sims[order]
+    else:
+        from scipy.cluster.hierarchy import linkage
+        from scipy.spatial.distance import squareform
+        S = ES.toarray()
+        S = np.maximum(S, S.T)
+        dist = np.max(S) - S
+        np.fill_diagonal(dist, 0)
+        Z = linkage(squareform(dist, checks=False), method='complete')
+        # Represent each merged cluster by one of its links
+        rep = np.concatenate([np.arange(m), np.zeros(len(Z), dtype=np.int64)])
+        rows = np.zeros(len(Z), dtype=np.int64)
+        cols = np.zeros(len(Z), dtype=np.int64)
+        for k, (x, y, _, _) in enumerate(Z):
+            rows[k] = rep[int(x)]
+            cols[k] = rep[int(y)]
+            rep[m + k] = rows[k]
+        return rows, cols, np.max(S) - Z[:, 2]
 
 
 def link_communities(W, type_clustering='single'):
@@ -445,6 +1431,13 @@ def link_communities(W, type_clustering='single'):
     -------
     M : CxN np.ndarray
         nodal community affiliation matrix.
+    Notes
+    -----
+    Jaccard similarities are computed with matrix products, and link
+    similarity only over pairs of links that share a node (as a sparse
+    matrix). Single-linkage clustering is read off the maximum spanning tree
+    of the link similarity graph, with merges of equal similarity forming one
+    level of the hierarchy.
     '''
     n = len(W)
     W = normalize(W)
@@ -461,149 +1454,88 @@ def link_communities(W, type_clustering='single'):
     Ni = np.sum(W**2, axis=0)
 
     # Weighted in/out jaccard
-    Jo = np.zeros((n, n))
-    Ji = np.zeros((n, n))
-
-    for b in range(n):
-        for c in range(n):
-            Do = np.dot(W[b, :], W[c, :].T)
-            Jo[b, c] = Do / (No[b] + No[c] - Do)
-
-            Di = np.dot(W[:, b].T, W[:, c])
-            Ji[b, c] = Di / (Ni[b] + Ni[c] - Di)
+    Do = np.dot(W, W.T)
+    Di = np.dot(W.T, W)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Jo = Do / (No[:, np.newaxis] + No[np.newaxis, :] - Do)
+        Ji = Di / (Ni[:, np.newaxis] + Ni[np.newaxis, :] - Di)
 
     # Get link similarity
     A, B = np.where(np.logical_and(np.logical_or(W, W.T), np.triu(np.ones((n, n)), 1)))
     m = len(A)
     # Link nodes
-    Ln = np.zeros((m, 2), dtype=np.int32)
+    Ln = np.column_stack((A, B)).astype(np.int32)
     # Link weights
-    Lw = np.zeros((m,))
-
-    for i in range(m):
-        Ln[i, :] = (A[i], B[i])
-        Lw[i] = (W[A[i], B[i]] + W[B[i], A[i]]) / 2
-
-    # Link similarity
-    ES = np.zeros((m, m), dtype=np.float32)
-    for i in range(m):
-        for j in range(m):
-            if Ln[i, 0] == Ln[j, 0]:
-                a = Ln[i, 0]
-                b = Ln[i, 1]
-                c = Ln[j, 1]
-            elif Ln[i, 0] == Ln[j, 1]:
-                a = Ln[i, 0]
-                b = Ln[i, 1]
-                c = Ln[j, 0]
-            elif Ln[i, 1] == Ln[j, 0]:
-                a = Ln[i, 1]
-                b = Ln[i, 0]
-                c = Ln[j, 1]
-            elif Ln[i, 1] == Ln[j, 1]:
-                a = Ln[i, 1]
-                b = Ln[i, 0]
-                c = Ln[j, 0]
-            else:
-                continue
-
-            ES[i, j] = (W[a, b] * W[a, c] * Ji[b, c] + W[b, a] * W[c, a] * Jo[b, c]) / 2
-
-    np.fill_diagonal(ES, 0)
-    # Perform hierarchical clustering
-    # Community affiliation matrix
-    C = np.zeros((m, m), dtype=np.int32)
-    Nc = C.copy()
-    Mc = np.zeros((m, m), dtype=np.float32)
-    # Community nodes, links, density
-    Dc = Mc.copy()
-    # Initial community assignments
-    U = np.arange(m)
-    C[0, :] = np.arange(m)
-
-    for i in range(m - 1):
-        print('Hierarchy %i' % i)
-        #time1 = time.time()
-        # Loop over communities
-        for j in range(len(U)):
-            # Get link indices
-            ixes = C[i, :] == U[j]
-            links = np.sort(Lw[ixes])
-            #nodes = np.sort(Ln[ixes,:].flat)
-            nodes = np.sort(np.reshape(
-                Ln[ixes, :], 2 * np.size(np.where(ixes))))
-            # Get unique nodes
-            nodulo = np.append(nodes[0], (nodes[1:])[nodes[1:] != nodes[:-1]])
-            #nodulo = ((nodes[1:])[nodes[1:] != nodes[:-1]])
-            nc = len(nodulo)
-            #nc = len(nodulo)+1
-            mc = np.sum(links)
-            # Minimal weight
-            min_mc = np.sum(links[:nc - 1])
-            # Community density
+    Lw = (W[A, B] + W[B, A]) / 2
+
+    ES = _link_similarity(W, Ln, Ji, Jo)
+    [rows, cols, sims] = _link_merges(ES, type_clustering)
+
+    # Perform hierarchical clustering, tracking each community's nodes and sorted link weights
+    parent = np.arange(m)
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    comm_nodes = [set(l) for l in Ln.tolist()]
+    comm_links = [np.array([w]) for w in Lw]
+
+    def partition_density(c):
+        nc = len(comm_nodes[c])
+        links = comm_links[c]
+        mc = np.sum(links)
+        # Minimal weight
+        min_mc = np.sum(links[:nc - 1])
+        with np.errstate(divide='ignore', invalid='ignore'):
             dc = (mc - min_mc) / (nc * (nc - 1) / 2 - min_mc)
-            if np.array(dc).shape is not ():
-                print(dc)
-                print(dc.shape)
-            Nc[i, j] = nc
-            Mc[i, j] = mc
-            Dc[i, j] = dc if not np.isnan(dc) else 0
-        #time2 = time.time()
-        #print('compute densities time', time2-time1)
-        # Copy current partition
-        C[i + 1, :] = C[i, :]
-        #if i in (2693,):
-        #    import pdb
-        #    pdb.set_trace()
-        u1, u2 = np.where(ES[np.ix_(U, U)] == np.max(ES[np.ix_(U, U)]))
-        if np.size(u1) > 2:
-            wehr, = np.where((u1 == u2[0]))
-            uc = np.squeeze((u1[0], u2[0]))
-            ud = np.squeeze((u1[wehr], u2[wehr]))
-            u1 = uc
-            u2 = ud
-
-        #time25 = time.time()
-        #print('copy and max time', time25-time2)
-        #ugl = np.array((u1,u2))
-        ugl = np.sort((u1, u2), axis=1)
-        ug_rows = ugl[np.argsort(ugl, axis=0)[:, 0]]
-        # implementation of matlab unique(A, 'rows')
-        unq_rows = np.vstack({tuple(row) for row in ug_rows})
-        V = U[unq_rows]
-        #time3 = time.time()
-        #print('sortrows time', time3-time25)
-
-        for j in range(len(V)):
-            if type_clustering == 'single':
-                x = np.max(ES[V[j, :], :], axis=0)
-            elif type_clustering == 'complete':
-                x = np.min(ES[V[j, :], :], axis=0)
-            # Assign distances to whole clusters
-#            import pdb
-#            pdb.set_trace()
-            ES[V[j, :], :] = np.array((x, x))
-            ES[:, V[j, :]] = np.transpose((x, x))
-            # clear diagonal
-            ES[V[j, 0], V[j, 0]] = 0
-            ES[V[j, 1], V[j, 1]] = 0
-            # merge communities
-            C[i + 1, C[i + 1, :] == V[j, 1]] = V[j, 0]
-            V[V == V[j, 1]] = V[j, 0]
-
-        #time4 = time.time()
-        #print('get linkages time', time4-time3)
-        U = np.unique(C[i + 1, :])
-        if len(U) == 1:
+        return (dc if not np.isnan(dc) else 0) * mc
+
+    score = np.sum([partition_density(c) for c in range(m)])
+    best_score = score
+    best_k = 0
+    n_comms = m
+    k = 0
+    while k < len(sims):
+        # Merge all pairs of communities at the current (maximal) similarity as one level
+        level = sims[k]
+        while k < len(sims) and sims[k] == level:
+            r1 = find(rows[k])
+            r2 = find(cols[k])
+            k += 1
+            if r1 == r2:
+                continue
+            keep, drop = min(r1, r2), max(r1, r2)
+            score -= partition_density(keep) + partition_density(drop)
+            comm_nodes[keep] |= comm_nodes[drop]
+            comm_links[keep] = np.sort(np.concatenate((comm_links[keep], comm_links[drop])), kind='mergesort')
+            comm_nodes[drop] = None
+            comm_links[drop] = None
+            parent[drop] = keep
+            n_comms -= 1
+            score += partition_density(keep)
+        # The fully merged hierarchy is never selected
+        if n_comms == 1:
             break
-        #time5 = time.time()
-        #print('get unique communities time', time5-time4)
-    #Dc[ np.where(np.isnan(Dc)) ]=0
-    i = np.argmax(np.sum(Dc * Mc, axis=1))
-    U = np.unique(C[i, :])
+        if score > best_score:
+            best_score = score
+            best_k = k
+
+    # Replay the merges up to the level of maximal partition density
+    parent = np.arange(m)
+    for x, y in zip(rows[:best_k], cols[:best_k]):
+        r1 = find(x)
+        r2 = find(y)
+        parent[max(r1, r2)] = min(r1, r2)
+    C = np.array([find(x) for x in range(m)])
+    U, comm = np.unique(C, return_inverse=True)
     M = np.zeros((len(U), n))
-    for j in range(len(U)):
-        M[j, np.unique(Ln[C[i, :] == U[j], :])] = 1
+    M[comm, Ln[:, 0]] = 1
+    M[comm, Ln[:, 1]] = 1
 
     M = M[np.sum(M, axis=1) > 2, :]
     return M
@@ -625,7 +1557,7 @@ def modularity_louvain_und_sign(W, gamma=1, qtype='sta', seed=42):
     modularity_louvain_und().
     Parameters
     ----------
-    W : NxN np.ndarray
+    W : NxN np.ndarray or scipy.sparse matrix
         undirected weighted/binary connection matrix with positive and
         negative weights
     qtype : str
@@ -646,15 +1578,23 @@ def modularity_louvain_und_sign(W, gamma=1, qtype='sta', seed=42):
     -----
     Ci and Q may vary from run to run, due to heuristics in the
     algorithm. Consequently, it may be worth to compare multiple runs.
+    Weights are held in CSR form throughout. Node-to-module degrees are
+    gathered from each node's row on demand rather than kept as dense NxN
+    copies, and each coarse-grained level is built as a single sparse
+    indicator product (M.T * W * M).
     '''
+    from scipy import sparse
     np.random.seed(seed)
 
-    n = len(W)  # number of nodes
+    W = sparse.csr_matrix(W, dtype=np.float64)
+    n = W.shape[0]  # number of nodes
 
-    W0 = W * (W > 0)  # positive weights matrix
-    W1 = -W * (W < 0)  # negative weights matrix
-    s0 = np.sum(W0)  # weight of positive links
-    s1 = np.sum(W1)  # weight of negative links
+    W0 = W.multiply(W > 0).tocsr()  # positive weights matrix
+    W1 = -W.multiply(W < 0).tocsr()  # negative weights matrix
+    W0.eliminate_zeros()
+    W1.eliminate_zeros()
+    s0 = W0.sum()  # weight of positive links
+    s1 = W1.sum()  # weight of negative links
 
     if qtype == 'smp':
         d0 = 1 / s0
@@ -688,12 +1628,12 @@ def modularity_louvain_und_sign(W, gamma=1, qtype='sta', seed=42):
     while q[h] - q[h - 1] > 1e-10:
         if h > 300:
             raise ValueError('Modularity Infinite Loop')
-        kn0 = np.sum(W0, axis=0)  # positive node degree
-        kn1 = np.sum(W1, axis=0)  # negative node degree
+        kn0 = np.asarray(W0.sum(axis=0)).ravel()  # positive node degree
+        kn1 = np.asarray(W1.sum(axis=0)).ravel()  # negative node degree
         km0 = kn0.copy()  # positive module degree
         km1 = kn1.copy()  # negative module degree
-        knm0 = W0.copy()  # positive node-to-module degree
-        knm1 = W1.copy()  # negative node-to-module degree
+        diag0 = W0.diagonal()
+        diag1 = W1.diagonal()
 
         m = np.arange(nh) + 1  # initial module assignments
         flag = True  # flag for within hierarchy search
@@ -706,9 +1646,14 @@ def modularity_louvain_und_sign(W, gamma=1, qtype='sta', seed=42):
             # loop over nodes in random order
             for u in np.random.permutation(nh):
                 ma = m[u] - 1
-                dQ0 = ((knm0[u, :] + W0[u, u] - knm0[u, ma]) -
+                # positive/negative node-to-module degrees, gathered from row u
+                row0 = slice(W0.indptr[u], W0.indptr[u + 1])
+                row1 = slice(W1.indptr[u], W1.indptr[u + 1])
+                knm0_u = np.bincount(m[W0.indices[row0]] - 1, weights=W0.data[row0], minlength=nh)
+                knm1_u = np.bincount(m[W1.indices[row1]] - 1, weights=W1.data[row1], minlength=nh)
+                dQ0 = ((knm0_u + diag0[u] - knm0_u[ma]) -
                        gamma * kn0[u] * (km0 + kn0[u] - km0[ma]) / s0)  # positive dQ
-                dQ1 = ((knm1[u, :] + W1[u, u] - knm1[u, ma]) -
+                dQ1 = ((knm1_u + diag1[u] - knm1_u[ma]) -
                        gamma * kn1[u] * (km1 + kn1[u] - km1[ma]) / s1)  # negative dQ
 
                 dQ = d0 * dQ0 - d1 * dQ1  # rescaled changes in modularity
@@ -719,12 +1664,6 @@ def modularity_louvain_und_sign(W, gamma=1, qtype='sta', seed=42):
                     flag = True
                     mb = np.argmax(dQ)
 
-                    # change positive node-to-module degrees
-                    knm0[:, mb] += W0[:, u]
-                    knm0[:, ma] -= W0[:, u]
-                    # change negative node-to-module degrees
-                    knm1[:, mb] += W1[:, u]
-                    knm1[:, ma] -= W1[:, u]
                     km0[mb] += kn0[u]  # change positive module degrees
                     km0[ma] -= kn0[u]
                     km1[mb] += kn1[u]  # change negative module degrees
@@ -733,31 +1672,21 @@ def modularity_louvain_und_sign(W, gamma=1, qtype='sta', seed=42):
                     m[u] = mb + 1  # reassign module
 
         h += 1
-        ci.append(np.zeros((n,)))
         _, m = np.unique(m, return_inverse=True)
         m += 1
-
-        for u in range(nh):  # loop through initial module assignments
-            ci[h][np.where(ci[h - 1] == u + 1)] = m[u]  # assign new modules
+        # assign new modules through the previous level's assignments
+        ci.append(m[ci[h - 1].astype(int) - 1])
 
         nh = np.max(m)  # number of new nodes
-        wn0 = np.zeros((nh, nh))  # new positive weights matrix
-        wn1 = np.zeros((nh, nh))
-
-        for u in range(nh):
-            for v in range(u, nh):
-                wn0[u, v] = np.sum(W0[np.ix_(m == u + 1, m == v + 1)])
-                wn1[u, v] = np.sum(W1[np.ix_(m == u + 1, m == v + 1)])
-                wn0[v, u] = wn0[u, v]
-                wn1[v, u] = wn1[u, v]
-
-        W0 = wn0
-        W1 = wn1
+        # module indicator matrix, so that each coarse-grained weight matrix is M.T * W * M
+        M = sparse.csr_matrix((np.ones(len(m)), (np.arange(len(m)), m - 1)), shape=(len(m), nh))
+        W0 = (M.T * W0 * M).tocsr()  # new positive weights matrix
+        W1 = (M.T * W1 * M).tocsr()  # new negative weights matrix
 
         q.append(0)
         # compute modularity
-        q0 = np.trace(W0) - np.sum(np.dot(W0, W0)) / s0
-        q1 = np.trace(W1) - np.sum(np.dot(W1, W1)) / s1
+        q0 = W0.diagonal().sum() - np.dot(np.asarray(W0.sum(axis=0)).ravel(), np.asarray(W0.sum(axis=1)).ravel()) / s0
+        q1 = W1.diagonal().sum() - np.dot(np.asarray(W1.sum(axis=0)).ravel(), np.asarray(W1.sum(axis=1)).ravel()) / s1
         q[h] = d0 * q0 - d1 * q1
 
     _, ci_ret = np.unique(ci[-1], return_inverse=True)
@@ -766,119 +1695,1071 @@ def modularity_louvain_und_sign(W, gamma=1, qtype='sta', seed=42):
     return ci_ret, q[-1]
 
 
+def signed_modularity(W, ci, qtype='sta'):
+    '''
+    Modularity of a given community partition of a signed network, as
+    evaluated by modularity_louvain_und_sign at each level of its hierarchy.
+    Parameters
+    ----------
+    W : NxN np.ndarray or scipy.sparse matrix
+        undirected weighted/binary connection matrix with positive and
+        negative weights
+    ci : Nx1 np.ndarray
+        community affiliation vector
+    qtype : str
+        modularity type. Can be 'sta' (default), 'pos', 'smp', 'gja', 'neg'.
+    Returns
+    -------
+    Q : float
+        modularity of the partition
+    '''
+    from scipy import sparse
+    W = sparse.csr_matrix(W, dtype=np.float64)
+    W0 = W.multiply(W > 0).tocsr()
+    W1 = -W.multiply(W < 0).tocsr()
+    s0 = W0.sum()
+    s1 = W1.sum()
+    if qtype == 'smp':
+        d0 = 1 / s0
+        d1 = 1 / s1
+    elif qtype == 'gja':
+        d0 = 1 / (s0 + s1)
+        d1 = d0
+    elif qtype == 'sta':
+        d0 = 1 / s0
+        d1 = 1 / (s0 + s1)
+    elif qtype == 'pos':
+        d0 = 1 / s0
+        d1 = 0
+    elif qtype == 'neg':
+        d0 = 0
+        d1 = 1 / s1
+    else:
+        raise KeyError('Modularity type unknown')
+    if not s0:
+        s0 = 1
+        d0 = 0
+    if not s1:
+        s1 = 1
+        d1 = 0
+
+    _, m = np.unique(ci, return_inverse=True)
+    M = sparse.csr_matrix((np.ones(len(m)), (np.arange(len(m)), m)), shape=(len(m), np.max(m) + 1))
+    W0 = M.T * W0 * M
+    W1 = M.T * W1 * M
+    q0 = W0.diagonal().sum() - np.dot(np.asarray(W0.sum(axis=0)).ravel(), np.asarray(W0.sum(axis=1)).ravel()) / s0
+    q1 = W1.diagonal().sum() - np.dot(np.asarray(W1.sum(axis=0)).ravel(), np.asarray(W1.sum(axis=1)).ravel()) / s1
+    return d0 * q0 - d1 * q1
+
+
+def _louvain_seeds(args):
+    """Return the Louvain partition and Q for each of the given seeds"""
+    W, gamma, qtype, seeds = args
+    cis = []
+    qs = []
+    for seed in seeds:
+        [ci, q] = modularity_louvain_und_sign(W, gamma=gamma, qtype=qtype, seed=int(seed))
+        cis.append(ci)
+        qs.append(q)
+    return np.array(cis), np.array(qs)
+
+
+def _run_louvain_seeds(W, gamma, qtype, seeds, n_jobs):
+    import multiprocessing
+    if multiprocessing.current_process().daemon:
+        n_jobs = 1
+    chunks = [c for c in np.array_split(np.asarray(seeds), max(min(int(n_jobs), len(seeds)), 1)) if len(c) > 0]
+    if len(chunks) > 1:
+        pool = multiprocessing.Pool(len(chunks))
+        try:
+            results = pool.map(_louvain_seeds, [(W, gamma, qtype, c) for c in chunks])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_louvain_seeds((W, gamma, qtype, c)) for c in chunks]
+    return np.vstack([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def agreement_matrix(cis):
+    '''
+    Fraction of partitions in which each pair of nodes is assigned to the same
+    community, computed as a single sparse indicator product.
+    Parameters
+    ----------
+    cis : SxN np.ndarray
+        community affiliation vectors of S partitions
+    Returns
+    -------
+    D : NxN np.ndarray
+        agreement matrix, with zero diagonal
+    '''
+    from scipy import sparse
+    cis = np.atleast_2d(cis)
+    S, n = cis.shape
+    # Offset each partition's labels so that all partitions share one indicator matrix
+    labels = np.vstack([np.unique(ci, return_inverse=True)[1] for ci in cis])
+    offsets = np.concatenate([[0], np.cumsum(np.max(labels, axis=1) + 1)[:-1]])
+    cols = (labels + offsets[:, np.newaxis]).ravel()
+    rows = np.tile(np.arange(n), S)
+    H = sparse.csr_matrix((np.ones(len(cols)), (rows, cols)), shape=(n, int(np.max(cols)) + 1))
+    D = (H * H.T).toarray() / S
+    np.fill_diagonal(D, 0)
+    return D
+
+
+def consensus_louvain(W, gamma=1, qtype='sta', n_seeds=100, tau=0.5, seed=42, max_iter=10, n_jobs=None,
+                      use_cache=True):
+    '''
+    Consensus community partition across many Louvain runs with independent
+    seeds (Lancichinetti & Fortunato, 2012). Runs are spread across a process
+    pool. Their agreement matrix is thresholded at tau and re-clustered until
+    all runs agree.
+    Parameters
+    ----------
+    W : NxN np.ndarray
+        undirected weighted/binary connection matrix with positive and
+        negative weights
+    gamma : float
+        resolution parameter. default value=1.
+    qtype : str
+        modularity type. Can be 'sta' (default), 'pos', 'smp', 'gja', 'neg'.
+    n_seeds : int
+        number of Louvain runs per consensus iteration. default value=100.
+    tau : float
+        agreement threshold in [0, 1]. default value=0.5.
+    seed : int
+        seed from which the per-run seeds are drawn.
+    max_iter : int
+        maximum number of consensus iterations.
+    n_jobs : int | None
+        number of processes. If None, uses all but one available CPU.
+    use_cache : bool
+        If True, the result is stored on disk keyed by the (max-normalized)
+        matrix and parameters, so that stats and plotting of the same graph
+        share one partition.
+    Returns
+    -------
+    ci : Nx1 np.ndarray
+        consensus community affiliation vector
+    q_stats : dict
+        'modularity' (Q of the consensus partition on W), and the mean,
+        standard deviation and maximum of Q across the initial runs.
+    '''
+    import hashlib
+    import multiprocessing
+    from pynets import utils
+    W = np.asarray(W, dtype=np.float64)
+
+    cache_path = None
+    if use_cache is True:
+        # Key on the scale-free matrix, since Louvain partitions are invariant to positive rescaling
+        W_key = np.around(W / np.max(np.abs(W)), decimals=5) if np.any(W) else W
+        key = hashlib.sha1(np.ascontiguousarray(W_key).tobytes())
+        key.update(("%s_%.10g_%s_%s_%.10g_%s_%s" % (W.shape[0], float(gamma), qtype, n_seeds, float(tau), seed,
+                                                     max_iter)).encode('utf-8'))
+        cache_path = os.path.join(utils.get_cache_dir('communities'), "%s%s%s" % ('consensus_', key.hexdigest(), '.npz'))
+        if os.path.isfile(cache_path):
+            try:
+                cached = np.load(cache_path)
+                return cached['ci'], dict(zip([str(k) for k in cached['q_keys']], cached['q_vals']))
+            except Exception:
+                # Unreadable cache, recompute the partition
+                pass
+
+    if n_jobs is None:
+        n_jobs = max(multiprocessing.cpu_count() - 1, 1)
+    rs = np.random.RandomState(seed)
+    seeds = rs.randint(0, 2**31 - 1, size=int(n_seeds))
+    [cis, qs] = _run_louvain_seeds(W, gamma, qtype, seeds, n_jobs)
+    q_stats = {'modularity_mean': float(np.mean(qs)), 'modularity_std': float(np.std(qs)),
+               'modularity_max': float(np.max(qs))}
+
+    it = 0
+    D_prev = None
+    while not np.all(cis == cis[0]) and it < max_iter:
+        D = agreement_matrix(cis)
+        D[D < tau] = 0
+        # Stop once the thresholded agreement no longer changes between iterations
+        if not np.any(D) or (D_prev is not None and np.allclose(D, D_prev)):
+            break
+        D_prev = D
+        # Re-cluster the agreement matrix at unit resolution
+        seeds = rs.randint(0, 2**31 - 1, size=int(n_seeds))
+        [cis, _] = _run_louvain_seeds(D, 1, 'pos', seeds, n_jobs)
+        it += 1
+
+    if np.all(cis == cis[0]):
+        ci = cis[0]
+    else:
+        # No full agreement: take the communities of the thresholded agreement graph
+        from scipy.sparse.csgraph import connected_components
+        D = agreement_matrix(cis)
+        D[D < tau] = 0
+        ci = connected_components(D, directed=False)[1] + 1
+    _, ci = np.unique(ci, return_inverse=True)
+    ci += 1
+    q_stats['modularity'] = float(signed_modularity(W, ci, qtype=qtype))
+
+    if cache_path is not None:
+        q_keys = sorted(q_stats.keys())
+        utils.atomic_write(cache_path, lambda f: np.savez(f, ci=ci, q_keys=np.array(q_keys),
+                                                          q_vals=np.array([q_stats[k] for k in q_keys])))
+    return ci, q_stats
+
+
+def consensus_communities(in_mat, n_seeds):
+    '''
+    Consensus partition (see consensus_louvain) of a conditioned (see
+    thresholding.condition_matrix), unpruned connectivity matrix, at a
+    resolution equal to its density. extractnetstats and plotting.plot_all
+    both partition a graph here, from the same matrix, so that they share
+    one cached partition; pruned nodes are dropped from it afterwards (see
+    restrict_communities).
+    Parameters
+    ----------
+    in_mat : NxN np.ndarray
+        conditioned connectivity matrix, before pruning.
+    n_seeds : int
+        number of Louvain runs per consensus iteration.
+    Returns
+    -------
+    ci : Nx1 np.ndarray
+        consensus community affiliation vector
+    q_stats : dict
+        as returned by consensus_louvain.
+    '''
+    from pynets.graph import ArrayGraph
+    return consensus_louvain(in_mat, gamma=ArrayGraph(in_mat).density(), n_seeds=n_seeds)
+
+
+def restrict_communities(ci, keep):
+    """Return the community affiliation vector ci of the nodes kept by the boolean mask keep, relabeled 1..K"""
+    _, ci = np.unique(np.asarray(ci)[np.asarray(keep, dtype=bool)], return_inverse=True)
+    return ci + 1
+
+
+# Above this many nodes, betweenness centrality is estimated from a sample of pivot sources
+approx_betweenness_nodes = 500
+betweenness_pivots = 256
+
+
+def _betweenness_dependencies(args):
+    """Return the dependency of every node on each source, one row per source"""
+    G, sources, weight = args
+    nodes = list(G.nodes())
+    delta = np.zeros((len(sources), len(nodes)))
+    for i, source in enumerate(sources):
+        b = nx.betweenness_centrality_subset(G, [source], nodes, normalized=False, weight=weight)
+        delta[i] = [b[node] for node in nodes]
+    # betweenness_centrality_subset halves the dependencies of undirected graphs
+    if not G.is_directed():
+        delta = 2 * delta
+    return delta
+
+
+def betweenness_centrality_vector(G, k=None, seed=42, weight=None, n_jobs=None):
+    """
+    Normalized betweenness centrality of every node, exact or estimated from k sampled pivot sources
+    (Brandes & Pich, 2007).
+
+    The exact betweenness is a single networkx.betweenness_centrality call. With pivots, the betweenness of each node is the mean of its per-pivot dependencies scaled to all N sources, and
+    its standard error follows from the sample variance of those dependencies (with a finite population correction).
+
+    Parameters
+    ----------
+    G : NetworkX graph
+    k : int
+        number of pivot sources. If None, pivots are only used for graphs with more than approx_betweenness_nodes
+        nodes (betweenness_pivots of them). If >= N, the result is exact.
+    seed : int
+        random seed of the sampled pivots.
+    weight : str
+        edge attribute holding edge lengths. If None, all edges have length 1.
+    n_jobs : int | None
+        number of processes across which pivots are split. If None, uses all but one available CPU.
+
+    Returns
+    -------
+    bc : Nx1 np.ndarray
+        betweenness centrality of each node, in the order of G.nodes().
+    stderr : Nx1 np.ndarray
+        standard error of bc (zero when exact).
+    """
+    import multiprocessing
+    nodes = list(G.nodes())
+    n = len(nodes)
+    if k is None and n > approx_betweenness_nodes:
+        k = betweenness_pivots
+    if k is None or k >= n:
+        bc = nx.betweenness_centrality(G, normalized=True, weight=weight)
+        return np.array([bc[node] for node in nodes], dtype=np.float64), np.zeros(n)
+
+    print("%s%s%s" % ('Estimating betweenness centrality from ', k, ' pivots...'))
+    sources = [nodes[i] for i in np.sort(np.random.RandomState(seed).choice(n, int(k), replace=False))]
+
+    if n_jobs is None:
+        n_jobs = max(multiprocessing.cpu_count() - 1, 1)
+    if multiprocessing.current_process().daemon:
+        n_jobs = 1
+    chunks = [list(c) for c in np.array_split(np.arange(len(sources)), min(int(n_jobs), max(len(sources), 1)))
+              if len(c) > 0]
+    if len(chunks) > 1:
+        pool = multiprocessing.Pool(len(chunks))
+        try:
+            results = pool.map(_betweenness_dependencies, [(G, [sources[i] for i in c], weight) for c in chunks])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_betweenness_dependencies((G, sources, weight))]
+    delta = np.vstack(results) if len(results) > 0 else np.zeros((0, n))
+
+    scale = 1.0 / ((n - 1) * (n - 2)) if n > 2 else 1.0
+    bc = n * np.mean(delta, axis=0) * scale
+    stderr = n * scale * np.sqrt(np.var(delta, axis=0, ddof=1) / len(sources) * (1 - float(len(sources)) / n))
+    return bc, stderr
+
+
+def pruned_betweenness(G_pre, G, bc, stderr):
+    """
+    Restrict the betweenness centrality of G_pre to its subgraph G, if it is unchanged by the pruning.
+
+    This is the case when no pruned node shares an edge with a kept node (i.e. whole components were pruned), since
+    shortest paths then never cross between the two. Only the normalization changes with the number of nodes.
+
+    Returns
+    -------
+    (bc, stderr) for the nodes of G, or None if betweenness has to be recomputed on G.
+    """
+    from pynets.graph import ArrayGraph
+    index = dict((node, i) for i, node in enumerate(G_pre.nodes()))
+    ix = [index[node] for node in G.nodes()]
+    return _pruned_betweenness(ArrayGraph.from_networkx(G_pre).adjacency, ix, bc, stderr)
+
+
+def _pruned_betweenness(A, ix, bc, stderr):
+    """Array version of pruned_betweenness, for the adjacency matrix A of G_pre and the indices ix of the kept nodes"""
+    from scipy import sparse
+    n_pre = A.shape[0]
+    n = len(ix)
+    pruned = np.ones(n_pre, dtype=bool)
+    pruned[ix] = False
+    if sparse.csr_matrix(A)[np.where(pruned)[0]][:, ix].nnz > 0:
+        return None
+    rescale = (float((n_pre - 1) * (n_pre - 2)) / ((n - 1) * (n - 2))) if n > 2 and n_pre > 2 else 1.0
+    return np.asarray(bc)[ix] * rescale, np.asarray(stderr)[ix] * rescale
+
+
 def prune_disconnected(G):
     """ returns a copy of G with
-        isolates pruned """
+        isolates pruned (see pruning.largest_component_mask) """
+    from pynets import pruning
     print('Pruning fully disconnected...')
+    keep = pruning.largest_component_mask(nx.to_numpy_array(G))
+    pruned_nodes = list(np.where(~keep)[0])
+    return pruning.subgraph(G, keep), pruned_nodes
+
+
+def most_important(G, bc=None):
+    """ returns a copy of G with
+        isolates and low-importance nodes pruned (see pruning.importance_mask)
+
+        bc optionally holds the betweenness centrality of the nodes of G (in the
+        order of G.nodes()), so that it is not computed again. pruned_nodes are
+        the indices of the pruned nodes in G.nodes() """
+    from pynets import pruning
+    print('Pruning fully disconnected and low importance nodes (3 SD < M)...')
+    if bc is None:
+        bc = betweenness_centrality_vector(G)[0]
+    keep = pruning.importance_mask(nx.to_numpy_array(G), bc=bc)
+    pruned_nodes = list(np.where(~keep)[0])
+    return pruning.subgraph(G, keep), pruned_nodes
+
+
+class GraphCache(object):
+    """Lazily computes and memoizes structures derived from a single graph
+
+    Every metric computed for a graph in extractnetstats reads its inputs from
+    one GraphCache, so that the distance matrix, length matrix, connected
+    components, degree/strength vectors and community partition are each
+    built at most once per graph.
+
+    Parameters
+    ----------
+    in_mat : NxN np.ndarray
+        adjacency matrix of the graph.
+    G : NetworkX graph
+        optional graph corresponding to in_mat, whose node ordering matches
+        the rows of in_mat. If None, it is built from in_mat on first use,
+        i.e. only by metrics that have no array implementation.
+    consensus_seeds : int
+        if > 0, the partition is a consensus across this many Louvain seeds
+        (see consensus_louvain) rather than a single Louvain run.
+    betweenness : tuple
+        optional (bc, stderr) betweenness centrality of the nodes of G, e.g.
+        reused from pruning (see pruned_betweenness).
+    nodes : list
+        optional node labels, in the order of the rows of in_mat (e.g. the
+        nodes kept by pruning). Defaults to those of G, or to 0..N-1.
+    eigenvector_start : Nx1 np.ndarray
+        optional starting vector of the eigenvector centrality solver, e.g.
+        the eigenvector of a previous threshold or bootstrap of the same
+        graph (see eigenvector_centrality_vector).
+    consensus : tuple
+        optional (ci, q_stats) consensus partition of the nodes of G, e.g.
+        that of the unpruned graph (see consensus_communities). Only used if
+        consensus_seeds > 0.
+    """
+    # Intermediates each cached structure is derived from, i.e. the edges of the dependency DAG walked by metric_plan
+    dependencies = {
+        'G': (),
+        'nodes': (),
+        'mat_len': (),
+        'G_len': ('mat_len', 'nodes'),
+        'adjacency': (),
+        'distances': ('adjacency',),
+        'components': ('adjacency',),
+        'degree': ('adjacency',),
+        'strength': (),
+        'density': ('degree',),
+        'partition': ('density',),
+        'local_efficiency': ('adjacency', 'nodes'),
+        'clustering': ('adjacency',),
+        'eigenvector': ('adjacency',),
+        'community_connectivity': ('partition',),
+        'betweenness': ('G',),
+    }
+
+    def __init__(self, in_mat, G=None, consensus_seeds=0, betweenness=None, nodes=None, eigenvector_start=None,
+                 consensus=None):
+        self.in_mat = np.asarray(in_mat)
+        self.consensus_seeds = int(consensus_seeds)
+        self.eigenvector_start = eigenvector_start
+        self._memo = {}
+        if G is not None:
+            self._memo['G'] = G
+            self._memo['nodes'] = list(G.nodes())
+        elif nodes is not None:
+            self._memo['nodes'] = list(nodes)
+        if betweenness is not None:
+            self._memo['betweenness'] = betweenness
+        if consensus is not None:
+            self._memo['consensus'] = consensus
+
+    def _get(self, key, func):
+        if key not in self._memo:
+            self._memo[key] = func()
+        return self._memo[key]
+
+    def evaluate(self, name):
+        """Return the intermediate called name (see GraphCache.dependencies)"""
+        value = getattr(self, name)
+        return value() if name == 'local_efficiency' else value
+
+    @property
+    def G(self):
+        from pynets.graph import ArrayGraph
+        return self._get('G', lambda: ArrayGraph(self.in_mat, nodes=self.nodes).to_networkx())
+
+    @property
+    def nodes(self):
+        return self._get('nodes', lambda: list(range(len(self.in_mat))))
+
+    @property
+    def mat_len(self):
+        from pynets import thresholding
+        return self._get('mat_len', lambda: thresholding.weight_conversion(self.in_mat, 'lengths'))
+
+    @property
+    def G_len(self):
+        from pynets.graph import ArrayGraph
+        return self._get('G_len', lambda: ArrayGraph(self.mat_len, nodes=self.nodes).to_networkx())
+
+    @property
+    def distances(self):
+        return self._get('distances', lambda: all_pairs_distances(self.adjacency))
+
+    @property
+    def components(self):
+        from scipy.sparse.csgraph import connected_components
+        return self._get('components', lambda: connected_components(self.adjacency, directed=False))
+
+    @property
+    def is_connected(self):
+        return len(self.in_mat) > 0 and self.components[0] == 1
+
+    @property
+    def adjacency(self):
+        def binarize_sym():
+            A = np.logical_or(self.in_mat != 0, self.in_mat.T != 0)
+            np.fill_diagonal(A, False)
+            return A
+        return self._get('adjacency', binarize_sym)
+
+    @property
+    def degree(self):
+        return self._get('degree', lambda: np.sum(self.adjacency, axis=1))
+
+    @property
+    def strength(self):
+        return self._get('strength', lambda: np.sum(self.in_mat, axis=1))
+
+    @property
+    def clustering(self):
+        return self._get('clustering', lambda: clustering_vector(self.adjacency))
+
+    @property
+    def eigenvector(self):
+        return self._get('eigenvector', lambda: eigenvector_centrality_vector(self.adjacency,
+                                                                              v0=self.eigenvector_start))
+
+    @property
+    def density(self):
+        n = len(self.in_mat)
+        if n < 2:
+            return 0
+        return float(np.sum(self.degree)) / (n * (n - 1))
+
+    @property
+    def partition(self):
+        if self.consensus_seeds > 0:
+            [ci, q_stats] = self.consensus
+            return ci, q_stats['modularity']
+        return self._get('partition', lambda: modularity_louvain_und_sign(self.in_mat, gamma=self.density))
+
+    @property
+    def community_connectivity(self):
+        return self._get('community_connectivity', lambda: community_connectivity(self.in_mat, self.partition[0]))
+
+    @property
+    def consensus(self):
+        return self._get('consensus', lambda: consensus_louvain(self.in_mat, gamma=self.density,
+                                                                n_seeds=self.consensus_seeds))
+
+    def global_efficiency(self):
+        return path_length_and_efficiency(self.distances)[1]
+
+    def average_shortest_path_length(self):
+        if self.is_connected:
+            return path_length_and_efficiency(self.distances)[0]
+        else:
+            print('WARNING: Calculating average shortest path length for a disconnected graph...')
+            return component_path_length(self.distances, self.components[1])
+
+    def local_efficiency(self):
+        return self._get('local_efficiency', lambda: dict(zip(self.nodes, local_efficiency_vector(self.adjacency))))
+
+    def average_local_efficiency(self):
+        return average_local_efficiency(self.in_mat, efficiencies=self.local_efficiency())
+
+    @property
+    def betweenness(self):
+        return self._get('betweenness', lambda: betweenness_centrality_vector(self.G))
+
+    def degree_centrality(self):
+        n = len(self.in_mat)
+        scale = 1.0 / (n - 1) if n > 1 else 1.0
+        return dict(zip(self.nodes, self.degree * scale))
+
+
+class NetworkMetric(object):
+    """A graph metric, declared by the GraphCache intermediates it reads
+
+    Parameters
+    ----------
+    name : str
+        name of the metric, as listed in global_graph_measures.yaml or
+        nodal_graph_measures.yaml.
+    func : callable
+        func(graph_cache, weight) returning the metric, where weight is an
+        optional custom edge attribute for networkx metrics that accept one.
+    requires : tuple
+        intermediates of GraphCache (see GraphCache.dependencies) read by func.
+    cost : str
+        cost class of the metric, one of metric_costs.
+    output : str
+        'scalar' for a single value, 'scalars' for a dict of named values,
+        'nodal' for one value per node (as a dict keyed by node or an array in
+        node order) and 'degree' for a dict keyed by degree.
+    label : str
+        column suffix of nodal/degree metrics (e.g. `12_<label>`). Defaults to
+        name.
+    average_label : str
+        name under which the mean of a nodal/degree metric is reported.
+    cost_model : callable
+        cost_model(n, m) estimating the run time (in seconds) of func on a graph with n nodes and m edges. Defaults to
+        a model of the cost class (see estimate_cost).
+    budget : float
+        wall-clock budget of func in seconds, or None for no budget.
+    approximation : callable
+        approximation(graph_cache, weight) run instead of func when func is over budget. If None, an over-budget
+        metric is skipped with NaN.
+    """
+    def __init__(self, name, func, requires=(), cost='quadratic', output='scalar', label=None, average_label=None,
+                 cost_model=None, budget=None, approximation=None):
+        if cost not in metric_costs:
+            raise ValueError("%s%s" % ('Unknown metric cost class: ', cost))
+        if output not in ('scalar', 'scalars', 'nodal', 'degree'):
+            raise ValueError("%s%s" % ('Unknown metric output: ', output))
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.cost = cost
+        self.output = output
+        self.label = label if label is not None else name
+        self.average_label = average_label
+        self.cost_model = cost_model
+        self.budget = budget
+        self.approximation = approximation
+
+
+# Cost classes of registered metrics, from cheapest to most expensive
+metric_costs = ('linear', 'quadratic', 'cubic', 'exponential', 'ensemble')
+metric_registry = OrderedDict()
+
+# Rough throughput (operations per second) used to turn operation counts into run time estimates
+_ops_per_second = 1e7
+
+
+def register_metric(name, requires=(), cost='quadratic', output='scalar', label=None, average_label=None,
+                    cost_model=None, budget=None, approximation=None):
+    """Decorator adding func(graph_cache, weight) to the metric registry under name"""
+    def decorator(func):
+        metric_registry[name] = NetworkMetric(name, func, requires, cost, output, label, average_label, cost_model,
+                                              budget, approximation)
+        return func
+    return decorator
+
+
+def estimate_cost(metric_name, n, m):
+    """Estimate the run time (in seconds) of a registered metric on a graph with n nodes and m edges"""
+    metric = metric_registry[metric_name]
+    if metric.cost_model is not None:
+        return float(metric.cost_model(n, m))
+    if metric.cost == 'linear':
+        ops = n + m
+    elif metric.cost == 'quadratic':
+        ops = n ** 2 + m
+    elif metric.cost == 'cubic':
+        ops = n * m + n ** 2 * np.log(max(n, 2))
+    elif metric.cost == 'exponential':
+        # Moon-Moser style bound at the average degree
+        ops = n * 3 ** (min(2.0 * m / max(n, 1), 600) / 3)
+    else:
+        ops = 100 * n * m
+    return float(ops) / _ops_per_second
+
+
+def _budget_worker(conn, func, args):
+    """Run func(*args) and send (succeeded, result or exception) back through conn"""
+    if hasattr(os, 'setpgrp'):
+        # Lead a process group, so that a timeout also terminates any pool the metric starts
+        os.setpgrp()
+    try:
+        conn.send((True, func(*args)))
+    except BaseException as e:
+        try:
+            conn.send((False, e))
+        except Exception:
+            conn.send((False, RuntimeError(repr(e))))
+    finally:
+        conn.close()
+
+
+def _run_with_budget(func, args, budget):
+    """
+    Run func(*args) in a non-daemonic child process, raising multiprocessing.TimeoutError after budget seconds.
+
+    The child is forked where possible, so args are not pickled, and only the result is sent back. Being non-daemonic,
+    it can still parallelize the metric itself (e.g. rich_club_null_ensemble).
+    """
+    import multiprocessing
+    import signal
+    if budget is None or multiprocessing.current_process().daemon:
+        # Daemonic (e.g. pool worker) processes cannot spawn children, so the budget cannot be enforced there
+        return func(*args)
+    if 'fork' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('fork')
+    else:
+        ctx = multiprocessing.get_context()
+    [recv_conn, send_conn] = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_budget_worker, args=(send_conn, func, args))
+    proc.start()
+    send_conn.close()
+    try:
+        if not recv_conn.poll(budget):
+            raise multiprocessing.TimeoutError
+        [succeeded, value] = recv_conn.recv()
+    finally:
+        recv_conn.close()
+        if proc.is_alive():
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except (AttributeError, OSError):
+                proc.terminate()
+        proc.join()
+    if not succeeded:
+        raise value
+    return value
+
+
+@register_metric('global_efficiency', requires=('distances',), cost='cubic')
+def _global_efficiency_metric(graph_cache, weight):
+    return graph_cache.global_efficiency()
+
+
+@register_metric('average_local_efficiency', requires=('local_efficiency',), cost='cubic')
+def _average_local_efficiency_metric(graph_cache, weight):
+    return graph_cache.average_local_efficiency()
+
+
+@register_metric('degree_assortativity_coefficient', requires=('G',), cost='linear')
+def _degree_assortativity_metric(graph_cache, weight):
+    from networkx.algorithms import degree_assortativity_coefficient
+    return degree_assortativity_coefficient(graph_cache.G, weight=weight)
+
+
+@register_metric('average_clustering', requires=('clustering',), cost='cubic')
+def _average_clustering_metric(graph_cache, weight):
+    if weight is not None:
+        return np.mean(clustering_vector(graph_cache.in_mat, weighted=True))
+    return np.mean(graph_cache.clustering)
+
+
+@register_metric('average_shortest_path_length', requires=('distances', 'components'), cost='cubic')
+def _average_shortest_path_length_metric(graph_cache, weight):
+    return graph_cache.average_shortest_path_length()
+
+
+@register_metric('degree_pearson_correlation_coefficient', requires=('G',), cost='linear')
+def _degree_pearson_metric(graph_cache, weight):
+    from networkx.algorithms import degree_pearson_correlation_coefficient
+    return degree_pearson_correlation_coefficient(graph_cache.G)
+
+
+def _number_of_cliques_capped(graph_cache, weight):
+    return number_of_cliques(graph_cache.G, max_cliques=100000)
+
+
+@register_metric('graph_number_of_cliques', requires=('G',), cost='exponential', budget=300,
+                 approximation=_number_of_cliques_capped)
+def _number_of_cliques_metric(graph_cache, weight):
+    return number_of_cliques(graph_cache.G)
+
+
+@register_metric('transitivity', requires=('adjacency',), cost='cubic')
+def _transitivity_metric(graph_cache, weight):
+    return transitivity_vector(graph_cache.adjacency)
+
+
+@register_metric('smallworldness', requires=('G',), cost='ensemble')
+def _smallworldness_metric(graph_cache, weight):
+    return smallworldness(graph_cache.G)
+
+
+@register_metric('louvain_modularity', requires=('partition',), cost='quadratic', output='scalars')
+def _louvain_modularity_metric(graph_cache, weight):
+    q = OrderedDict([('modularity', graph_cache.partition[1])])
+    if graph_cache.consensus_seeds > 0:
+        q_stats = graph_cache.consensus[1]
+        for q_name in ['modularity_mean', 'modularity_std', 'modularity_max']:
+            q[q_name] = q_stats[q_name]
+    return q
+
+
+@register_metric('participation_coefficient', requires=('community_connectivity',), cost='quadratic', output='nodal',
+                 label='partic_coef', average_label='average_participation_coefficient')
+def _participation_metric(graph_cache, weight):
+    return graph_cache.community_connectivity['participation']
+
+
+@register_metric('diversity_coefficient', requires=('community_connectivity',), cost='quadratic', output='nodal',
+                 label='diversity_coef', average_label='average_diversity_coefficient')
+def _diversity_metric(graph_cache, weight):
+    return graph_cache.community_connectivity['diversity_pos']
+
+
+@register_metric('within_module_degree_zscore', requires=('community_connectivity',), cost='quadratic',
+                 output='nodal', label='within_module_z', average_label='average_within_module_degree_zscore')
+def _within_module_zscore_metric(graph_cache, weight):
+    return graph_cache.community_connectivity['within_module_zscore']
+
+
+@register_metric('local_efficiency', requires=('local_efficiency',), cost='cubic', output='nodal',
+                 average_label='average_local_efficiency_nodewise')
+def _local_efficiency_metric(graph_cache, weight):
+    return graph_cache.local_efficiency()
+
+
+@register_metric('local_clustering', requires=('clustering', 'nodes'), cost='cubic', output='nodal',
+                 average_label='average_local_clustering_nodewise')
+def _local_clustering_metric(graph_cache, weight):
+    return dict(zip(graph_cache.nodes, graph_cache.clustering))
+
+
+@register_metric('degree_centrality', requires=('degree', 'nodes'), cost='linear', output='nodal',
+                 average_label='average_degree_cent')
+def _degree_centrality_metric(graph_cache, weight):
+    return graph_cache.degree_centrality()
+
+
+@register_metric('betweenness_centrality', requires=('betweenness',), cost='cubic', output='nodal',
+                 average_label='average_betweenness_centrality')
+def _betweenness_centrality_metric(graph_cache, weight):
+    return graph_cache.betweenness[0]
+
+
+@register_metric('betweenness_centrality_stderr', requires=('betweenness',), cost='cubic', output='nodal',
+                 average_label='average_betweenness_centrality_stderr')
+def _betweenness_centrality_stderr_metric(graph_cache, weight):
+    return graph_cache.betweenness[1]
+
+
+@register_metric('eigenvector_centrality', requires=('eigenvector', 'nodes'), cost='quadratic', output='nodal',
+                 average_label='average_eigenvector_centrality')
+def _eigenvector_centrality_metric(graph_cache, weight):
+    return dict(zip(graph_cache.nodes, graph_cache.eigenvector))
+
+
+def _communicability_centrality_sampled(graph_cache, weight):
+    [cbc, stderr] = communicability_betweenness(graph_cache.adjacency, n_sources=communicability_sources)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rel_stderr = np.nanmean(stderr / cbc)
+    print("%s%s%s%s%s" % ('Estimated communicability centrality from ', communicability_sources,
+                          ' sources (mean relative standard error: ', np.round(rel_stderr, 3), ')'))
+    return cbc
+
+
+# One n^3 matrix exponential per node
+@register_metric('communicability_centrality', requires=('adjacency',), cost='exponential', output='nodal',
+                 average_label='average_communicability_centrality', cost_model=lambda n, m: 10.0 * n ** 4 / 1e9,
+                 budget=300, approximation=_communicability_centrality_sampled)
+def _communicability_centrality_metric(graph_cache, weight):
+    return communicability_betweenness(graph_cache.adjacency)[0]
+
+
+def _rich_club_few_swaps(graph_cache, weight):
+    return rich_club_coefficient(graph_cache.adjacency, normalized=True, Q=10)
+
+
+def _rich_club_cost(n, m):
+    # Normalization rewires 10 random graphs Q=100 times per edge with batched double edge swaps, a growing share of
+    # which are rejected as the graph gets denser
+    density = 2.0 * m / max(n * (n - 1), 1)
+    return 10 * 100.0 * m * 60 / 1e7 / max(1 - density, 1e-2) + n * m / 1e7
+
+
+@register_metric('rich_club_coefficient', requires=('adjacency',), cost='ensemble', output='degree',
+                 label='rich_club', average_label='average_rich_club_coefficient', cost_model=_rich_club_cost,
+                 budget=300, approximation=_rich_club_few_swaps)
+def _rich_club_metric(graph_cache, weight):
+    return rich_club_coefficient(graph_cache.adjacency, normalized=True)
+
+
+def metric_plan(metric_names):
+    """Return the GraphCache intermediates required by metric_names, in dependency order
+
+    Intermediates that no requested metric depends on are left out, so that they are never computed.
+    """
+    plan = []
+
+    def visit(name):
+        if name in plan:
+            return
+        for dep in GraphCache.dependencies[name]:
+            visit(dep)
+        plan.append(name)
+
+    for metric_name in metric_names:
+        if metric_name not in metric_registry:
+            raise ValueError("%s%s" % ('Unknown graph metric: ', metric_name))
+        for dep in metric_registry[metric_name].requires:
+            visit(dep)
+    return plan
+
+
+def compute_metrics(graph_cache, metric_names, weight=None, budgets=None, enforce_budgets=True):
+    """Compute the registered metrics metric_names from a GraphCache
+
+    Intermediates are evaluated once each, in the order given by metric_plan. A metric that is undefined for the graph
+    (or whose intermediates are) is NaN if it is a scalar and is left out otherwise.
+
+    Metrics with a wall-clock budget are scheduled by cost: if the estimated run time (see estimate_cost) is over
+    budget, the metric's approximation is run instead. Otherwise the exact metric runs in a child process and falls
+    back to the approximation once the budget is exhausted. Without an approximation, an over-budget metric is NaN.
+
+    Parameters
+    ----------
+    graph_cache : GraphCache
+        graph to compute the metrics of.
+    metric_names : list
+        names of registered metrics.
+    weight : str
+        optional custom edge attribute for networkx metrics that accept one.
+    budgets : dict
+        metric name -> wall-clock budget in seconds, overriding the budgets declared in the registry.
+    enforce_budgets : bool
+        if False, all metrics run exactly without budget.
+
+    Returns
+    -------
+    results : OrderedDict
+        metric name -> value, where nodal metrics are float arrays in the node order of graph_cache.
+    paths : OrderedDict
+        metric name -> how the metric was computed, one of 'exact', 'approximate' (estimated over budget),
+        'approximate_timeout' (exact run exceeded the budget), 'skipped' (over budget, no approximation) or
+        'undefined'.
+    """
+    import multiprocessing
+    failed = set()
+    for name in metric_plan(metric_names):
+        try:
+            graph_cache.evaluate(name)
+        except:
+            print("%s%s%s" % ('WARNING: ', name, ' is undefined for graph G'))
+            failed.add(name)
+
+    n = len(graph_cache.in_mat)
+    m = int(np.sum(graph_cache.adjacency)) // 2
+    results = OrderedDict()
+    paths = OrderedDict()
+    for metric_name in metric_names:
+        metric = metric_registry[metric_name]
+        budget = metric.budget
+        if budgets is not None and metric_name in budgets:
+            budget = budgets[metric_name]
+        if not enforce_budgets:
+            budget = None
+        path = 'exact'
+        try:
+            if failed.intersection(metric.requires):
+                raise ValueError("%s%s" % (metric_name, ' depends on an undefined intermediate'))
+            if budget is not None and estimate_cost(metric_name, n, m) > budget:
+                path = 'approximate' if metric.approximation is not None else 'skipped'
+            elif budget is not None:
+                try:
+                    value = _run_with_budget(metric.func, (graph_cache, weight), budget)
+                except multiprocessing.TimeoutError:
+                    path = 'approximate_timeout' if metric.approximation is not None else 'skipped'
+            else:
+                value = metric.func(graph_cache, weight)
+            if path == 'skipped':
+                raise ValueError("%s%s" % (metric_name, ' is over budget'))
+            elif path != 'exact':
+                print("%s%s%s%s" % ('Running approximate ', metric_name, ' within a budget of ',
+                                    "%s%s" % (budget, 's...')))
+                value = metric.approximation(graph_cache, weight)
+            if metric.output == 'scalar':
+                value = float(value)
+            elif metric.output == 'nodal':
+                if isinstance(value, dict):
+                    value = [value[node] for node in graph_cache.nodes]
+                value = np.asarray(value, dtype=np.float64)
+        except:
+            print("%s%s%s" % ('WARNING: ', metric_name, ' is undefined for graph G'))
+            if path != 'skipped':
+                path = 'undefined'
+            paths[metric_name] = path
+            if metric.output != 'scalar':
+                continue
+            value = np.nan
+        results[metric_name] = value
+        paths[metric_name] = path
+    return results, paths
+
 
-    # List because it returns a generator
-    components = list(nx.connected_components(G))
-    components.sort(key=len, reverse=True)
-    components_isolated = list(components[0])
-
-    # Remove disconnected nodes
-    pruned_nodes = []
-    s = 0
-    for node in list(G.nodes()):
-        if node not in components_isolated:
-            G.remove_node(node)
-            pruned_nodes.append(s)
-        s = s + 1
-
-    return G, pruned_nodes
-
-
-def most_important(G):
-     """ returns a copy of G with
-         isolates and low-importance nodes pruned """
-     print('Pruning fully disconnected and low importance nodes (3 SD < M)...')
-     ranking = nx.betweenness_centrality(G).items()
-     #print(ranking)
-     r = [x[1] for x in ranking]
-     m = sum(r)/len(r) - 3*np.std(r)
-     Gt = G.copy()
-     pruned_nodes = []
-     i = 0
-     # Remove near-zero isolates
-     for k, v in ranking:
-        if v < m:
-            Gt.remove_node(k)
-            pruned_nodes.append(i)
-        i = i + 1
-
-     # List because it returns a generator
-     components = list(nx.connected_components(Gt))
-     components.sort(key=len, reverse=True)
-     components_isolated = list(components[0])
-
-     # Remove disconnected nodes
-     s = 0
-     for node in list(Gt.nodes()):
-         if node not in components_isolated:
-             Gt.remove_node(node)
-             pruned_nodes.append(s)
-         s = s + 1
-
-     return Gt, pruned_nodes
+# Eigenvector centrality of the most recently analysed estimates, keyed by estimate identity (all but the threshold),
+# used to warm-start the next threshold or bootstrap of the same estimate
+_eigenvector_starts = OrderedDict()
+max_eigenvector_starts = 64
 
 
 # Extract network metrics interface
-def extractnetstats(ID, network, thr, conn_model, est_path, roi, prune, node_size, smooth, c_boot):
-    import pandas as pd
+def extractnetstats(ID, network, thr, conn_model, est_path, roi, prune, node_size, smooth, c_boot, conn_matrix=None):
     import yaml
-    try:
-        import cPickle as pickle
-    except ImportError:
-        import _pickle as pickle
     from pathlib import Path
-    from pynets import thresholding, utils
+    from pynets import pruning, thresholding, utils
+    from pynets.graph import ArrayGraph
 
     # Advanced options
     save_gephi = False
     custom_weight = None
     binary = False
-
-    # Load and threshold matrix
-    if '.txt' in est_path:
-        in_mat_raw = np.array(np.genfromtxt(est_path))
+    # Number of Louvain seeds for consensus community detection (0 runs a single seed)
+    consensus_seeds = 0
+    # Switch expensive metrics to their approximations (or NaN) when over their wall-clock budgets
+    enforce_budgets = True
+    # Hold the connectivity matrix in single precision (halves the memory of large matrices)
+    low_memory = False
+
+    # Load the matrix (unless it is passed in memory, e.g. by thresholding.ThresholdSweep), then de-diagonal, clean,
+    # normalize (weights between 0-1) and, if non-covariance, Fisher r-to-z transform it in place
+    dtype = np.float32 if low_memory is True else np.float64
+    if conn_matrix is not None:
+        in_mat = thresholding.condition_matrix(conn_matrix, conn_model, dtype=dtype)
     else:
-        in_mat_raw = np.array(np.load(est_path))
-
-    # De-diagnal and Normalize connectivity matrix (weights between 0-1)
-    in_mat = np.array(thresholding.normalize(np.array(thresholding.autofix(in_mat_raw))))
-    in_mat[np.isnan(in_mat)] = 0
-    in_mat[np.isinf(in_mat)] = 1
-
-    # Get hyperbolic tangent (i.e. fischer r-to-z transform) of matrix if non-covariance
-    if conn_model == 'corr':
-        in_mat = np.arctanh(in_mat)
+        # .npy files are read straight into a buffer of the working precision, and compact .npz files (see
+        # utils.save_est) are rebuilt from their unthresholded matrix or CSR entries
+        in_mat = thresholding.condition_matrix(utils.load_est(est_path, mmap_mode='r'), conn_model, dtype=dtype,
+                                               copy=False)
 
     # Get dir_path
     dir_path = os.path.dirname(os.path.realpath(est_path))
 
-    # Load numpy matrix as networkx graph
-    G_pre = nx.from_numpy_matrix(in_mat)
+    # Load numpy matrix as an array-backed graph (a networkx graph is only built for metrics that need one)
+    graph_pre = ArrayGraph(in_mat)
+
+    # The consensus partition is computed before pruning, from the same matrix as in plotting.plot_all, so that both
+    # share one cached partition
+    consensus = None
+    if consensus_seeds > 0:
+        [ci_pre, q_stats_pre] = consensus_communities(in_mat, consensus_seeds)
 
     # Prune irrelevant nodes (i.e. nodes who are fully disconnected from the graph and/or those whose betweenness centrality are > 3 standard deviations below the mean)
-    if prune == 1:
-        [G, _] = prune_disconnected(G_pre)
-    elif prune == 2:
-        [G, _] = most_important(G_pre)
-    else:
-        G = G_pre
+    betweenness = None
+    betweenness_pre = []
+
+    def bc_pre():
+        betweenness_pre.append(betweenness_centrality_vector(graph_pre.to_networkx()))
+        return betweenness_pre[0][0]
 
-    # Get corresponding matrix
-    in_mat = np.array(nx.to_numpy_matrix(G))
+    # The keep-mask is cached by graph, and shared with plot_all. Betweenness is only computed on a cache miss
+    keep = pruning.prune_mask(in_mat, prune, bc=bc_pre)
+    graph = graph_pre if np.all(keep) else graph_pre.subgraph(keep)
+    in_mat = graph.W
+    if len(betweenness_pre) > 0:
+        # Reuse the betweenness vector of the pruning for the betweenness metric where possible
+        betweenness = _pruned_betweenness(graph_pre.adjacency, np.where(keep)[0], *betweenness_pre[0])
 
     # Binarize graph
     if binary is True:
         in_mat = thresholding.binarize(in_mat)
 
+    if consensus_seeds > 0:
+        ci = restrict_communities(ci_pre, keep)
+        q_stats = dict(q_stats_pre)
+        q_stats['modularity'] = float(signed_modularity(in_mat, ci))
+        consensus = (ci, q_stats)
+
+    # Warm-start eigenvector centrality from the last threshold or bootstrap of the same estimate in this process, if
+    # any (e.g. the previous step of a thresholding.ThresholdSweep)
+    eig_key = (ID, network, conn_model, os.path.basename(str(roi)), prune, node_size, smooth, dir_path)
+    eigenvector_start = None
+    if eig_key in _eigenvector_starts:
+        prev = _eigenvector_starts[eig_key]
+        if len(prev) > 0:
+            fill = np.mean(list(prev.values()))
+            eigenvector_start = np.array([prev.get(i, fill) for i in graph.nodes], dtype=np.float64)
+
+    # Share derived structures (distances, lengths, components, partition) across all metrics
+    graph_cache = GraphCache(in_mat, consensus_seeds=consensus_seeds, betweenness=betweenness, nodes=graph.nodes,
+                             eigenvector_start=eigenvector_start, consensus=consensus)
+
     # Print graph summary
     print("%s%.2f%s" % ('\n\nThreshold: ', 100*float(thr), '%'))
     print("%s%s" % ('Source File: ', est_path))
-    info_list = list(nx.info(G).split('\n'))[2:]
-    for i in info_list:
+    for i in graph.info():
         print(i)
 
     # try:
@@ -887,440 +2768,109 @@ def extractnetstats(ID, network, thr, conn_model, est_path, roi, prune, node_siz
     # except:
     #     print('Graph is UNDIRECTED')
 
-    if nx.is_connected(G) is True:
+    if graph_cache.is_connected is True:
         frag = False
         print('Graph is connected...')
     else:
         frag = True
         print('Warning: Graph is fragmented...\n')
 
-    # Create Length matrix
-    mat_len = thresholding.weight_conversion(in_mat, 'lengths')
-    # Load numpy matrix as networkx graph
-    G_len = nx.from_numpy_matrix(mat_len)
-
     if save_gephi is True:
         # Save G as gephi file
         if roi:
             if network:
-                nx.write_graphml(G, "%s%s%s%s%s%s%s%s%s%s%s%s%s%s" % (dir_path, '/', ID, '_', network, '_', os.path.basename(roi).split('.')[0], '_', thr, '_', node_size, '%s' % ("mm_" if node_size != 'parc' else "_"), "%s" % ("%s%s" % (int(c_boot), 'nb_') if float(c_boot) > 0 else 'nb_'), "%s" % ("%s%s" % (smooth, 'fwhm.graphml') if float(smooth) > 0 else 'nosm.graphml')))
+                nx.write_graphml(graph_cache.G, "%s%s%s%s%s%s%s%s%s%s%s%s%s%s" % (dir_path, '/', ID, '_', network, '_', os.path.basename(roi).split('.')[0], '_', thr, '_', node_size, '%s' % ("mm_" if node_size != 'parc' else "_"), "%s" % ("%s%s" % (int(c_boot), 'nb_') if float(c_boot) > 0 else 'nb_'), "%s" % ("%s%s" % (smooth, 'fwhm.graphml') if float(smooth) > 0 else 'nosm.graphml')))
             else:
-                nx.write_graphml(G, "%s%s%s%s%s%s%s%s%s%s%s%s" % (dir_path, '/', ID, '_', os.path.basename(roi).split('.')[0], '_', thr, '_', node_size, '%s' % ("mm_" if node_size != 'parc' else "_"), "%s" % ("%s%s" % (int(c_boot), 'nb_') if float(c_boot) > 0 else 'nb_'), "%s" % ("%s%s" % (smooth, 'fwhm.graphml') if float(smooth) > 0 else 'nosm.graphml')))
+                nx.write_graphml(graph_cache.G, "%s%s%s%s%s%s%s%s%s%s%s%s" % (dir_path, '/', ID, '_', os.path.basename(roi).split('.')[0], '_', thr, '_', node_size, '%s' % ("mm_" if node_size != 'parc' else "_"), "%s" % ("%s%s" % (int(c_boot), 'nb_') if float(c_boot) > 0 else 'nb_'), "%s" % ("%s%s" % (smooth, 'fwhm.graphml') if float(smooth) > 0 else 'nosm.graphml')))
         else:
             if network:
-                nx.write_graphml(G, "%s%s%s%s%s%s%s%s%s%s%s%s" % (dir_path, '/', ID, '_', network, '_', thr, '_', node_size, '%s' % ("mm_" if node_size != 'parc' else "_"), "%s" % ("%s%s" % (int(c_boot), 'nb_') if float(c_boot) > 0 else 'nb_'), "%s" % ("%s%s" % (smooth, 'fwhm.graphml') if float(smooth) > 0 else 'nosm.graphml')))
+                nx.write_graphml(graph_cache.G, "%s%s%s%s%s%s%s%s%s%s%s%s" % (dir_path, '/', ID, '_', network, '_', thr, '_', node_size, '%s' % ("mm_" if node_size != 'parc' else "_"), "%s" % ("%s%s" % (int(c_boot), 'nb_') if float(c_boot) > 0 else 'nb_'), "%s" % ("%s%s" % (smooth, 'fwhm.graphml') if float(smooth) > 0 else 'nosm.graphml')))
             else:
-                nx.write_graphml(G, "%s%s%s%s%s%s%s%s%s%s" % (dir_path, '/', ID, '_', thr, '_', node_size, '%s' % ("mm_" if node_size != 'parc' else "_"), "%s" % ("%s%s" % (int(c_boot), 'nb_') if float(c_boot) > 0 else 'nb_'), "%s" % ("%s%s" % (smooth, 'fwhm.graphml') if float(smooth) > 0 else 'nosm.graphml')))
+                nx.write_graphml(graph_cache.G, "%s%s%s%s%s%s%s%s%s%s" % (dir_path, '/', ID, '_', thr, '_', node_size, '%s' % ("mm_" if node_size != 'parc' else "_"), "%s" % ("%s%s" % (int(c_boot), 'nb_') if float(c_boot) > 0 else 'nb_'), "%s" % ("%s%s" % (smooth, 'fwhm.graphml') if float(smooth) > 0 else 'nosm.graphml')))
 
     # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
     # # # # Calculate global and local metrics from graph G # # # #
     # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-    from networkx.algorithms import degree_assortativity_coefficient, average_clustering, average_shortest_path_length, degree_pearson_correlation_coefficient, graph_number_of_cliques, transitivity, betweenness_centrality, eigenvector_centrality, communicability_betweenness_centrality, clustering, degree_centrality, rich_club_coefficient
-    from pynets.netstats import average_local_efficiency, global_efficiency, local_efficiency, modularity_louvain_und_sign, smallworldness, participation_coef, diversity_coef_sign
-    # For non-nodal scalar metrics from custom functions, add the name of the function to metric_list and add the function  (with a G-only input) to the netstats module.
-    metric_list_glob = [global_efficiency, average_local_efficiency, degree_assortativity_coefficient, average_clustering, average_shortest_path_length, degree_pearson_correlation_coefficient, graph_number_of_cliques, transitivity]
-    #metric_list_glob = [global_efficiency, average_local_efficiency, degree_assortativity_coefficient, average_clustering, average_shortest_path_length, degree_pearson_correlation_coefficient, graph_number_of_cliques, transitivity, smallworldness]
-    metric_list_comm = ['louvain_modularity']
-    # with open("%s%s" % (str(Path(__file__).parent), '/global_graph_measures.yaml'), 'r') as stream:
-    #     try:
-    #         metric_dict_global = yaml.load(stream)
-    #         metric_list_global = metric_dict_global['metric_list_global']
-    #         print("%s%s%s" % ('\n\nCalculating global measures:\n', metric_list_global, '\n\n'))
-    #     except FileNotFoundError:
-    #         print('Failed to parse global_graph_measures.yaml')
+    # To add a metric, register a function of the GraphCache with register_metric and list it in one of the yaml files.
+    with open("%s%s" % (str(Path(__file__).parent), '/global_graph_measures.yaml'), 'r') as stream:
+        try:
+            metric_dict_global = yaml.safe_load(stream)
+            metric_list_global = metric_dict_global['metric_list_global']
+            print("%s%s%s" % ('\n\nCalculating global measures:\n', metric_list_global, '\n\n'))
+        except FileNotFoundError:
+            print('Failed to parse global_graph_measures.yaml')
 
     with open("%s%s" % (str(Path(__file__).parent), '/nodal_graph_measures.yaml'), 'r') as stream:
         try:
-            metric_dict_nodal = yaml.load(stream)
+            metric_dict_nodal = yaml.safe_load(stream)
             metric_list_nodal = metric_dict_nodal['metric_list_nodal']
             print("%s%s%s" % ('\n\nCalculating nodal measures:\n', metric_list_nodal, '\n\n'))
         except FileNotFoundError:
             print('Failed to parse nodal_graph_measures.yaml')
-    # Note the use of bare excepts in preceding blocks. Typically, this is considered bad practice in python. Here,
+    # Note the use of bare excepts in compute_metrics. Typically, this is considered bad practice in python. Here,
     # we are exploiting it intentionally to facilitate uninterrupted, automated graph analysis even when algorithms are
     # undefined. In those instances, solutions are assigned NaN's.
-
-    # Iteratively run functions from above metric list that generate single scalar output
-    num_mets = len(metric_list_glob)
-    net_met_arr = np.zeros([num_mets, 2], dtype='object')
-    j = 0
-    for i in metric_list_glob:
-        met_name = str(i).split('<function ')[1].split(' at')[0]
-        net_met = met_name
-        try:
-            if i is 'average_shortest_path_length':
-                if nx.is_connected(G) is True:
-                    # try:
-                    #     net_met_val = float(i(G_dir))
-                    #     print('Calculating from directed graph...')
-                    # except:
-                    #     net_met_val = float(i(G))
-                    net_met_val = float(i(G))
-                else:
-                    # Case where G is not fully connected
-                    print('WARNING: Calculating average shortest path length for a disconnected graph. This might take awhile...')
-                    net_met_val = float(average_shortest_path_length_for_all(G))
-            if custom_weight is not None and i is 'degree_assortativity_coefficient' or i is 'global_efficiency' or i is 'average_local_efficiency' or i is 'average_clustering':
-                custom_weight_param = 'weight = ' + str(custom_weight)
-                # try:
-                #     net_met_val = float(i(G_dir, custom_weight_param))
-                #     print('Calculating from directed graph...')
-                # except:
-                #     net_met_val = float(i(G, custom_weight_param))
-                net_met_val = float(i(G, custom_weight_param))
+    [results, metric_paths] = compute_metrics(graph_cache, metric_list_global + metric_list_nodal,
+                                              weight=custom_weight, enforce_budgets=enforce_budgets)
+    if 'eigenvector' in graph_cache._memo:
+        _eigenvector_starts.pop(eig_key, None)
+        _eigenvector_starts[eig_key] = dict(zip(graph_cache.nodes, graph_cache._memo['eigenvector']))
+        while len(_eigenvector_starts) > max_eigenvector_starts:
+            _eigenvector_starts.popitem(last=False)
+
+    # Global metrics and the means of nodal metrics form one vector, nodal metrics a nodes x metrics table
+    nodes = list(graph_cache.nodes)
+    metric_list_names = []
+    net_met_val_list_final = []
+    nodal_names = []
+    nodal_cols = []
+    rc_degrees = np.zeros(0, dtype=np.int64)
+    rc_vals = np.zeros(0)
+    for met_name, net_met_val in results.items():
+        metric = metric_registry[met_name]
+        if metric.output == 'scalar':
+            metric_list_names.append(met_name)
+            net_met_val_list_final.append(net_met_val)
+        elif metric.output == 'scalars':
+            metric_list_names.extend(net_met_val.keys())
+            net_met_val_list_final.extend(net_met_val.values())
+        elif metric.output == 'nodal':
+            nodal_names.append(metric.label)
+            nodal_cols.append(net_met_val)
+            metric_list_names.append(metric.average_label)
+            # All-NaN nodal vectors (e.g. a metric over budget) average to NaN, without a 'Mean of empty slice' warning
+            if np.all(np.isnan(np.asarray(net_met_val, dtype=np.float64))):
+                net_met_val_list_final.append(np.nan)
             else:
-                # try:
-                #     net_met_val = float(i(G_dir))
-                #     print('Calculating from directed graph...')
-                # except:
-                #     net_met_val = float(i(G))
-                net_met_val = float(i(G))
-        except:
-            print("%s%s%s" % ('WARNING: ', str(i), ' is undefined for graph G'))
-            net_met_val = np.nan
-        net_met_arr[j, 0] = net_met
-        net_met_arr[j, 1] = net_met_val
-        print(net_met)
+                net_met_val_list_final.append(np.nanmean(net_met_val))
+        else:
+            rc_degrees = np.array(list(net_met_val.keys()), dtype=np.int64)
+            rc_vals = np.array(list(net_met_val.values()), dtype=np.float64)
+            metric_list_names.append(metric.average_label)
+            if np.all(np.isnan(rc_vals)):
+                net_met_val_list_final.append(np.nan)
+            else:
+                net_met_val_list_final.append(np.nanmean(rc_vals))
+    for met_name, net_met_val in zip(metric_list_names, net_met_val_list_final):
+        print(met_name)
         print(str(net_met_val))
         print('\n')
-        j = j + 1
-    net_met_val_list = list(net_met_arr[:, 1])
-
-    # Create a list of metric names for scalar metrics
-    metric_list_names = []
-    net_met_val_list_final = net_met_val_list
-    for i in net_met_arr[:, 0]:
-        metric_list_names.append(i)
-
-    # Run miscellaneous functions that generate multiple outputs
-
-    # Calculate modularity using the Louvain algorithm
-    if 'louvain_modularity' in metric_list_comm:
-        try:
-            gamma = nx.density(nx.from_numpy_array(in_mat))
-            [ci, modularity] = modularity_louvain_und_sign(in_mat, gamma=gamma)
-            metric_list_names.append('modularity')
-            net_met_val_list_final.append(modularity)
-        except:
-            print('Louvain modularity calculation is undefined for graph G')
-            pass
-
-    # Participation Coefficient by louvain community
-    if 'participation_coefficient' in metric_list_nodal:
-        try:
-            if ci is None:
-                raise KeyError('Participation coefficient cannot be calculated for graph G in the absence of a community affiliation vector')
-            pc_vector = participation_coef(in_mat, ci)
-            print('\nExtracting Participation Coefficient vector for all network nodes...')
-            pc_vals = list(pc_vector)
-            pc_edges = list(range(len(pc_vector)))
-            num_edges = len(pc_edges)
-            pc_arr = np.zeros([num_edges + 1, 2], dtype='object')
-            j = 0
-            for i in range(num_edges):
-                pc_arr[j, 0] = "%s%s" % (str(pc_edges[j]), '_partic_coef')
-                #print('\n' + str(rc_edges[j]) + '_rich_club')
-                try:
-                    pc_arr[j, 1] = pc_vals[j]
-                except:
-                    print("%s%s%s" % ('Participation coefficient is undefined for node ', str(j), ' of graph G'))
-                    pc_arr[j, 1] = np.nan
-                #print(str(rc_vals[j]))
-                j = j + 1
-            # Add mean
-            pc_arr[num_edges, 0] = 'average_participation_coefficient'
-            nonzero_arr_partic_coef = np.delete(pc_arr[:, 1], [0])
-            pc_arr[num_edges, 1] = np.mean(nonzero_arr_partic_coef)
-            print("%s%s" % ('Mean Participation Coefficient across edges: ', str(pc_arr[num_edges, 1])))
-            for i in pc_arr[:, 0]:
-                metric_list_names.append(i)
-            net_met_val_list_final = net_met_val_list_final + list(pc_arr[:, 1])
-        except:
-            print('Participation coefficient cannot be calculated for graph G')
-            pass
-
-    # Diversity Coefficient by louvain community
-    if 'diversity_coefficient' in metric_list_nodal:
-        try:
-            if ci is None:
-                raise KeyError('Diversity coefficient cannot be calculated for graph G in the absence of a community affiliation vector')
-            [dc_vector, _] = diversity_coef_sign(in_mat, ci)
-            print('\nExtracting Diversity Coefficient vector for all network nodes...')
-            dc_vals = list(dc_vector)
-            dc_edges = list(range(len(dc_vector)))
-            num_edges = len(dc_edges)
-            dc_arr = np.zeros([num_edges + 1, 2], dtype='object')
-            j = 0
-            for i in range(num_edges):
-                dc_arr[j, 0] = "%s%s" % (str(dc_edges[j]), '_diversity_coef')
-                #print('\n' + str(rc_edges[j]) + '_rich_club')
-                try:
-                    dc_arr[j, 1] = dc_vals[j]
-                except:
-                    print("%s%s%s" % ('Diversity coefficient is undefined for node ', str(j), ' of graph G'))
-                    dc_arr[j, 1] = np.nan
-                #print(str(rc_vals[j]))
-                j = j + 1
-            # Add mean
-            dc_arr[num_edges, 0] = 'average_diversity_coefficient'
-            nonzero_arr_diversity_coef = np.delete(dc_arr[:, 1], [0])
-            dc_arr[num_edges, 1] = np.mean(nonzero_arr_diversity_coef)
-            print("%s%s" % ('Mean Diversity Coefficient across edges: ', str(dc_arr[num_edges, 1])))
-            for i in dc_arr[:, 0]:
-                metric_list_names.append(i)
-            net_met_val_list_final = net_met_val_list_final + list(dc_arr[:, 1])
-        except:
-            print('Diversity coefficient cannot be calculated for graph G')
-            pass
-
-    # Local Efficiency
-    if 'local_efficiency' in metric_list_nodal:
-        try:
-            # try:
-            #     le_vector = local_efficiency(G_dir)
-            # except:
-            #     le_vector = local_efficiency(G)
-            le_vector = local_efficiency(G)
-            print('\nExtracting Local Efficiency vector for all network nodes...')
-            le_vals = list(le_vector.values())
-            le_nodes = list(le_vector.keys())
-            num_nodes = len(le_nodes)
-            le_arr = np.zeros([num_nodes + 1, 2], dtype='object')
-            j = 0
-            for i in range(num_nodes):
-                le_arr[j, 0] = "%s%s" % (str(le_nodes[j]), '_local_efficiency')
-                #print('\n' + str(le_nodes[j]) + '_local_efficiency')
-                try:
-                    le_arr[j, 1] = le_vals[j]
-                except:
-                    print("%s%s%s" % ('Local efficiency is undefined for node ', str(j), ' of graph G'))
-                    le_arr[j, 1] = np.nan
-                #print(str(le_vals[j]))
-                j = j + 1
-            le_arr[num_nodes, 0] = 'average_local_efficiency_nodewise'
-            nonzero_arr_le = np.delete(le_arr[:, 1], [0])
-            le_arr[num_nodes, 1] = np.mean(nonzero_arr_le)
-            print("%s%s" % ('Mean Local Efficiency across nodes: ', str(le_arr[num_nodes, 1])))
-            for i in le_arr[:, 0]:
-                metric_list_names.append(i)
-            net_met_val_list_final = net_met_val_list_final + list(le_arr[:, 1])
-        except:
-            print('Local efficiency cannot be calculated for graph G')
-            pass
-
-    # Local Clustering
-    if 'local_clustering' in metric_list_nodal:
-        try:
-            cl_vector = clustering(G)
-            print('\nExtracting Local Clustering vector for all network nodes...')
-            cl_vals = list(cl_vector.values())
-            cl_nodes = list(cl_vector.keys())
-            num_nodes = len(cl_nodes)
-            cl_arr = np.zeros([num_nodes + 1, 2], dtype='object')
-            j = 0
-            for i in range(num_nodes):
-                cl_arr[j, 0] = "%s%s" % (str(cl_nodes[j]), '_local_clustering')
-                #print('\n' + str(cl_nodes[j]) + '_local_clustering')
-                try:
-                    cl_arr[j, 1] = cl_vals[j]
-                except:
-                    print("%s%s%s" % ('Local clustering is undefined for node ', str(j), ' of graph G'))
-                    cl_arr[j, 1] = np.nan
-                #print(str(cl_vals[j]))
-                j = j + 1
-            cl_arr[num_nodes, 0] = 'average_local_efficiency_nodewise'
-            nonzero_arr_cl = np.delete(cl_arr[:, 1], [0])
-            cl_arr[num_nodes, 1] = np.mean(nonzero_arr_cl)
-            print("%s%s" % ('Mean Local Clustering across nodes: ', str(cl_arr[num_nodes, 1])))
-            for i in cl_arr[:, 0]:
-                metric_list_names.append(i)
-            net_met_val_list_final = net_met_val_list_final + list(cl_arr[:, 1])
-        except:
-            print('Local clustering cannot be calculated for graph G')
-            pass
-
-    # Degree centrality
-    if 'degree_centrality' in metric_list_nodal:
-        try:
-            # try:
-            #     dc_vector = degree_centrality(G_dir)
-            # except:
-            #     dc_vector = degree_centrality(G)
-            dc_vector = degree_centrality(G)
-            print('\nExtracting Degree Centrality vector for all network nodes...')
-            dc_vals = list(dc_vector.values())
-            dc_nodes = list(dc_vector.keys())
-            num_nodes = len(dc_nodes)
-            dc_arr = np.zeros([num_nodes + 1, 2], dtype='object')
-            j = 0
-            for i in range(num_nodes):
-                dc_arr[j, 0] = "%s%s" % (str(dc_nodes[j]), '_degree_centrality')
-                #print('\n' + str(dc_nodes[j]) + '_degree_centrality')
-                try:
-                    dc_arr[j, 1] = dc_vals[j]
-                except:
-                    print("%s%s%s" % ('Degree centrality is undefined for node ', str(j), ' of graph G'))
-                    dc_arr[j, 1] = np.nan
-                #print(str(cl_vals[j]))
-                j = j + 1
-            dc_arr[num_nodes, 0] = 'average_degree_cent'
-            nonzero_arr_dc = np.delete(dc_arr[:, 1], [0])
-            dc_arr[num_nodes, 1] = np.mean(nonzero_arr_dc)
-            print("%s%s" % ('Mean Degree Centrality across nodes: ', str(dc_arr[num_nodes, 1])))
-            for i in dc_arr[:, 0]:
-                metric_list_names.append(i)
-            net_met_val_list_final = net_met_val_list_final + list(dc_arr[:, 1])
-        except:
-            print('Degree centrality cannot be calculated for graph G')
-            pass
-
-    # Betweenness Centrality
-    if 'betweenness_centrality' in metric_list_nodal:
-        try:
-            bc_vector = betweenness_centrality(G_len, normalized=True)
-            print('\nExtracting Betweeness Centrality vector for all network nodes...')
-            bc_vals = list(bc_vector.values())
-            bc_nodes = list(bc_vector.keys())
-            num_nodes = len(bc_nodes)
-            bc_arr = np.zeros([num_nodes + 1, 2], dtype='object')
-            j = 0
-            for i in range(num_nodes):
-                bc_arr[j, 0] = "%s%s" % (str(bc_nodes[j]), '_betweenness_centrality')
-                #print('\n' + str(bc_nodes[j]) + '_betw_cent')
-                try:
-                    bc_arr[j, 1] = bc_vals[j]
-                except:
-                    print("%s%s%s" % ('Betweeness centrality is undefined for node ', str(j), ' of graph G'))
-                    bc_arr[j, 1] = np.nan
-                #print(str(bc_vals[j]))
-                j = j + 1
-            bc_arr[num_nodes, 0] = 'average_betweenness_centrality'
-            nonzero_arr_betw_cent = np.delete(bc_arr[:, 1], [0])
-            bc_arr[num_nodes, 1] = np.mean(nonzero_arr_betw_cent)
-            print("%s%s" % ('Mean Betweenness Centrality across nodes: ', str(bc_arr[num_nodes, 1])))
-            for i in bc_arr[:, 0]:
-                metric_list_names.append(i)
-            net_met_val_list_final = net_met_val_list_final + list(bc_arr[:, 1])
-        except:
-            print('Betweenness centrality cannot be calculated for graph G')
-            pass
-
-    # Eigenvector Centrality
-    if 'eigenvector_centrality' in metric_list_nodal:
-        try:
-            # try:
-            #     ec_vector = eigenvector_centrality(G_dir, max_iter=1000)
-            # except:
-            #     ec_vector = eigenvector_centrality(G, max_iter=1000)
-            ec_vector = eigenvector_centrality(G, max_iter=1000)
-            print('\nExtracting Eigenvector Centrality vector for all network nodes...')
-            ec_vals = list(ec_vector.values())
-            ec_nodes = list(ec_vector.keys())
-            num_nodes = len(ec_nodes)
-            ec_arr = np.zeros([num_nodes + 1, 2], dtype='object')
-            j = 0
-            for i in range(num_nodes):
-                ec_arr[j, 0] = "%s%s" % (str(ec_nodes[j]), '_eigenvector_centrality')
-                #print('\n' + str(ec_nodes[j]) + '_eig_cent')
-                try:
-                    ec_arr[j, 1] = ec_vals[j]
-                except:
-                    print("%s%s%s" % ('Eigenvector centrality is undefined for node ', str(j), ' of graph G'))
-                    ec_arr[j, 1] = np.nan
-                #print(str(ec_vals[j]))
-                j = j + 1
-            ec_arr[num_nodes, 0] = 'average_eigenvector_centrality'
-            nonzero_arr_eig_cent = np.delete(ec_arr[:, 1], [0])
-            ec_arr[num_nodes, 1] = np.mean(nonzero_arr_eig_cent)
-            print("%s%s" % ('Mean Eigenvector Centrality across nodes: ', str(ec_arr[num_nodes, 1])))
-            for i in ec_arr[:, 0]:
-                metric_list_names.append(i)
-            net_met_val_list_final = net_met_val_list_final + list(ec_arr[:, 1])
-        except:
-            print('Eigenvector centrality cannot be calculated for graph G')
-            pass
-
-    # Communicability Centrality
-    if 'communicability_centrality' in metric_list_nodal:
-        try:
-            cc_vector = communicability_betweenness_centrality(G, normalized=True)
-            print('\nExtracting Communicability Centrality vector for all network nodes...')
-            cc_vals = list(cc_vector.values())
-            cc_nodes = list(cc_vector.keys())
-            num_nodes = len(cc_nodes)
-            cc_arr = np.zeros([num_nodes + 1, 2], dtype='object')
-            j = 0
-            for i in range(num_nodes):
-                cc_arr[j, 0] = "%s%s" % (str(cc_nodes[j]), '_communicability_centrality')
-                #print('\n' + str(cc_nodes[j]) + '_comm_cent')
-                try:
-                    cc_arr[j, 1] = cc_vals[j]
-                except:
-                    print("%s%s%s" % ('Communicability centrality is undefined for node ', str(j), ' of graph G'))
-                    cc_arr[j, 1] = np.nan
-                #print(str(cc_vals[j]))
-                j = j + 1
-            cc_arr[num_nodes, 0] = 'average_communicability_centrality'
-            nonzero_arr_comm_cent = np.delete(cc_arr[:, 1], [0])
-            cc_arr[num_nodes, 1] = np.mean(nonzero_arr_comm_cent)
-            print("%s%s" % ('Mean Communicability Centrality across nodes: ', str(cc_arr[num_nodes, 1])))
-            for i in cc_arr[:, 0]:
-                metric_list_names.append(i)
-            net_met_val_list_final = net_met_val_list_final + list(cc_arr[:, 1])
-        except:
-            print('Communicability centrality cannot be calculated for graph G')
-            pass
-
-    # Rich club coefficient
-    if 'rich_club_coefficient' in metric_list_nodal:
-        try:
-            rc_vector = rich_club_coefficient(G, normalized=True)
-            print('\nExtracting Rich Club Coefficient vector for all network nodes...')
-            rc_vals = list(rc_vector.values())
-            rc_edges = list(rc_vector.keys())
-            num_edges = len(rc_edges)
-            rc_arr = np.zeros([num_edges + 1, 2], dtype='object')
-            j = 0
-            for i in range(num_edges):
-                rc_arr[j, 0] = "%s%s" % (str(rc_edges[j]), '_rich_club')
-                #print('\n' + str(rc_edges[j]) + '_rich_club')
-                try:
-                    rc_arr[j, 1] = rc_vals[j]
-                except:
-                    print("%s%s%s" % ('Rich club coefficient is undefined for node ', str(j), ' of graph G'))
-                    rc_arr[j, 1] = np.nan
-                #print(str(rc_vals[j]))
-                j = j + 1
-            # Add mean
-            rc_arr[num_edges, 0] = 'average_rich_club_coefficient'
-            nonzero_arr_rich_club = np.delete(rc_arr[:, 1], [0])
-            rc_arr[num_edges, 1] = np.mean(nonzero_arr_rich_club)
-            print("%s%s" % ('Mean Rich Club Coefficient across edges: ', str(rc_arr[num_edges, 1])))
-            for i in rc_arr[:, 0]:
-                metric_list_names.append(i)
-            net_met_val_list_final = net_met_val_list_final + list(rc_arr[:, 1])
-        except:
-            print('Rich club coefficient cannot be calculated for graph G')
-            pass
-
-    if roi:
-        met_list_picke_path = "%s%s%s%s" % (os.path.dirname(os.path.abspath(est_path)), '/net_metric_list', "%s" % ("%s%s%s" % ('_', network, '_') if network else "_"), os.path.basename(roi).split('.')[0])
-    else:
-        if network:
-            met_list_picke_path = "%s%s%s" % (os.path.dirname(os.path.abspath(est_path)), '/net_metric_list_', network)
-        else:
-            met_list_picke_path = "%s%s" % (os.path.dirname(os.path.abspath(est_path)), '/net_metric_list')
-    pickle.dump(metric_list_names, open(met_list_picke_path, 'wb'), protocol=2)
 
-    # And save results to csv
-    out_path = utils.create_csv_path(ID, network, conn_model, thr, roi, dir_path, node_size, smooth, c_boot)
-    np.savetxt(out_path, net_met_val_list_final, delimiter='\t')
+    # Save results as a single columnar table
+    out_path = "%s%s" % (utils.create_csv_path(ID, network, conn_model, thr, roi, dir_path, node_size, smooth,
+                                               c_boot).split('.csv')[0], '.npz')
+    np.savez(out_path, global_names=np.array(metric_list_names, dtype=str),
+             global_values=np.array(net_met_val_list_final, dtype=np.float64),
+             node_ids=np.array(nodes), nodal_names=np.array(nodal_names, dtype=str),
+             nodal_values=np.column_stack(nodal_cols) if nodal_cols else np.zeros((len(nodes), 0)),
+             rich_club_degrees=rc_degrees, rich_club_values=rc_vals,
+             metric_names=np.array(list(metric_paths.keys()), dtype=str),
+             metric_paths=np.array(list(metric_paths.values()), dtype=str))
 
     if frag is True:
-        out_path_neat = "%s%s" % (out_path.split('.csv')[0], '_frag_neat.csv')
+        out_path_neat = "%s%s" % (out_path.split('.npz')[0], '_frag_neat.csv')
     else:
-        out_path_neat = "%s%s" % (out_path.split('.csv')[0], '_neat.csv')
-    df = pd.DataFrame.from_dict(dict(zip(metric_list_names, net_met_val_list_final)), orient='index').transpose()
-    df.to_csv(out_path_neat, index=False)
+        out_path_neat = "%s%s" % (out_path.split('.npz')[0], '_neat.csv')
+    utils.net_metrics_to_dataframe(out_path).to_csv(out_path_neat, index=False)
 
     return out_path
@@ -5,7 +5,6 @@ Copyright (C) 2018
 @author: Derek Pisner (dPys)
 """
 import numpy as np
-import networkx as nx
 import os
 import warnings
 warnings.simplefilter("ignore")
@@ -89,9 +88,9 @@ def plot_community_conn_mat(conn_matrix, label_names, out_path_fig_comm, communi
     return
 
 
-def plot_conn_mat_func(conn_matrix, conn_model, atlas_select, dir_path, ID, network, label_names, roi, thr, node_size, smooth, c_boot):
-    import networkx as nx
+def plot_conn_mat_func(conn_matrix, conn_model, atlas_select, dir_path, ID, network, label_names, roi, thr, node_size, smooth, c_boot, community_aff=None):
     from pynets import plotting
+    from pynets.graph import ArrayGraph
     from pynets.netstats import modularity_louvain_und_sign
     if roi:
         out_path_fig = "%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s%s" % (dir_path, '/', str(ID), '_', str(atlas_select), "%s" % ("%s%s%s" % ('_', network, '_') if network else "_"), str(os.path.basename(roi).split('.')[0]), '_func_adj_mat_', str(conn_model), '_', str(thr), '_', str(node_size), '%s' % ("mm_" if node_size != 'parc' else "_"), "%s" % ("%s%s" % (int(c_boot), 'nb_') if float(c_boot) > 0 else 'nb_'), "%s" % ("%s%s" % (smooth, 'fwhm.png') if float(smooth) > 0 else 'nosm.png'))
@@ -102,9 +101,12 @@ def plot_conn_mat_func(conn_matrix, conn_model, atlas_select, dir_path, ID, netw
 
     plotting.plot_conn_mat(conn_matrix, label_names, out_path_fig)
     # Plot community adj. matrix
-    gamma = nx.density(nx.from_numpy_array(conn_matrix))
+    gamma = ArrayGraph(conn_matrix).density()
     try:
-        if network or len(conn_matrix) < 100:
+        if community_aff is not None:
+            # Consensus partition passed by plot_all (see netstats.consensus_communities)
+            node_comm_aff_mat = community_aff
+        elif network or len(conn_matrix) < 100:
             [node_comm_aff_mat, q] = modularity_louvain_und_sign(conn_matrix, gamma=float(gamma*0.001))
         else:
             [node_comm_aff_mat, q] = modularity_louvain_und_sign(conn_matrix, gamma=float(gamma*0.01))
@@ -126,12 +128,14 @@ def plot_conn_mat_struct(conn_matrix, conn_model, atlas_select, dir_path, ID, ne
     return
 
 
-def plot_connectogram(conn_matrix, conn_model, atlas_select, dir_path, ID, network, label_names):
+def plot_connectogram(conn_matrix, conn_model, atlas_select, dir_path, ID, network, label_names, community_aff=None):
     import json
     from pathlib import Path
     from networkx.readwrite import json_graph
     from pynets.thresholding import normalize
-    from pynets.netstats import most_important
+    from pynets import pruning
+    from pynets.graph import ArrayGraph
+    from pynets.netstats import restrict_communities
     from scipy.cluster.hierarchy import linkage, fcluster
     from nipype.utils.filemanip import save_json
 
@@ -149,14 +153,11 @@ def plot_connectogram(conn_matrix, conn_model, atlas_select, dir_path, ID, netwo
     # Advanced Settings
 
     conn_matrix = normalize(conn_matrix)
-    G = nx.from_numpy_matrix(conn_matrix)
     if pruned is True:
-        [G, pruned_nodes] = most_important(G)
-        conn_matrix = nx.to_numpy_array(G)
-
-        pruned_nodes.sort(reverse=True)
-        for j in pruned_nodes:
-            del label_names[label_names.index(label_names[j])]
+        keep = pruning.prune_mask(conn_matrix, 2)
+        [conn_matrix, label_names] = pruning.apply_mask(keep, conn_matrix, list(label_names))
+        if community_aff is not None:
+            community_aff = restrict_communities(community_aff, keep)
 
     def doClust(X, clust_levels):
         # get the linkage diagram
@@ -176,9 +177,12 @@ def plot_connectogram(conn_matrix, conn_model, atlas_select, dir_path, ID, netwo
     if comm == 'nodes' and len(conn_matrix) > 40:
         from pynets.netstats import modularity_louvain_und_sign
 
-        gamma = nx.density(nx.from_numpy_array(conn_matrix))
+        gamma = ArrayGraph(conn_matrix).density()
         try:
-            if network or len(conn_matrix) < 100:
+            if community_aff is not None:
+                # Consensus partition passed by plot_all (see netstats.consensus_communities)
+                node_comm_aff_mat = community_aff
+            elif network or len(conn_matrix) < 100:
                 [node_comm_aff_mat, q] = modularity_louvain_und_sign(conn_matrix, gamma=float(gamma * 0.001))
             else:
                 [node_comm_aff_mat, q] = modularity_louvain_und_sign(conn_matrix, gamma=float(gamma * 0.01))
@@ -195,6 +199,9 @@ def plot_connectogram(conn_matrix, conn_model, atlas_select, dir_path, ID, netwo
         # Plot link communities
         link_comm_aff_mat = link_communities(conn_matrix, type_clustering='single')
         print("%s%s%s" % ('Found ', str(len(link_comm_aff_mat)), ' communities...'))
+        if len(link_comm_aff_mat) == 0:
+            print('\nWARNING: No link communities found. Proceeding with single community affiliation vector...')
+            link_comm_aff_mat = np.ones((1, conn_matrix.shape[0])).astype('int')
         clust_levels = len(link_comm_aff_mat)
         clust_levels_tmp = int(clust_levels) - 1
         mask_mat = np.squeeze(np.array([link_comm_aff_mat == 0]).astype('int'))
@@ -256,17 +263,9 @@ def plot_connectogram(conn_matrix, conn_model, atlas_select, dir_path, ID, netwo
 
     output = []
 
-    adj_dict = {}
-    for i in list(G.adjacency()):
-        source = list(i)[0]
-        target = list(list(i)[1])
-        adj_dict[source] = target
-
-    for node_idx, connections in adj_dict.items():
-        weight_vec = []
-        for i in connections:
-            wei = G.get_edge_data(node_idx,int(i))['weight']
-            weight_vec.append(wei)
+    for node_idx in range(len(conn_matrix)):
+        connections = np.nonzero(conn_matrix[node_idx])[0]
+        weight_vec = conn_matrix[node_idx, connections].tolist()
         entry = {}
         nodes_label = get_node_label(node_idx, label_arr, clust_levels_tmp)
         entry["name"] = nodes_label
@@ -295,7 +294,7 @@ def plot_connectogram(conn_matrix, conn_model, atlas_select, dir_path, ID, netwo
     save_json(connectogram_plot, output)
 
     # Force-directed graphing
-    G = nx.from_numpy_matrix(np.round(conn_matrix.astype('float64'), 6))
+    G = ArrayGraph(np.round(conn_matrix.astype('float64'), 6)).to_networkx()
     data = json_graph.node_link_data(G)
     data.pop('directed', None)
     data.pop('graph', None)
@@ -377,14 +376,28 @@ def plot_all(conn_matrix, conn_model, atlas_select, dir_path, ID, network, label
     from matplotlib import pyplot as plt
     from nilearn import plotting as niplot
     import pkg_resources
-    import networkx as nx
-    from pynets import plotting, thresholding
-    from pynets.netstats import most_important, prune_disconnected
+    from pynets import netstats, plotting, pruning, thresholding, utils
     try:
         import cPickle as pickle
     except ImportError:
         import _pickle as pickle
 
+    # Advanced Settings
+    # Number of Louvain seeds for consensus community detection (0 runs a single seed). The consensus partition is
+    # computed on the conditioned, unpruned matrix, as in extractnetstats, so that both share one cached partition
+    consensus_seeds = 0
+    # Advanced Settings
+
+    # The thresholded matrix may also be passed as the path of a saved estimate (see utils.save_est)
+    if isinstance(conn_matrix, str):
+        conn_matrix = utils.load_est(conn_matrix)
+    # Partition and prune the same conditioned matrix as extractnetstats, so that both share one cached partition and
+    # keep-mask. It is only conditioned when either is needed
+    in_mat = None
+    community_aff = None
+    if consensus_seeds > 0:
+        in_mat = thresholding.condition_matrix(conn_matrix, conn_model)
+        [community_aff, _] = netstats.consensus_communities(in_mat, consensus_seeds)
     coords = list(coords)
     label_names = list(label_names)
     if len(coords) > 0:
@@ -392,25 +405,15 @@ def plot_all(conn_matrix, conn_model, atlas_select, dir_path, ID, network, label
         if '\'b' in atlas_select:
             atlas_select = atlas_select.decode('utf-8')
         if (prune == 1 or prune == 2) and len(coords) == conn_matrix.shape[0]:
-            G_pre = nx.from_numpy_matrix(conn_matrix)
-            if prune == 1:
-                [G, pruned_nodes] = prune_disconnected(G_pre)
-            elif prune == 2:
-                [G, pruned_nodes] = most_important(G_pre)
-            else:
-                G = G_pre
-                pruned_nodes = []
-            pruned_nodes.sort(reverse=True)
+            # The keep-mask is cached by graph, and shared with extractnetstats
+            if in_mat is None:
+                in_mat = thresholding.condition_matrix(conn_matrix, conn_model)
+            keep = pruning.prune_mask(in_mat, prune)
             print('(Display)')
-            coords_pre = list(coords)
-            label_names_pre = list(label_names)
-            if len(pruned_nodes) > 0:
-                for j in pruned_nodes:
-                    label_names_pre.pop(j)
-                    coords_pre.pop(j)
-                conn_matrix = nx.to_numpy_array(G)
-                label_names = label_names_pre
-                coords = coords_pre
+            if not np.all(keep):
+                [conn_matrix, coords, label_names] = pruning.apply_mask(keep, conn_matrix, coords, label_names)
+                if community_aff is not None:
+                    community_aff = netstats.restrict_communities(community_aff, keep)
             else:
                 print('No nodes to prune for plot...')
 
@@ -418,7 +421,8 @@ def plot_all(conn_matrix, conn_model, atlas_select, dir_path, ID, network, label
         # Plot connectogram
         if len(conn_matrix) > 20:
             try:
-                plotting.plot_connectogram(conn_matrix, conn_model, atlas_select, dir_path, ID, network, label_names)
+                plotting.plot_connectogram(conn_matrix, conn_model, atlas_select, dir_path, ID, network, label_names,
+                                           community_aff=community_aff)
             except RuntimeWarning:
                 print('\n\n\nWarning: Connectogram plotting failed!')
         else:
@@ -428,7 +432,7 @@ def plot_all(conn_matrix, conn_model, atlas_select, dir_path, ID, network, label
         if not node_size or node_size == 'None':
             node_size = 'parc'
         plotting.plot_conn_mat_func(conn_matrix, conn_model, atlas_select, dir_path, ID, network, label_names, roi,
-                                    thr, node_size, smooth, c_boot)
+                                    thr, node_size, smooth, c_boot, community_aff=community_aff)
 
         # Plot connectome
         if roi:
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Nov  7 10:40:07 2017
+Copyright (C) 2018
+@author: Derek Pisner (dPys)
+"""
+import os
+import numpy as np
+import warnings
+warnings.simplefilter("ignore")
+
+
+def _adjacency(W):
+    """Return the symmetric binary adjacency array of W, without self-loops"""
+    W = np.nan_to_num(np.asarray(W), nan=0, posinf=0, neginf=0)
+    A = np.logical_or(W != 0, W.T != 0)
+    np.fill_diagonal(A, False)
+    return A
+
+
+def largest_component_mask(W, keep=None):
+    """
+    Keep-mask of the nodes in the largest connected component of a graph.
+
+    Parameters
+    ----------
+    W : NxN np.ndarray
+        adjacency matrix. Nonzero entries are edges.
+    keep : Nx1 np.ndarray
+        optional boolean mask of candidate nodes. The largest component is then that of the subgraph they induce.
+
+    Returns
+    -------
+    keep : Nx1 np.ndarray
+        boolean mask of the nodes of the largest connected component. Ties are broken in favor of the component
+        containing the lowest-indexed node.
+    """
+    from scipy.sparse.csgraph import connected_components
+    A = _adjacency(W)
+    n = len(A)
+    if keep is None:
+        keep = np.ones(n, dtype=bool)
+    ix = np.where(keep)[0]
+    mask = np.zeros(n, dtype=bool)
+    if len(ix) == 0:
+        return mask
+    [_, labels] = connected_components(A[np.ix_(ix, ix)], directed=False)
+    mask[ix[labels == np.argmax(np.bincount(labels))]] = True
+    return mask
+
+
+def importance_mask(W, bc=None):
+    """
+    Keep-mask of the nodes in the largest connected component left after removing low-importance nodes, i.e. those
+    whose betweenness centrality is more than 3 standard deviations below the mean.
+
+    Parameters
+    ----------
+    W : NxN np.ndarray
+        adjacency matrix. Nonzero entries are edges.
+    bc : Nx1 np.ndarray
+        optional betweenness centrality of each node, so that it is not computed again.
+
+    Returns
+    -------
+    keep : Nx1 np.ndarray
+        boolean mask of the kept nodes.
+    """
+    if bc is None:
+        import networkx as nx
+        from pynets.netstats import betweenness_centrality_vector
+        bc = betweenness_centrality_vector(nx.from_numpy_array(_adjacency(W).astype(np.float64)))[0]
+    bc = np.asarray(bc)
+    return largest_component_mask(W, keep=bc >= np.mean(bc) - 3 * np.std(bc))
+
+
+def prune_mask(W, prune, bc=None, use_cache=True):
+    """
+    Keep-mask of the nodes of a graph that survive pruning.
+
+    Parameters
+    ----------
+    W : NxN np.ndarray
+        adjacency matrix. Nonzero entries are edges.
+    prune : int
+        0 (keep all nodes), 1 (keep the largest connected component, see largest_component_mask) or 2 (also prune
+        low-importance nodes, see importance_mask).
+    bc : Nx1 np.ndarray or callable
+        optional betweenness centrality of each node, used when prune=2, or a function of no arguments returning it,
+        which is only called when the mask is not cached.
+    use_cache : bool
+        If True, the mask is stored on disk keyed by the binary adjacency matrix (with nan and inf weights removed), so
+        that every consumer of the same graph shares one pruning, even when their weights differ. extractnetstats and
+        plot_all both pass the conditioned matrix (see thresholding.condition_matrix), whose rounding may remove
+        edges of negligible weight.
+
+    Returns
+    -------
+    keep : Nx1 np.ndarray
+        boolean mask of the kept nodes.
+    """
+    import hashlib
+    from pynets import utils
+    prune = int(prune) if prune else 0
+    A = _adjacency(W)
+    if prune not in (1, 2):
+        return np.ones(len(A), dtype=bool)
+
+    cache_path = None
+    if use_cache is True:
+        key = hashlib.sha1(np.packbits(A).tobytes())
+        key.update(("%s_%s" % (len(A), prune)).encode())
+        cache_path = os.path.join(utils.get_cache_dir('pruning'), "%s%s%s" % ('keep_', key.hexdigest(), '.npy'))
+        if os.path.isfile(cache_path):
+            try:
+                return np.load(cache_path)
+            except Exception:
+                # Unreadable cache, prune again
+                pass
+
+    if prune == 1:
+        print('Pruning fully disconnected...')
+        keep = largest_component_mask(A)
+    else:
+        print('Pruning fully disconnected and low importance nodes (3 SD < M)...')
+        keep = importance_mask(A, bc=bc() if callable(bc) else bc)
+    if cache_path is not None:
+        utils.atomic_write(cache_path, lambda f: np.save(f, keep))
+    return keep
+
+
+def apply_mask(keep, conn_matrix, *node_arrays):
+    """
+    Restrict a connectivity matrix, and any number of per-node arrays (e.g. coordinates or labels), to the kept nodes.
+
+    Parameters
+    ----------
+    keep : Nx1 np.ndarray
+        boolean mask of the kept nodes.
+    conn_matrix : NxN np.ndarray
+        connectivity matrix.
+    node_arrays : lists or np.ndarrays of length N
+        per-node values. Lists are returned as lists.
+
+    Returns
+    -------
+    conn_matrix, followed by each of node_arrays, restricted to the kept nodes.
+    """
+    keep = np.asarray(keep, dtype=bool)
+    out = [np.asarray(conn_matrix)[np.ix_(keep, keep)]]
+    for node_array in node_arrays:
+        if isinstance(node_array, list):
+            out.append(np.asarray(node_array)[keep].tolist())
+        else:
+            out.append(np.asarray(node_array)[keep])
+    return out
+
+
+def subgraph(G, keep):
+    """Return a copy of the subgraph of G induced by the kept nodes, in the node order of G"""
+    nodes = [node for node, k in zip(G.nodes(), keep) if k]
+    H = G.__class__()
+    H.graph.update(G.graph)
+    H.add_nodes_from((node, G.nodes[node]) for node in nodes)
+    H.add_edges_from(G.subgraph(nodes).edges(data=True))
+    return H
@@ -24,7 +24,7 @@ def get_parser():
     parser.add_argument('-g',
                         metavar='Path to graph file input.',
                         default=None,
-                        help='In either .txt or .npy format. This skips fMRI and dMRI graph estimation workflows and begins at the graph analysis stage.\n')
+                        help='In either .txt, .npy or .npz (compact, see utils.save_est) format. This skips fMRI and dMRI graph estimation workflows and begins at the graph analysis stage.\n')
     parser.add_argument('-dwi',
                         metavar='Path to a directory containing diffusion data (required for structural connectomes)',
                         default=None,
@@ -627,6 +627,8 @@ def build_workflow(args, retval):
                     graph_name = os.path.basename(graph).split('.txt')[0]
                 elif '.npy' in graph:
                     graph_name = os.path.basename(graph).split('.npy')[0]
+                elif '.npz' in graph:
+                    graph_name = os.path.basename(graph).split('.npz')[0]
                 else:
                     print('Error: input graph file format not recognized. See -help for supported formats.')
                     sys.exit(0)
@@ -639,6 +641,8 @@ def build_workflow(args, retval):
                 graph_name = os.path.basename(graph).split('.txt')[0]
             elif '.npy' in graph:
                 graph_name = os.path.basename(graph).split('.npy')[0]
+            elif '.npz' in graph:
+                graph_name = os.path.basename(graph).split('.npz')[0]
             else:
                 print('Error: input graph file format not recognized. See -help for supported formats.')
                 sys.exit(0)
@@ -44,6 +44,114 @@ def threshold_proportional(W, p, copy=True):
     return W
 
 
+class ThresholdSweep(object):
+    """Proportional thresholds of one connectivity matrix from a single ranking of its edges
+
+    The edges (of the upper triangle, if the matrix is symmetric) are ranked
+    by weight once, in the same order as threshold_proportional, so every
+    threshold of a sweep selects a prefix of that ranking. Matrices and
+    masks are then updated by adding or removing only the edges between two
+    consecutive thresholds.
+
+    Parameters
+    ----------
+    W : NxN np.ndarray
+        unthresholded connectivity matrix. It is not modified.
+    """
+
+    def __init__(self, W):
+        W = np.asarray(W)
+        n = len(W)
+        self.shape = W.shape
+        self.dtype = W.dtype
+        self.symmetric = bool(np.allclose(W, W.T))
+        if self.symmetric:
+            [rows, cols] = np.nonzero(np.triu(W, 1))
+        else:
+            off_diag = W.copy()
+            np.fill_diagonal(off_diag, 0)
+            [rows, cols] = np.nonzero(off_diag)
+        weights = W[rows, cols]
+        I = np.argsort(weights)[::-1]
+        self.rows = rows[I]
+        self.cols = cols[I]
+        self.weights = weights[I]
+
+    def edge_count(self, thr):
+        """Return the number of edges kept by the proportional threshold thr"""
+        if thr > 1 or thr < 0:
+            raise ValueError('Threshold must be in range [0,1]')
+        ud = 2 if self.symmetric else 1
+        return min(int(round((self.shape[0] * self.shape[0] - self.shape[0]) * float(thr) / ud)), len(self.weights))
+
+    def _walk(self, out, thresholds, values, copy):
+        m = 0
+        for thr in thresholds:
+            en = self.edge_count(thr)
+            if en != m:
+                [lo, hi] = sorted([m, en])
+                if en < m:
+                    fill = 0
+                else:
+                    fill = True if values is None else values[lo:hi]
+                out[self.rows[lo:hi], self.cols[lo:hi]] = fill
+                if self.symmetric:
+                    out[self.cols[lo:hi], self.rows[lo:hi]] = fill
+                m = en
+            yield thr, out.copy() if copy is True else out
+
+    def matrices(self, thresholds, copy=True):
+        """
+        Yield (thr, conn_matrix_thr) for each threshold, in the order given, where conn_matrix_thr equals
+        threshold_proportional(W, thr).
+
+        If copy is False, the same array is updated in place and yielded at every step, which avoids one N x N
+        copy per threshold for consumers that do not keep it.
+        """
+        return self._walk(np.zeros(self.shape, dtype=self.dtype), thresholds, self.weights, copy)
+
+    def masks(self, thresholds, copy=True):
+        """Yield (thr, mask) for each threshold, where mask is the boolean NxN matrix of the edges it keeps"""
+        return self._walk(np.zeros(self.shape, dtype=bool), thresholds, None, copy)
+
+    def matrix(self, thr):
+        return next(self.matrices([thr], copy=False))[1]
+
+    def mask(self, thr):
+        return next(self.masks([thr], copy=False))[1]
+
+    def extractnetstats(self, thresholds, ID, network, conn_model, dir_path, roi, prune, node_size, smooth, c_boot,
+                        save=False):
+        """
+        Compute the graph metrics of each thresholded matrix in memory, with netstats.extractnetstats.
+
+        Parameters
+        ----------
+        thresholds : list
+            proportional thresholds in [0, 1].
+        ID, network, conn_model, dir_path, roi, prune, node_size, smooth, c_boot :
+            as in thresh_func. Results are written next to the est_path each threshold would have had.
+        save : bool
+            If True, also save each thresholded matrix to its est_path (see utils.save_est). default value=False.
+
+        Returns
+        -------
+        out_paths : list
+            path of the metrics table of each threshold.
+        """
+        from pynets import utils
+        from pynets.netstats import extractnetstats
+        out_paths = []
+        for thr, conn_matrix_thr in self.matrices(thresholds, copy=False):
+            est_path = utils.create_est_path(ID, network, conn_model, thr, roi, dir_path, node_size, smooth, c_boot,
+                                             'prop')
+            if save is True:
+                est_path = utils.save_est(conn_matrix_thr, est_path)
+            out_paths.append(extractnetstats(ID, network, thr, conn_model, est_path, roi, prune, node_size, smooth,
+                                             c_boot, conn_matrix=conn_matrix_thr))
+        return out_paths
+
+
 def normalize(W, copy=True):
     '''# Adapted from bctpy
     '''
@@ -54,31 +162,56 @@ def normalize(W, copy=True):
 
 
 def density_thresholding(conn_matrix, thr):
-    from pynets import thresholding
-    work_thr = 0.0
-    conn_matrix = thresholding.normalize(conn_matrix)
-    np.fill_diagonal(conn_matrix, 0)
-    i = 1
-    thr_max = 0.50
-    G = nx.from_numpy_matrix(conn_matrix)
-    density = nx.density(G)
-    while float(work_thr) <= float(thr_max) and float(density) > float(thr):
-        work_thr = float(work_thr) + float(0.01)
-        conn_matrix = thresholding.threshold_proportional(conn_matrix, work_thr)
-        G = nx.from_numpy_matrix(conn_matrix)
-        density = nx.density(G)
-        print("%s%d%s%.2f%s%.2f%s" % ('Iteratively thresholding -- Iteration ', i, ' -- with thresh: ', float(work_thr), ' and Density: ', float(density), '...'))
-        i = i + 1
-    return conn_matrix
+    """
+    Threshold a connectivity matrix to a target density, keeping its strongest edges.
+
+    The off-diagonal weights (of the upper triangle, if the matrix is symmetric) are sorted once, and all edges
+    ranked below the number of edges of the target density are removed, so the density of the result is the
+    nearest achievable to thr (or that of the input, if it is already sparser).
+
+    Parameters
+    ----------
+    conn_matrix : NxN np.ndarray
+        connectivity matrix.
+    thr : float
+        target density in [0, 1].
+
+    Returns
+    -------
+    conn_matrix : NxN np.ndarray
+        normalized (see normalize) matrix thresholded to the target density, with a zeroed diagonal.
+    """
+    if thr > 1 or thr < 0:
+        raise ValueError('Density must be in range [0,1]')
+    W = normalize(np.array(conn_matrix, dtype=np.float64), copy=False)
+    n = len(W)
+    np.fill_diagonal(W, 0)
+    if np.allclose(W, W.T):
+        [rows, cols] = np.triu_indices(n, k=1)
+        ud = 2
+    else:
+        [rows, cols] = np.where(~np.eye(n, dtype=bool))
+        ud = 1
+    weights = W[rows, cols]
+    edges = np.flatnonzero(weights)
+    en = int(round((n * n - n) * float(thr) / ud))
+    if len(edges) > en:
+        # Rank the edges by weight (in decreasing order, stable for ties) and cut at the target edge count
+        order = edges[np.argsort(-weights[edges], kind='mergesort')]
+        drop = order[en:]
+        W[rows[drop], cols[drop]] = 0
+        if ud == 2:
+            W[cols[drop], rows[drop]] = 0
+    print("%s%.4f%s" % ('Thresholded to density: ', est_density(W), '...'))
+    return W
 
 
 # Calculate density
 def est_density(func_mat):
     '''# Adapted from bctpy
     '''
-    fG=nx.from_numpy_matrix(func_mat)
-    density=nx.density(fG)
-    return density
+    from pynets.graph import ArrayGraph
+    return ArrayGraph(func_mat).density()
 
 
 def thr2prob(W, copy=True):
@@ -141,63 +274,154 @@ def autofix(W, copy=True):
     return W
 
 
+def _is_symmetric(W, block=256):
+    """Check np.allclose(W, W.T) one block of rows at a time, so that no full-size temporary is allocated"""
+    n = len(W)
+    for start in range(0, n, block):
+        if not np.allclose(W[start:start + block], W[:, start:start + block].T):
+            return False
+    return True
+
+
+def _mirror_upper(W, block=256):
+    """Copy the upper triangle of W onto its lower triangle in place, one block of rows at a time"""
+    n = len(W)
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        W[start:stop, :start] = W[:start, start:stop].T
+        diag = W[start:stop, start:stop]
+        lower = np.tril_indices(stop - start, k=-1)
+        diag[lower] = diag.T[lower]
+    return W
+
+
+def condition_matrix(W, conn_model=None, dtype=np.float64, copy=True):
+    """
+    Prepare a connectivity matrix for graph analysis in place: zero the diagonal, replace nan and inf with 0,
+    round (symmetric matrices) to 5 decimals as in autofix, normalize to a maximum absolute weight of 1 and, for
+    correlation models, apply the Fisher r-to-z transform.
+
+    Parameters
+    ----------
+    W : NxN np.ndarray
+        connectivity matrix.
+    conn_model : str
+        connectivity model. If 'corr', the Fisher transform (np.arctanh) is applied, with weights of absolute value
+        1 clipped to the largest value below 1 so that they stay finite.
+    dtype : np.dtype
+        working precision. np.float32 halves the memory of large (e.g. voxelwise) matrices. default value=np.float64.
+    copy : bool
+        If False and W is a writeable array of the requested dtype, W itself is conditioned. Otherwise, one working copy of W
+        is made.
+
+    Returns
+    -------
+    W : NxN np.ndarray
+        conditioned matrix.
+    """
+    if copy is True or not isinstance(W, np.ndarray) or W.dtype != np.dtype(dtype) or not W.flags.writeable:
+        W = np.array(W, dtype=dtype)
+    np.fill_diagonal(W, 0)
+    np.nan_to_num(W, copy=False, nan=0, posinf=0, neginf=0)
+    if _is_symmetric(W):
+        np.around(W, decimals=5, out=W)
+        _mirror_upper(W)
+    scale = max(np.max(W), -np.min(W)) if W.size > 0 else 0
+    if scale > 0:
+        W /= scale
+    if conn_model == 'corr':
+        bound = np.nextafter(W.dtype.type(1), W.dtype.type(0))
+        np.clip(W, -bound, bound, out=W)
+        np.arctanh(W, out=W)
+    return W
+
+
+def disparity_alpha(W, directed=None):
+    '''
+    Compute the disparity significance (alpha) of every edge of a weight matrix from both of its end nodes, as
+    defined in Serrano et al. 2009. For the edge i -> j, the significance with respect to node i is
+    alpha_ij = (1 - |w_ij| / s_i) ** (k_i - 1), with s_i and k_i the strength and degree of i, the closed form of
+    1 - (k_i - 1) * integral_0^p_ij (1 - x) ** (k_i - 2) dx. In a directed graph, an edge that is both the only edge
+    out of its tail and the only edge into its head is the only way to keep them connected, and is always kept
+    (alpha_out = alpha_in = 0).
+        Args
+            W: NxN np.ndarray of weights (nan and the diagonal are ignored)
+            directed: whether W is a directed graph. If None, W is directed if it is asymmetric.
+        Returns
+            alpha_out: NxN np.ndarray of significances of each edge w.r.t. its row node (1 for non-edges)
+            alpha_in: NxN np.ndarray of significances of each edge w.r.t. its column node (1 for non-edges). For a
+            symmetric W, alpha_in is the transpose of alpha_out.
+        References
+            M. A. Serrano et al. (2009) Extracting the Multiscale backbone of complex weighted networks. PNAS, 106:16, pp. 6483-6488.
+    '''
+    W = np.abs(np.nan_to_num(np.array(W, dtype=np.float64)))
+    np.fill_diagonal(W, 0)
+    E = W != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha_out = (1 - W / np.sum(W, axis=1)[:, np.newaxis]) ** (np.sum(E, axis=1)[:, np.newaxis] - 1)
+        alpha_in = (1 - W / np.sum(W, axis=0)[np.newaxis, :]) ** (np.sum(E, axis=0)[np.newaxis, :] - 1)
+    alpha_out[~E] = 1
+    alpha_in[~E] = 1
+    if directed is None:
+        directed = not np.allclose(W, W.T)
+    if directed:
+        only = E & (np.sum(E, axis=1)[:, np.newaxis] == 1) & (np.sum(E, axis=0)[np.newaxis, :] == 1)
+        alpha_out[only] = 0
+        alpha_in[only] = 0
+    return alpha_out, alpha_in
+
+
+def disparity_filter_masks(W, alphas, cut_mode='or'):
+    '''
+    Extract the disparity filter backbone of a weight matrix at several significance levels at once.
+        Args
+            W: NxN np.ndarray of weights, directed if asymmetric (see disparity_alpha)
+            alphas: list of significance levels in [0, 1]
+            cut_mode: 'or' keeps edges significant w.r.t. either end node, 'and' those significant w.r.t. both
+        Returns
+            masks: len(alphas)xNxN boolean np.ndarray of the edges kept at each significance level
+    '''
+    [alpha_out, alpha_in] = disparity_alpha(W)
+    if cut_mode == 'or':
+        alpha = np.minimum(alpha_out, alpha_in)
+    elif cut_mode == 'and':
+        alpha = np.maximum(alpha_out, alpha_in)
+    else:
+        raise ValueError("cut_mode must be 'or' or 'and'")
+    E = np.nan_to_num(np.asarray(W, dtype=np.float64)) != 0
+    np.fill_diagonal(E, False)
+    alphas = np.atleast_1d(np.asarray(alphas, dtype=np.float64))
+    return (alpha[np.newaxis, :, :] < alphas[:, np.newaxis, np.newaxis]) & E[np.newaxis, :, :]
+
+
 def disparity_filter(G, weight='weight'):
-    from scipy import integrate
     ''' 
     Compute significance scores (alpha) for weighted edges in G as defined in Serrano et al. 2009
         Args
             G: Weighted NetworkX graph
         Returns
-            Weighted graph with a significance score (alpha) assigned to each edge
+            Weighted graph with a significance score (alpha) assigned to each edge. For undirected graphs, alpha is
+            the smaller of the significances w.r.t. both end nodes; for directed graphs, alpha_out and alpha_in are
+            those w.r.t. the tail and the head.
         References
             M. A. Serrano et al. (2009) Extracting the Multiscale backbone of complex weighted networks. PNAS, 106:16, pp. 6483-6488.
     '''
-
-    if nx.is_directed(G):  # directed case
+    nodes = list(G.nodes())
+    W = nx.to_numpy_array(G, nodelist=nodes, weight=weight)
+    [alpha_out, alpha_in] = np.round(disparity_alpha(W, directed=nx.is_directed(G)), 4)
+    [rows, cols] = np.nonzero(W)
+    if nx.is_directed(G):
         N = nx.DiGraph()
-        for u in G:
-
-            k_out = G.out_degree(u)
-            k_in = G.in_degree(u)
-
-            if k_out > 1:
-                sum_w_out = sum(np.absolute(G[u][v][weight]) for v in G.successors(u))
-                for v in G.successors(u):
-                    w = G[u][v][weight]
-                    p_ij_out = float(np.absolute(w)) / sum_w_out
-                    alpha_ij_out = 1 - (k_out - 1) * integrate.quad(lambda x: (1 - x) ** (k_out - 2), 0, p_ij_out)[0]
-                    N.add_edge(u, v, weight=w, alpha_out=float('%.4f' % alpha_ij_out))
-
-            elif k_out == 1 and G.in_degree(G.successors(u)[0]) == 1:
-                # we need to keep the connection as it is the only way to maintain the connectivity of the network
-                v = G.successors(u)[0]
-                w = G[u][v][weight]
-                N.add_edge(u, v, weight=w, alpha_out=0., alpha_in=0.)
-                # there is no need to do the same for the k_in, since the link is built already from the tail
-
-            if k_in > 1:
-                sum_w_in = sum(np.absolute(G[v][u][weight]) for v in G.predecessors(u))
-                for v in G.predecessors(u):
-                    w = G[v][u][weight]
-                    p_ij_in = float(np.absolute(w)) / sum_w_in
-                    alpha_ij_in = 1 - (k_in - 1) * integrate.quad(lambda x: (1 - x) ** (k_in - 2), 0, p_ij_in)[0]
-                    N.add_edge(v, u, weight=w, alpha_in=float('%.4f' % alpha_ij_in))
+        N.add_nodes_from(nodes)
+        N.add_edges_from((nodes[i], nodes[j], {'weight': W[i, j], 'alpha_out': alpha_out[i, j],
+                                               'alpha_in': alpha_in[i, j]}) for i, j in zip(rows, cols) if i != j)
         return N
-
-    else:  # undirected case
-        B = nx.Graph()
-        for u in G:
-            k = len(G[u])
-            if k > 1:
-                sum_w = sum(np.absolute(G[u][v][weight]) for v in G[u])
-                for v in G[u]:
-                    w = G[u][v][weight]
-                    p_ij = float(np.absolute(w)) / sum_w
-                    alpha_ij = 1 - (k - 1) * integrate.quad(lambda x: (1 - x) ** (k - 2), 0, p_ij)[0]
-                    B.add_edge(u, v, weight=w, alpha=float('%.4f' % alpha_ij))
-            else:
-                B.add_node(u)
-        return B
+    B = nx.Graph()
+    B.add_nodes_from(nodes)
+    alpha = np.minimum(alpha_out, alpha_in)
+    B.add_edges_from((nodes[i], nodes[j], {'weight': W[i, j], 'alpha': alpha[i, j]})
+                     for i, j in zip(rows, cols) if i < j)
+    return B
 
 
 def disparity_filter_alpha_cut(G, weight='weight', alpha_t=0.4, cut_mode='or'):
@@ -279,159 +503,106 @@ def weight_to_distance(G):
     return G
 
 
+def knn_ranking(conn_matrix):
+    """
+    Rank the neighbours of each node in decreasing order of connection weight, once for all k.
+
+    Returns
+    -------
+    order : Nx(N-1) np.ndarray
+        order[i, k - 1] is the k-th nearest neighbour of node i, so the k-nearest neighbour graph is the first k
+        columns.
+    """
+    W = np.nan_to_num(np.array(conn_matrix, dtype=np.float64))
+    np.fill_diagonal(W, -np.inf)
+    return np.argsort(-W, axis=1, kind='mergesort')[:, :-1]
+
+
 def knn(conn_matrix, k):
     """
     Creating a k-nearest neighbour graph
     """
+    n = len(conn_matrix)
     gra = nx.Graph()
-    nodes = list(range(len(conn_matrix[0])))
-    gra.add_nodes_from(nodes)
-    for i in nodes:
-        line = np.ma.masked_array(conn_matrix[i, :], roi=np.isnan(conn_matrix[i]))
-        line.mask[i] = True
-        for _ in range(k):
-            node = np.argmax(line)
-            if not np.isnan(conn_matrix[i, node]):
-                gra.add_edge(i, node)
-
-            line.mask[node] = True
-
+    gra.add_nodes_from(range(n))
+    rows = np.repeat(np.arange(n), min(k, n - 1))
+    cols = knn_ranking(conn_matrix)[:, :k].ravel()
+    keep = ~np.isnan(conn_matrix[rows, cols])
+    gra.add_edges_from(zip(rows[keep].tolist(), cols[keep].tolist()))
     return gra
 
 
-def local_thresholding_prop(conn_matrix, thr):
-    from pynets import netstats, thresholding
-    '''
-    Threshold the adjacency matrix by building from the minimum spanning tree (MST) and adding
-    successive N-nearest neighbour degree graphs to achieve target proportional threshold.
-    '''
+def _local_thresholding(conn_matrix, edgenum, thr):
+    """
+    Grow the maximum spanning tree of conn_matrix with the edges of successive k-nearest neighbour graphs (in
+    decreasing order of weight within each k) until it has edgenum edges.
 
-    fail_tol = 10
-    conn_matrix = np.nan_to_num(conn_matrix)
-    G = nx.from_numpy_matrix(conn_matrix)
-    if not nx.is_connected(G):
-        [G, _] = netstats.prune_disconnected(G)
+    As before, a graph with nodes disconnected from the largest component (whose spanning tree would be a forest)
+    raises a RuntimeWarning instead.
+    """
+    from pynets import pruning
+    from pynets.graph import ArrayGraph
+    W = np.nan_to_num(np.array(conn_matrix, dtype=np.float64))
+    np.fill_diagonal(W, 0)
+    n = len(W)
+    if not np.all(pruning.largest_component_mask(W)):
+        raise RuntimeWarning("%s%s%s" % ('Cannot apply local thresholding to achieve threshold of: ', thr, '. Try a higher -thr or -min_thr'))
 
-    maximum_edges = G.number_of_edges()
-    G = thresholding.weight_to_distance(G)
-    min_t = nx.minimum_spanning_tree(G, weight="distance")
+    # The minimum spanning tree on distances that decrease with weight, i.e. the maximum spanning tree
+    min_t = ArrayGraph(W).minimum_spanning_tree(distance=-W)
     len_edges = min_t.number_of_edges()
-    upper_values = np.triu_indices(np.shape(conn_matrix)[0], k=1)
-    weights = np.array(conn_matrix[upper_values])
-    weights = weights[~np.isnan(weights)]
-    edgenum = int(float(thr) * float(len(weights)))
-    if len_edges > edgenum:
+    if len_edges >= edgenum:
         print("%s%s%s" % ('Warning: The minimum spanning tree already has: ', len_edges, ' edges, select more edges. Local Threshold will be applied by just retaining the Minimum Spanning Tree'))
-        conn_matrix_thr = nx.to_numpy_array(G)
-        return conn_matrix_thr
-
-    k = 1
-    len_edge_list = []
-    while len_edges < edgenum and k <= np.shape(conn_matrix)[0] and (len(len_edge_list[-fail_tol:]) - len(set(len_edge_list[-fail_tol:]))) < (fail_tol-1):
-        print(k)
-        print(len_edges)
-        len_edge_list.append(len_edges)
-        # Create nearest neighbour graph
-        nng = thresholding.knn(conn_matrix, k)
-        number_before = nng.number_of_edges()
-        # Remove edges from the NNG that exist already in the new graph/MST
-        nng.remove_edges_from(min_t.edges())
-        if nng.number_of_edges() == 0 and number_before >= maximum_edges:
-            break
-
-        # Add weights to NNG
-        for e in nng.edges():
-            nng.edges[e[0], e[1]]['weight'] = float(conn_matrix[e[0], e[1]])
-
-        # Obtain list of edges from the NNG in order of weight
-        edge_list = sorted(nng.edges(data=True), key=lambda t: t[2]['weight'], reverse=True)
-        # Add edges in order of connectivity strength
-        for edge in edge_list:
-            #print("%s%s" % ('Adding edge to mst: ', edge))
-            min_t.add_edges_from([edge])
-            min_t_mx = nx.to_numpy_array(min_t)
-            len_edges = nx.from_numpy_matrix(min_t_mx).number_of_edges()
-            if len_edges >= edgenum:
-                #print(len_edges)
-                break
-
-        if (len(len_edge_list[-fail_tol:]) - len(set(len_edge_list[-fail_tol:]))) >= (fail_tol-1):
-            print("%s%s%s" % ('Cannot apply local thresholding to achieve threshold of: ', thr, '. Using maximally saturated connected matrix instead...'))
-
+        return min_t.to_array()
+
+    A = min_t.adjacency.toarray()
+    order = knn_ranking(W)
+    nodes = np.arange(n)
+    k = 0
+    while len_edges < edgenum and k < n - 1:
+        # Edges of the (k + 1)-nearest neighbour graph not in the graph yet, each pair once
+        cols = order[:, k]
+        new = (W[nodes, cols] != 0) & ~A[nodes, cols]
+        u = np.minimum(nodes[new], cols[new])
+        v = np.maximum(nodes[new], cols[new])
+        [_, first] = np.unique(u * n + v, return_index=True)
+        [u, v] = [u[first], v[first]]
+        # Add them in order of connectivity strength, up to the target edge count
+        add = np.argsort(-W[u, v], kind='mergesort')[:edgenum - len_edges]
+        A[u[add], v[add]] = True
+        A[v[add], u[add]] = True
+        len_edges += len(add)
         k += 1
+    if len_edges < edgenum:
+        print("%s%s%s" % ('Cannot apply local thresholding to achieve threshold of: ', thr, '. Using maximally saturated connected matrix instead...'))
+    print("%s%d%s%d%s%.4f" % ('Local thresholding with k = ', k, ': ', len_edges, ' edges, density ',
+                              2.0 * len_edges / (n * (n - 1)) if n > 1 else 0))
+    return np.where(A, W, 0)
 
-    conn_matrix_thr = nx.to_numpy_array(min_t, nodelist=sorted(min_t.nodes()), dtype=np.float64)
-    if len(min_t.nodes()) < conn_matrix.shape[0]:
-        raise RuntimeWarning("%s%s%s" % ('Cannot apply local thresholding to achieve threshold of: ', thr, '. Try a higher -thr or -min_thr'))
 
-    return conn_matrix_thr
+def local_thresholding_prop(conn_matrix, thr):
+    """
+    Threshold the adjacency matrix by building from the minimum spanning tree (MST) and adding
+    successive N-nearest neighbour degree graphs to achieve target proportional threshold.
+    """
+    upper_values = np.triu_indices(np.shape(conn_matrix)[0], k=1)
+    edgenum = int(float(thr) * float(np.count_nonzero(~np.isnan(conn_matrix[upper_values]))))
+    return _local_thresholding(conn_matrix, edgenum, thr)
 
 
 def local_thresholding_dens(conn_matrix, thr):
-    from pynets import netstats, thresholding
-    '''
+    """
     Threshold the adjacency matrix by building from the minimum spanning tree (MST) and adding
     successive N-nearest neighbour degree graphs to achieve target density.
-    '''
-    fail_tol = 10
-    conn_matrix = np.nan_to_num(conn_matrix)
-    G = nx.from_numpy_matrix(conn_matrix)
-    if not nx.is_connected(G):
-        [G, _] = netstats.prune_disconnected(G)
-
-    maximum_edges = G.number_of_edges()
-    G = thresholding.weight_to_distance(G)
-    min_t = nx.minimum_spanning_tree(G, weight="distance")
-    mst_density = nx.density(min_t)
-    G_density = nx.density(G)
-    if mst_density > G_density:
-        print("%s%s%s" % ('Warning: The minimum spanning tree already has: ', thr, ' density. Local Threshold will be applied by just retaining the Minimum Spanning Tree'))
-        conn_matrix_thr = nx.to_numpy_array(G)
-        return conn_matrix_thr
-
-    k = 1
-    dense_list = []
-    while mst_density < float(thr) and (len(dense_list[-fail_tol:]) - len(set(dense_list[-fail_tol:]))) < (fail_tol - 1):
-        print(k)
-        print(mst_density)
-        dense_list.append(mst_density)
-        # Create nearest neighbour graph
-        nng = thresholding.knn(conn_matrix, k)
-        number_before = nng.number_of_edges()
-        # Remove edges from the NNG that exist already in the new graph/MST
-        nng.remove_edges_from(min_t.edges())
-        if nng.number_of_edges() == 0 and number_before >= maximum_edges:
-            break
-
-        # Add weights to NNG
-        for e in nng.edges():
-            nng.edges[e[0], e[1]]['weight'] = float(conn_matrix[e[0], e[1]])
-
-        # Obtain list of edges from the NNG in order of weight
-        edge_list = sorted(nng.edges(data=True), key=lambda t: t[2]['weight'], reverse=True)
-        # Add edges in order of connectivity strength
-        for edge in edge_list:
-            min_t.add_edges_from([edge])
-            mst_density = thresholding.est_density((nx.to_numpy_array(min_t)))
-            #print("%s%s" % ('Adding edge to mst: ', edge))
-            if mst_density >= G_density or mst_density >= float(thr):
-                #print(mst_density)
-                break
-
-        if (len(dense_list[-fail_tol:]) - len(set(dense_list[-fail_tol:]))) >= (fail_tol - 1):
-            print("%s%s%s" % ('Cannot apply local thresholding to achieve density of: ', thr, '. Using maximally saturated connected matrix instead...'))
-
-        k += 1
-
-    conn_matrix_thr = nx.to_numpy_array(min_t, nodelist=sorted(min_t.nodes()), dtype=np.float64)
-    if len(min_t.nodes()) < conn_matrix.shape[0]:
-        raise RuntimeWarning("%s%s%s" % ('Cannot apply local thresholding to achieve density of: ', thr, '. Try a higher -thr or -min_thr'))
-
-    return conn_matrix_thr
+    """
+    n = len(conn_matrix)
+    edgenum = int(np.ceil(np.round(float(thr) * (n * (n - 1) // 2), 8)))
+    return _local_thresholding(conn_matrix, edgenum, thr)
 
 
 def thresh_func(dens_thresh, thr, conn_matrix, conn_model, network, ID, dir_path, roi, node_size, min_span_tree, smooth, disp_filt, parc, prune, atlas_select, uatlas_select, label_names, coords, c_boot):
     from pynets import utils, thresholding
+    from pynets.graph import ArrayGraph
 
     thr_perc = 100 * float(thr)
     edge_threshold = "%s%s" % (str(thr_perc), '%')
@@ -439,8 +610,7 @@ def thresh_func(dens_thresh, thr, conn_matrix, conn_model, network, ID, dir_path
         node_size = 'parc'
 
     # Save unthresholded
-    unthr_path = utils.create_unthr_path(ID, network, conn_model, roi, dir_path)
-    np.save(unthr_path, conn_matrix)
+    utils.save_unthr(conn_matrix, utils.create_unthr_path(ID, network, conn_model, roi, dir_path))
     if min_span_tree is True:
         print('Using local thresholding option with the Minimum Spanning Tree (MST)...\n')
         if dens_thresh is False:
@@ -451,13 +621,11 @@ def thresh_func(dens_thresh, thr, conn_matrix, conn_model, network, ID, dir_path
             conn_matrix_thr = thresholding.local_thresholding_dens(conn_matrix, thr)
     elif disp_filt is True:
         thr_type = 'DISPα'
-        G1 = thresholding.disparity_filter(nx.from_numpy_array(conn_matrix))
-        # G2 = nx.Graph([(u, v, d) for u, v, d in G1.edges(data=True) if d['alpha'] < thr])
         print('Computing edge disparity significance with alpha = %s' % thr)
-        print('Filtered graph: nodes = %s, edges = %s' % (G1.number_of_nodes(), G1.number_of_edges()))
-        # print('Backbone graph: nodes = %s, edges = %s' % (G2.number_of_nodes(), G2.number_of_edges()))
-        #print(G2.edges(data=True))
-        conn_matrix_thr = nx.to_numpy_array(G1)
+        backbone = thresholding.disparity_filter_masks(conn_matrix, [float(thr)])[0]
+        conn_matrix_thr = np.where(backbone, conn_matrix, 0)
+        print('Backbone graph: nodes = %s, edges = %s' % (len(conn_matrix_thr),
+                                                          ArrayGraph(conn_matrix_thr).number_of_edges()))
     else:
         if dens_thresh is False:
             thr_type='prop'
@@ -468,12 +636,12 @@ def thresh_func(dens_thresh, thr, conn_matrix, conn_model, network, ID, dir_path
             print("%s%.2f%s" % ('\nThresholding to achieve density of: ', thr_perc, '% ...\n'))
             conn_matrix_thr = thresholding.density_thresholding(conn_matrix, float(thr))
 
-    if not nx.is_connected(nx.from_numpy_matrix(conn_matrix_thr)):
+    if not ArrayGraph(conn_matrix_thr).is_connected():
         print('Warning: Fragmented graph')
 
     # Save thresholded mat
     est_path = utils.create_est_path(ID, network, conn_model, thr, roi, dir_path, node_size, smooth, c_boot, thr_type)
-    np.save(est_path, conn_matrix_thr)
+    est_path = utils.save_est(conn_matrix_thr, est_path, conn_matrix_unthr=conn_matrix)
 
     return conn_matrix_thr, edge_threshold, est_path, thr, node_size, network, conn_model, roi, smooth, prune, ID, dir_path, atlas_select, uatlas_select, label_names, coords, c_boot
 
@@ -481,12 +649,15 @@ def thresh_func(dens_thresh, thr, conn_matrix, conn_model, network, ID, dir_path
 def thresh_diff(dens_thresh, thr, conn_model, network, ID, dir_path, roi, node_size, conn_matrix, parc, min_span_tree,
                 disp_filt, atlas_select, uatlas_select, label_names, coords):
     from pynets import utils, thresholding
+    from pynets.graph import ArrayGraph
 
     thr_perc = 100 * float(thr)
     edge_threshold = "%s%s" % (str(thr_perc), '%')
     if parc is True:
         node_size = 'parc'
 
+    # Save unthresholded
+    utils.save_unthr(conn_matrix, utils.create_unthr_path(ID, network, conn_model, roi, dir_path))
     if min_span_tree is True:
         print('Using local thresholding option with the Minimum Spanning Tree (MST)...\n')
         if dens_thresh is False:
@@ -497,13 +668,11 @@ def thresh_diff(dens_thresh, thr, conn_model, network, ID, dir_path, roi, node_s
             conn_matrix_thr = thresholding.local_thresholding_dens(conn_matrix, thr)
     elif disp_filt is True:
         thr_type = 'DISPα'
-        G1 = thresholding.disparity_filter(nx.from_numpy_array(conn_matrix))
-        # G2 = nx.Graph([(u, v, d) for u, v, d in G1.edges(data=True) if d['alpha'] < thr])
         print('Computing edge disparity significance with alpha = %s' % thr)
-        print('Filtered graph: nodes = %s, edges = %s' % (G1.number_of_nodes(), G1.number_of_edges()))
-        # print('Backbone graph: nodes = %s, edges = %s' % (G2.number_of_nodes(), G2.number_of_edges()))
-        #print(G2.edges(data=True))
-        conn_matrix_thr = nx.to_numpy_array(G1)
+        backbone = thresholding.disparity_filter_masks(conn_matrix, [float(thr)])[0]
+        conn_matrix_thr = np.where(backbone, conn_matrix, 0)
+        print('Backbone graph: nodes = %s, edges = %s' % (len(conn_matrix_thr),
+                                                          ArrayGraph(conn_matrix_thr).number_of_edges()))
     else:
         if dens_thresh is False:
             thr_type = 'prop'
@@ -514,11 +683,12 @@ def thresh_diff(dens_thresh, thr, conn_model, network, ID, dir_path, roi, node_s
             print("%s%.2f%s" % ('\nThresholding to achieve density of: ', thr_perc, '% ...\n'))
             conn_matrix_thr = thresholding.density_thresholding(conn_matrix, float(thr))
 
-    if not nx.is_connected(nx.from_numpy_matrix(conn_matrix_thr)):
+    if not ArrayGraph(conn_matrix_thr).is_connected():
         print('Warning: Fragmented graph')
 
     # Save thresholded mat
     smooth = 0
-    est_path = utils.create_est_path(ID, network, conn_model, thr, roi, dir_path, node_size, smooth, thr_type)
-    np.save(est_path, conn_matrix_thr)
+    c_boot = 0
+    est_path = utils.create_est_path(ID, network, conn_model, thr, roi, dir_path, node_size, smooth, c_boot, thr_type)
+    est_path = utils.save_est(conn_matrix_thr, est_path, conn_matrix_unthr=conn_matrix)
     return conn_matrix_thr, edge_threshold, est_path, thr, node_size, network, conn_model, roi, atlas_select, uatlas_select, label_names, coords
@@ -20,6 +20,24 @@ def get_file():
 
 
 # Save net metric files to pandas dataframes interface
+def net_metrics_to_dataframe(net_mets_file):
+    """Load the columnar table written by extractnetstats as a single-row pandas dataframe.
+
+    Global metrics come first, followed by one column per node and nodal metric (e.g. `12_local_efficiency`) and one
+    column per degree of the rich club coefficient.
+    """
+    import pandas as pd
+    with np.load(net_mets_file) as net_mets:
+        global_names = [str(i) for i in net_mets['global_names']]
+        nodal_names = [str(i) for i in net_mets['nodal_names']]
+        node_ids = net_mets['node_ids']
+        col_names = global_names + ["%s%s%s" % (node, '_', name) for name in nodal_names for node in node_ids] + \
+                    ["%s%s" % (k, '_rich_club') for k in net_mets['rich_club_degrees']]
+        values = np.concatenate([net_mets['global_values'], net_mets['nodal_values'].T.ravel(),
+                                 net_mets['rich_club_values']])
+    return pd.DataFrame(values[np.newaxis, :], columns=col_names)
+
+
 def export_to_pandas(csv_loc, ID, network, roi):
     import pandas as pd
     try:
@@ -31,6 +49,14 @@ def export_to_pandas(csv_loc, ID, network, roi):
     if os.path.isfile(csv_loc) is False:
         raise FileNotFoundError('\nERROR: Missing netmetrics csv file output. Cannot export to pandas df!')
 
+    if csv_loc.endswith('.npz'):
+        df = net_metrics_to_dataframe(csv_loc)
+        df.insert(0, 'id', pd.Series([ID], dtype='object'))
+        net_pickle_mt = csv_loc.split('.npz')[0]
+        df.to_pickle(net_pickle_mt, protocol=2)
+        return net_pickle_mt
+
+    # Legacy output: tab-delimited values with a separately pickled list of metric names
     if roi is not None:
         if network is not None:
             met_list_picke_path = "%s%s%s%s%s" % (os.path.dirname(os.path.abspath(csv_loc)), '/net_metric_list_', network, '_', str(os.path.basename(roi).split('.')[0]))
@@ -59,6 +85,22 @@ def export_to_pandas(csv_loc, ID, network, roi):
     return net_pickle_mt
 
 
+def get_cache_dir(name):
+    """Return (and create) a persistent cache directory for reusable intermediate results.
+
+    The cache root defaults to ~/.pynets/cache and can be overridden with the PYNETS_CACHE_DIR environment variable.
+    """
+    cache_root = os.environ.get('PYNETS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.pynets', 'cache'))
+    cache_dir = os.path.join(cache_root, name)
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+    return cache_dir
+
+
 def do_dir_path(atlas_select, in_file):
     dir_path = "%s%s%s" % (os.path.dirname(os.path.realpath(in_file)), '/', atlas_select)
     if not os.path.exists(dir_path) and atlas_select is not None:
@@ -96,6 +138,181 @@ def create_unthr_path(ID, network, conn_model, roi, dir_path):
     return unthr_path
 
 
+def atomic_write(path, write):
+    """Write a file atomically: write(f) fills a temporary file in the same directory, which then replaces path, so
+    that concurrent readers never see a partial file"""
+    import tempfile
+    [fd, tmp_path] = tempfile.mkstemp(suffix=os.path.splitext(path)[1],
+                                      dir=os.path.dirname(os.path.realpath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def _unthr_digest(W):
+    """sha1 of the shape, dtype and bytes of W"""
+    import hashlib
+    key = hashlib.sha1(("%s_%s" % (W.shape, W.dtype.str)).encode('utf-8'))
+    key.update(W.tobytes())
+    return key.hexdigest()
+
+
+def _unthr_source(W, dir_path):
+    """
+    Save the unthresholded matrix W (unless save_unthr already did) and its edge-rank index (see save_est) under
+    names keyed on the content of W, so that estimates thresholded from different matrices never share, or overwrite,
+    their source.
+
+    Returns
+    -------
+    digest : str
+        sha1 of the shape, dtype and bytes of W.
+    rows, cols : Mx1 np.ndarray
+        end nodes of the edges of W in decreasing order of weight (see thresholding.ThresholdSweep).
+    symmetric : bool
+    """
+    from pynets.thresholding import ThresholdSweep
+    W = np.ascontiguousarray(W)
+    digest = _unthr_digest(W)
+    [src_path, rank_path] = _unthr_source_paths(dir_path, digest)
+    if not os.path.isfile(src_path):
+        atomic_write(src_path, lambda f: np.save(f, W))
+    if not os.path.isfile(rank_path):
+        sweep = ThresholdSweep(W)
+        atomic_write(rank_path, lambda f: np.savez(f, rows=sweep.rows.astype(np.int32),
+                                                   cols=sweep.cols.astype(np.int32), symmetric=sweep.symmetric,
+                                                   sha1=digest))
+    with np.load(rank_path) as ranks:
+        return digest, ranks['rows'], ranks['cols'], bool(ranks['symmetric'])
+
+
+def save_unthr(conn_matrix, unthr_path):
+    """
+    Save an unthresholded connectivity matrix to unthr_path (see create_unthr_path).
+
+    unthr_path is a hard link to the content-keyed copy that rank-format estimates (see save_est) are rebuilt from, so
+    the matrix is stored once, and saving unthr_path again for another estimate only re-points the name, leaving the
+    source of earlier estimates intact. Where hard links are not supported, unthr_path is a separate copy.
+
+    Returns
+    -------
+    unthr_path : str
+    """
+    import uuid
+    W = np.ascontiguousarray(conn_matrix)
+    src_path = _unthr_source_paths(os.path.dirname(os.path.realpath(unthr_path)), _unthr_digest(W))[0]
+    if not os.path.isfile(src_path):
+        atomic_write(src_path, lambda f: np.save(f, W))
+    link_path = "%s%s%s%s" % (unthr_path, '.', uuid.uuid4().hex, '.tmp')
+    try:
+        os.link(src_path, link_path)
+        os.replace(link_path, unthr_path)
+    except OSError:
+        if os.path.lexists(link_path):
+            os.remove(link_path)
+        atomic_write(unthr_path, lambda f: np.save(f, W))
+    return unthr_path
+
+
+def _unthr_source_paths(dir_path, digest):
+    base = os.path.join(dir_path, "%s%s" % ('unthr_', digest))
+    return "%s%s" % (base, '.npy'), "%s%s" % (base, '_ranks.npz')
+
+
+def _rebuild_from_ranks(W, rows, cols, symmetric, edge_count):
+    conn_matrix = np.zeros(W.shape, dtype=W.dtype)
+    [rows, cols] = [rows[:edge_count], cols[:edge_count]]
+    conn_matrix[rows, cols] = W[rows, cols]
+    if symmetric:
+        conn_matrix[cols, rows] = W[rows, cols]
+    return conn_matrix
+
+
+def save_est(conn_matrix, est_path, conn_matrix_unthr=None):
+    """
+    Save a thresholded connectivity matrix in compact form, as a .npz next to est_path.
+
+    If conn_matrix keeps the strongest edges of conn_matrix_unthr (i.e. it is one of its proportional thresholds),
+    only its edge count is stored, and its edges are rebuilt on load from conn_matrix_unthr and an edge-rank index,
+    both saved once per distinct unthresholded matrix under names keyed on its content. Otherwise, its nonzero entries
+    (of the upper triangle, if symmetric) are stored in CSR form. Use load_est to read it back.
+
+    Parameters
+    ----------
+    conn_matrix : NxN np.ndarray
+        thresholded connectivity matrix.
+    est_path : str
+        path the matrix would have been saved to as a .npy (see create_est_path).
+    conn_matrix_unthr : NxN np.ndarray
+        optional unthresholded matrix conn_matrix was thresholded from.
+
+    Returns
+    -------
+    est_path : str
+        path of the saved .npz.
+    """
+    from scipy import sparse
+    conn_matrix = np.asarray(conn_matrix)
+    est_path = "%s%s" % (est_path.split('.npy')[0], '.npz')
+    if conn_matrix_unthr is not None and np.shape(conn_matrix_unthr) == conn_matrix.shape:
+        W = np.asarray(conn_matrix_unthr)
+        [digest, rows, cols, symmetric] = _unthr_source(W, os.path.dirname(os.path.realpath(est_path)))
+        edge_count = int(np.count_nonzero(conn_matrix[rows, cols]))
+        if np.array_equal(_rebuild_from_ranks(W, rows, cols, symmetric, edge_count), conn_matrix):
+            atomic_write(est_path, lambda f: np.savez(f, format='rank', unthr_sha1=digest, edge_count=edge_count))
+            return est_path
+    symmetric = np.array_equal(conn_matrix, conn_matrix.T)
+    csr = sparse.csr_matrix(np.triu(conn_matrix) if symmetric else conn_matrix)
+    atomic_write(est_path, lambda f: np.savez(f, format='csr', data=csr.data, indices=csr.indices,
+                                              indptr=csr.indptr, shape=csr.shape, symmetric=symmetric))
+    return est_path
+
+
+def load_est(est_path, mmap_mode=None):
+    """
+    Load a connectivity matrix saved as .txt, .npy or by save_est (.npz) as a dense array.
+
+    Parameters
+    ----------
+    est_path : str
+        path of the matrix.
+    mmap_mode : str
+        memory-map mode of .npy files (see np.load). default value=None.
+
+    Returns
+    -------
+    conn_matrix : NxN np.ndarray
+    """
+    from scipy import sparse
+    if '.txt' in est_path:
+        return np.genfromtxt(est_path)
+    if not est_path.endswith('.npz'):
+        return np.load(est_path, mmap_mode=mmap_mode)
+    with np.load(est_path) as est:
+        if str(est['format']) == 'rank':
+            digest = str(est['unthr_sha1'])
+            [src_path, rank_path] = _unthr_source_paths(os.path.dirname(os.path.realpath(est_path)), digest)
+            if not os.path.isfile(src_path) or not os.path.isfile(rank_path):
+                raise IOError("%s%s" % ('Missing the unthresholded source matrix of: ', est_path))
+            with np.load(rank_path) as ranks:
+                if str(ranks['sha1']) != digest:
+                    raise IOError("%s%s" % ('Edge-rank index does not match the source matrix of: ', est_path))
+                [rows, cols, symmetric] = [ranks['rows'], ranks['cols'], bool(ranks['symmetric'])]
+            return _rebuild_from_ranks(np.load(src_path, mmap_mode='r'), rows, cols, symmetric,
+                                       int(est['edge_count']))
+        conn_matrix = sparse.csr_matrix((est['data'], est['indices'], est['indptr']),
+                                        shape=tuple(est['shape'])).toarray()
+        if bool(est['symmetric']):
+            conn_matrix = conn_matrix + np.triu(conn_matrix, 1).T
+        return conn_matrix
+
+
 def create_csv_path(ID, network, conn_model, thr, roi, dir_path, node_size, smooth, c_boot):
     if roi is not None:
         if network is not None:
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Dec 27 16:19:14 2017
+
+@authors: Derek Pisner & Ryan Hammonds
+
+"""
+import os
+import numpy as np
+import networkx as nx
+import time
+from pathlib import Path
+from pynets import cohort, netstats, thresholding
+
+
+def test_cohort_metrics(tmp_path):
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_sps_unthresholded_mat.npy')
+    rs = np.random.RandomState(42)
+    out_dir = str(tmp_path)
+    est_paths = []
+    for s in range(5):
+        noisy = np.abs(in_mat + 0.05 * rs.randn(*in_mat.shape))
+        est_path = os.path.join(out_dir, "%s%s%s" % ('sub', s, '.npy'))
+        np.save(est_path, thresholding.threshold_proportional((noisy + noisy.T) / 2, 0.3))
+        est_paths.append(est_path)
+    stack = cohort.load_est_stack(est_paths, out_path=os.path.join(out_dir, 'stack.npy'))
+    assert stack.shape == (5,) + in_mat.shape
+    ci = rs.randint(0, 4, len(in_mat))
+
+    start_time = time.time()
+    df = cohort.cohort_metrics(stack, ids=['sub' + str(s) for s in range(5)], ci=ci, batch_size=2)
+    print("%s%s%s" % ('cohort_metrics --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    assert list(df.columns) == ['id', 'metric', 'node', 'value']
+    n = len(in_mat)
+    n_nodal = len([name for name, output in cohort.cohort_metric_list if output == 'nodal'])
+    assert len(df) == 5 * (n_nodal * n + len(cohort.cohort_metric_list) - n_nodal)
+
+    # Each subject matches its own graph
+    W = np.load(est_paths[3])
+    G = nx.from_numpy_array(W)
+    sub = df[df['id'] == 'sub3']
+    def values(metric):
+        return sub[sub['metric'] == metric]['value'].values
+    assert np.allclose(values('degree'), [d for _, d in G.degree()])
+    assert np.allclose(values('strength'), np.sum(W, axis=1))
+    assert np.allclose(values('density'), nx.density(G))
+    clustering = nx.clustering(G)
+    assert np.allclose(values('local_clustering'), [clustering[i] for i in G.nodes()])
+    assert np.allclose(values('transitivity'), nx.transitivity(G))
+    assert np.allclose(values('global_efficiency'), nx.global_efficiency(G))
+    assert np.allclose(values('participation_coefficient'), netstats.participation_coef(W, ci))
+    # Same eigenvector centrality as extractnetstats
+    assert np.allclose(values('eigenvector_centrality'), netstats.eigenvector_centrality_vector(W))
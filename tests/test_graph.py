@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Dec 27 16:19:14 2017
+
+@authors: Derek Pisner & Ryan Hammonds
+
+"""
+import numpy as np
+import networkx as nx
+import time
+from pathlib import Path
+from scipy import sparse
+from pynets.graph import ArrayGraph
+
+
+def test_array_graph():
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
+    in_mat[:3, :] = 0
+    in_mat[:, :3] = 0
+    G = nx.from_numpy_array(in_mat)
+
+    for W in [in_mat, sparse.csr_matrix(in_mat)]:
+        start_time = time.time()
+        graph = ArrayGraph(W)
+        print("%s%s%s" % ('ArrayGraph --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+        assert graph.number_of_edges() == G.number_of_edges()
+        assert np.array_equal(graph.degree, [d for _, d in G.degree()])
+        assert np.isclose(graph.density(), nx.density(G))
+        assert graph.connected_components()[0] == nx.number_connected_components(G)
+        assert graph.is_connected() is False
+
+        D = graph.shortest_paths()
+        lengths = dict(nx.all_pairs_shortest_path_length(G))
+        assert np.all(D[5] == [lengths[5].get(j, np.inf) for j in G.nodes()])
+
+        T = graph.minimum_spanning_tree()
+        T_nx = nx.minimum_spanning_tree(G)
+        assert T.number_of_edges() == T_nx.number_of_edges()
+        assert np.isclose(np.sum(T.to_array()) / 2, T_nx.size(weight='weight'))
+
+        keep = np.arange(len(in_mat)) >= 3
+        H = graph.subgraph(keep)
+        assert H.nodes == list(range(3, len(in_mat)))
+        assert H.is_connected() == nx.is_connected(G.subgraph(H.nodes))
+        G_H = H.to_networkx()
+        assert list(G_H.nodes()) == H.nodes
+        assert G_H.number_of_edges() == H.number_of_edges()
+        assert ArrayGraph.from_networkx(G_H).number_of_edges() == H.number_of_edges()
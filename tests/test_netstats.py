@@ -6,6 +6,8 @@ Created on Wed Dec 27 16:19:14 2017
 @authors: Derek Pisner & Ryan Hammonds
 
 """
+import multiprocessing
+import pytest
 import numpy as np
 import networkx as nx
 import time
@@ -32,6 +34,23 @@ def test_global_efficiency():
     global_eff = netstats.global_efficiency(G)
     print("%s%s%s" % ('thresh_and_fit (Functional, proportional thresholding) --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
     assert global_eff is not None
+    assert np.isclose(global_eff, nx.global_efficiency(G))
+    assert np.isclose(netstats.global_efficiency(in_mat), global_eff)
+
+def test_all_pairs_distances():
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
+    G = nx.from_numpy_array(in_mat)
+
+    start_time = time.time()
+    D = netstats.all_pairs_distances(in_mat, weighted=True)
+    [L, E] = netstats.path_length_and_efficiency(D)
+    print("%s%s%s" % ('all_pairs_distances --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    lengths = dict(nx.single_source_dijkstra_path_length(G, 0))
+    for node, length in lengths.items():
+        assert np.isclose(D[0, node], length)
+    assert L is not None
+    assert np.isclose(E, netstats.global_efficiency(G, weight='weight'))
 
 def test_local_efficiency():
     base_dir = str(Path(__file__).parent/"examples")
@@ -46,6 +65,18 @@ def test_local_efficiency():
     # for i in efficiencies:
     #     assert i is not None
     assert efficiencies is not None
+    assert np.isclose(np.mean(list(efficiencies.values())), nx.local_efficiency(G))
+
+def test_local_efficiency_vector():
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
+
+    start_time = time.time()
+    le_vector = netstats.local_efficiency_vector(in_mat, n_jobs=2)
+    print("%s%s%s" % ('local_efficiency_vector --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    assert np.allclose(le_vector, netstats.local_efficiency_vector(in_mat))
+    assert np.isclose(netstats.average_local_efficiency(in_mat, efficiencies=dict(enumerate(le_vector))),
+                      nx.local_efficiency(nx.from_numpy_array(in_mat)))
 
 def test_average_local_efficiency():
     base_dir = str(Path(__file__).parent/"examples")
@@ -94,15 +125,37 @@ def test_smallworldness_measure():
     print("%s%s%s" % ('thresh_and_fit (Functional, proportional thresholding) --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
     assert swm is not None
 
-# def test_smallworldness():
-#     base_dir = str(Path(__file__).parent/"examples")
-#     in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
-#     G = nx.from_numpy_array(in_mat)
-#
-#     start_time = time.time()
-#     mean_s = netstats.smallworldness(G, rep=1000)
-#     print("%s%s%s" % ('thresh_and_fit (Functional, proportional thresholding) --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
-#     assert mean_s is not None
+def test_smallworldness():
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
+    G = nx.from_numpy_array(in_mat)
+
+    start_time = time.time()
+    mean_s = netstats.smallworldness(G, rep=50, n_jobs=2, use_cache=False)
+    print("%s%s%s" % ('thresh_and_fit (Functional, proportional thresholding) --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    assert mean_s is not None
+
+def test_null_model_ensemble(monkeypatch, tmp_path):
+    monkeypatch.setenv('PYNETS_CACHE_DIR', str(tmp_path))
+    n = 100
+    m = 500
+
+    start_time = time.time()
+    [C, L] = netstats.null_model_ensemble(n, m, rep=20, n_jobs=2)
+    print("%s%s%s" % ('null_model_ensemble --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    # Independent streams, so no two random graphs should be identical
+    assert len(np.unique(C)) == 20
+    # Cached ensemble is reused, and extended consistently
+    [C_ext, L_ext] = netstats.null_model_ensemble(n, m, rep=30, n_jobs=1)
+    assert np.allclose(C_ext[:20], C) and np.allclose(L_ext[:20], L)
+    [C_fresh, _] = netstats.null_model_ensemble(n, m, rep=30, n_jobs=3, use_cache=False)
+    assert np.allclose(C_fresh, C_ext)
+    # A truncated cache file is ignored and rewritten
+    [cache_path] = list((tmp_path / 'null_models').glob('*.npz'))
+    cache_path.write_bytes(cache_path.read_bytes()[:100])
+    [C_cold, _] = netstats.null_model_ensemble(n, m, rep=30, n_jobs=1)
+    assert np.allclose(C_cold, C_ext)
+    assert np.allclose(np.load(str(cache_path))['C'], C_ext)
 
 # used random node_comm_aff_mat
 def test_create_communities():
@@ -125,6 +178,59 @@ def test_compute_rc():
     print("%s%s%s" % ('thresh_and_fit (Functional, proportional thresholding) --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
     assert rc is not None
 
+def test_rich_club_coefficient(monkeypatch, tmp_path):
+    monkeypatch.setenv('PYNETS_CACHE_DIR', str(tmp_path))
+    G = nx.gnm_random_graph(60, 300, seed=1)
+    W = nx.to_numpy_array(G)
+
+    start_time = time.time()
+    rc = netstats.rich_club_vector(W)
+    print("%s%s%s" % ('rich_club_vector --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    rc_nx = nx.rich_club_coefficient(G, normalized=False)
+    assert np.allclose(rc, [rc_nx[k] for k in range(len(rc_nx))])
+
+    degree = np.sum(W, axis=1).astype(np.int64)
+    [u, v] = np.where(np.triu(W, 1))
+    [u_rand, v_rand] = netstats._double_edge_swaps(u, v, len(W), 10 * len(u), np.random.RandomState(0))
+    assert np.array_equal(np.bincount(np.concatenate([u_rand, v_rand]), minlength=len(W)), degree)
+    assert np.all(u_rand != v_rand)
+    assert len(set(zip(np.minimum(u_rand, v_rand), np.maximum(u_rand, v_rand)))) == len(u_rand)
+
+    rc_rand = netstats.rich_club_null_ensemble(degree, rep=4, Q=10, n_jobs=1)
+    assert rc_rand.shape == (4, len(rc))
+    # A larger ensemble extends the cached one
+    rc_rand_ext = netstats.rich_club_null_ensemble(degree, rep=6, Q=10, n_jobs=1)
+    assert np.allclose(rc_rand_ext[:4], rc_rand)
+
+    rc_norm = netstats.rich_club_coefficient(G, Q=10, rep=6, n_jobs=1)
+    assert np.allclose(list(rc_norm.values()), rc / np.mean(rc_rand_ext, axis=0), equal_nan=True)
+
+def test_clustering_vector():
+    from scipy import sparse
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
+    G = nx.from_numpy_array(in_mat)
+
+    start_time = time.time()
+    clustering = netstats.clustering_vector(in_mat, weighted=True)
+    print("%s%s%s" % ('clustering_vector --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    clustering_nx = nx.clustering(G, weight='weight')
+    assert np.allclose(clustering, [clustering_nx[i] for i in G.nodes()])
+    assert np.allclose(netstats.clustering_vector(sparse.csr_matrix(in_mat), weighted=True), clustering)
+
+    clustering_nx = nx.clustering(G)
+    for sparse_path in [False, True]:
+        assert np.allclose(netstats.clustering_vector(in_mat, sparse=sparse_path),
+                           [clustering_nx[i] for i in G.nodes()])
+        assert np.isclose(netstats.transitivity_vector(in_mat, sparse=sparse_path), nx.transitivity(G))
+
+    stack = np.stack([in_mat, in_mat * (in_mat > np.median(in_mat)), np.zeros_like(in_mat)])
+    clustering_stack = netstats.clustering_vector(stack, weighted=True)
+    assert clustering_stack.shape == stack.shape[:2]
+    for i in range(len(stack)):
+        assert np.allclose(clustering_stack[i], netstats.clustering_vector(stack[i], weighted=True))
+    assert np.allclose(netstats.transitivity_vector(stack), [netstats.transitivity_vector(mat) for mat in stack])
+
 def test_participation_coef():
     base_dir = str(Path(__file__).parent/"examples")
     in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
@@ -137,6 +243,34 @@ def test_participation_coef():
     print("%s%s%s" % ('thresh_and_fit (Functional, proportional thresholding) --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
     assert P is not None
 
+def test_community_connectivity():
+    from scipy import sparse
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_sps_unthresholded_mat.npy')
+    ci = np.random.RandomState(42).randint(1, 8, in_mat.shape[0])
+
+    start_time = time.time()
+    stats = netstats.community_connectivity(in_mat, ci)
+    print("%s%s%s" % ('community_connectivity --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+
+    # Reference node-to-module strengths, one module at a time
+    modules = np.unique(ci)
+    Snm = np.stack([np.sum(in_mat[:, ci == i], axis=1) for i in modules], axis=1)
+    Ko = np.sum(in_mat, axis=1)
+    assert np.allclose(stats['participation'], 1 - np.sum(Snm ** 2, axis=1) / Ko ** 2)
+    Snm_pos = np.stack([np.sum(np.maximum(in_mat, 0)[:, ci == i], axis=1) for i in modules], axis=1)
+    pnm = Snm_pos / np.sum(Snm_pos, axis=1)[:, np.newaxis]
+    pnm[np.isnan(pnm) | (pnm == 0)] = 1
+    assert np.allclose(stats['diversity_pos'], -np.sum(pnm * np.log(pnm), axis=1) / np.log(len(modules)))
+    Z = np.zeros(len(ci))
+    for j, i in enumerate(modules):
+        Z[ci == i] = (Snm[ci == i, j] - np.mean(Snm[ci == i, j])) / np.std(Snm[ci == i, j])
+    assert np.allclose(stats['within_module_zscore'], Z)
+
+    stats_sparse = netstats.community_connectivity(sparse.csr_matrix(in_mat), ci)
+    for key in stats:
+        assert np.allclose(stats_sparse[key], stats[key], equal_nan=True)
+
 def test_modularity():
     base_dir = str(Path(__file__).parent/"examples")
     in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
@@ -169,6 +303,17 @@ def test_link_communities():
     M = netstats.link_communities(in_mat, type_clustering='single')
     print("%s%s%s" % ('thresh_and_fit (Functional, proportional thresholding) --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
     assert M is not None
+    assert M.shape[1] == in_mat.shape[0]
+    assert np.all(np.sum(M, axis=1) > 2)
+
+    # Two cliques joined by a single bridge are recovered as two link communities
+    W = np.zeros((8, 8))
+    W[:4, :4] = 1
+    W[4:, 4:] = 1
+    W[3, 4] = W[4, 3] = 0.1
+    np.fill_diagonal(W, 0)
+    M = netstats.link_communities(W, type_clustering='single')
+    assert sorted(map(tuple, M.astype(int).tolist())) == [(0, 0, 0, 0, 1, 1, 1, 1), (1, 1, 1, 1, 0, 0, 0, 0)]
 
 def test_modularity_louvain_und_sign():
     base_dir = str(Path(__file__).parent/"examples")
@@ -180,6 +325,18 @@ def test_modularity_louvain_und_sign():
     assert ci is not None
     assert mod is not None
 
+def test_modularity_louvain_und_sign_sparse():
+    from scipy import sparse
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_sps_unthresholded_mat.npy')
+
+    start_time = time.time()
+    [ci, mod] = netstats.modularity_louvain_und_sign(sparse.csr_matrix(in_mat), gamma=1, qtype='sta', seed=42)
+    print("%s%s%s" % ('modularity_louvain_und_sign --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    [ci_dense, mod_dense] = netstats.modularity_louvain_und_sign(in_mat, gamma=1, qtype='sta', seed=42)
+    assert np.array_equal(ci, ci_dense)
+    assert np.isclose(mod, mod_dense)
+
 def test_prune_disconnected():
     base_dir = str(Path(__file__).parent/"examples")
     in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
@@ -202,14 +359,18 @@ def test_most_important():
     print("%s%s%s" % ('thresh_and_fit (Functional, proportional thresholding) --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
     assert Gt is not None
     assert pruned_nodes is not None
+    # Pruned node indices refer to G, whichever pruning step removed them
+    assert sorted(set(G.nodes()) - set(Gt.nodes())) == sorted(pruned_nodes)
 
-def test_extractnetstats():
+def test_extractnetstats(monkeypatch, tmp_path):
+    monkeypatch.setenv('PYNETS_CACHE_DIR', str(tmp_path / 'cache'))
+    import shutil
     base_dir = str(Path(__file__).parent/"examples")
     ID = '997'
     network = 'Default'
     thr = 0.95
     conn_model = 'cov'
-    est_path = base_dir + '/997/997_Default_est_cov_0.95prop_TESTmm_2fwhm.npy'
+    est_path = shutil.copy(base_dir + '/997/997_Default_est_cov_0.95prop_TESTmm_2fwhm.npy', str(tmp_path))
     mask = None
     prune = 1
     node_size = 'parc'
@@ -220,3 +381,217 @@ def test_extractnetstats():
     out_path = netstats.extractnetstats(ID, network, thr, conn_model, est_path, mask, prune, node_size, smooth, c_boot)
     print("%s%s%s" % ('thresh_and_fit (Functional, proportional thresholding) --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
     assert out_path is not None
+
+def test_graph_cache():
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
+    G = nx.from_numpy_array(in_mat)
+
+    start_time = time.time()
+    graph_cache = netstats.GraphCache(in_mat, G)
+    global_eff = graph_cache.global_efficiency()
+    avg_shortest_path_len = graph_cache.average_shortest_path_length()
+    print("%s%s%s" % ('GraphCache --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    assert np.isclose(global_eff, nx.global_efficiency(G))
+    assert np.isclose(avg_shortest_path_len, netstats.average_shortest_path_length_for_all(G))
+    assert graph_cache.distances is graph_cache.distances
+    assert np.isclose(graph_cache.density, nx.density(G))
+    assert graph_cache.degree_centrality() == nx.degree_centrality(G)
+
+def test_signed_modularity():
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_sps_unthresholded_mat.npy')
+
+    start_time = time.time()
+    [ci, mod] = netstats.modularity_louvain_und_sign(in_mat, gamma=1, qtype='sta', seed=42)
+    Q = netstats.signed_modularity(in_mat, ci, qtype='sta')
+    print("%s%s%s" % ('signed_modularity --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    assert np.isclose(Q, mod)
+
+def test_agreement_matrix():
+    cis = np.array([[1, 1, 2, 2], [1, 1, 1, 2], [3, 3, 1, 1]])
+
+    start_time = time.time()
+    D = netstats.agreement_matrix(cis)
+    print("%s%s%s" % ('agreement_matrix --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    assert np.isclose(D[0, 1], 1)
+    assert np.isclose(D[1, 2], 1 / 3)
+    assert np.isclose(D[2, 3], 2 / 3)
+    assert np.all(np.diag(D) == 0)
+
+def test_consensus_louvain(monkeypatch, tmp_path):
+    from pynets import thresholding
+    monkeypatch.setenv('PYNETS_CACHE_DIR', str(tmp_path))
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_sps_unthresholded_mat.npy')
+
+    start_time = time.time()
+    [ci, q_stats] = netstats.consensus_louvain(in_mat, n_seeds=10, n_jobs=2)
+    print("%s%s%s" % ('consensus_louvain --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    assert len(ci) == in_mat.shape[0]
+    assert np.isclose(q_stats['modularity'], netstats.signed_modularity(in_mat, ci))
+    # A rescaled copy of the same graph reuses the cached partition
+    [ci_cached, q_stats_cached] = netstats.consensus_louvain(2 * in_mat, n_seeds=10, n_jobs=2)
+    assert np.array_equal(ci, ci_cached)
+    assert np.isclose(q_stats['modularity_mean'], q_stats_cached['modularity_mean'])
+    # Stats and plotting partition the same conditioned, unpruned matrix, and share one cache entry
+    conditioned = thresholding.condition_matrix(in_mat, 'corr')
+    [ci_stats, _] = netstats.consensus_communities(conditioned, 10)
+    [ci_plot, _] = netstats.consensus_communities(thresholding.condition_matrix(in_mat.copy(), 'corr'), 10)
+    assert np.array_equal(ci_stats, ci_plot)
+    assert len(list((tmp_path / 'communities').glob('*.npz'))) == 2
+    keep = np.ones(len(ci_stats), dtype=bool)
+    keep[ci_stats == ci_stats[0]] = False
+    ci_kept = netstats.restrict_communities(ci_stats, keep)
+    assert len(ci_kept) == np.sum(keep)
+    assert np.array_equal(np.unique(ci_kept), np.arange(1, len(np.unique(ci_stats))))
+
+def test_metric_plan():
+    plan = netstats.metric_plan(['global_efficiency', 'participation_coefficient'])
+    assert plan.index('adjacency') < plan.index('distances')
+    assert plan.index('degree') < plan.index('density') < plan.index('partition')
+    # Intermediates of unrequested metrics are never computed
+    assert 'G_len' not in plan
+    assert 'mat_len' not in plan
+    assert netstats.metric_plan(['betweenness_centrality']) == ['G', 'betweenness']
+    try:
+        netstats.metric_plan(['not_a_metric'])
+        assert False
+    except ValueError:
+        pass
+
+def test_compute_metrics():
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
+    G = nx.from_numpy_array(in_mat)
+
+    start_time = time.time()
+    graph_cache = netstats.GraphCache(in_mat, G)
+    [results, paths] = netstats.compute_metrics(graph_cache, ['global_efficiency', 'louvain_modularity', 'degree_centrality'])
+    print("%s%s%s" % ('compute_metrics --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    assert list(results.keys()) == ['global_efficiency', 'louvain_modularity', 'degree_centrality']
+    assert np.isclose(results['global_efficiency'], nx.global_efficiency(G))
+    assert 'modularity' in results['louvain_modularity']
+    assert results['degree_centrality'].shape == (in_mat.shape[0],)
+    assert 'mat_len' not in graph_cache._memo
+    assert set(paths.values()) == {'exact'}
+
+def test_compute_metrics_budgets():
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
+    G = nx.from_numpy_array(in_mat)
+    graph_cache = netstats.GraphCache(in_mat, G)
+
+    start_time = time.time()
+    # An estimated run time over budget switches to the declared approximation, or to NaN without one
+    [results, paths] = netstats.compute_metrics(graph_cache, ['graph_number_of_cliques', 'transitivity'],
+                                                budgets={'graph_number_of_cliques': 0, 'transitivity': 0})
+    print("%s%s%s" % ('compute_metrics --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    assert paths['graph_number_of_cliques'] == 'approximate'
+    assert results['graph_number_of_cliques'] == len(list(nx.find_cliques(G)))
+    assert paths['transitivity'] == 'skipped'
+    assert np.isnan(results['transitivity'])
+    # A budget that the exact metric fits in runs it in a child process
+    [results, paths] = netstats.compute_metrics(graph_cache, ['graph_number_of_cliques'],
+                                                budgets={'graph_number_of_cliques': 60})
+    assert paths['graph_number_of_cliques'] == 'exact'
+    assert results['graph_number_of_cliques'] == len(list(nx.find_cliques(G)))
+    assert netstats.estimate_cost('communicability_centrality', 400, 8000) > netstats.estimate_cost('communicability_centrality', 200, 2000)
+    # Budgeted metrics run in a non-daemonic child, which can start its own pool, and time out cleanly
+    assert netstats._run_with_budget(_pool_squares, (3,), 60) == [0, 1, 4]
+    with pytest.raises(multiprocessing.TimeoutError):
+        netstats._run_with_budget(time.sleep, (10,), 0.5)
+    with pytest.raises(ValueError):
+        netstats._run_with_budget(int, ('a',), 60)
+
+def _pool_squares(n):
+    assert not multiprocessing.current_process().daemon
+    pool = multiprocessing.Pool(2)
+    try:
+        return pool.map(np.square, range(n))
+    finally:
+        pool.close()
+        pool.join()
+
+def test_communicability_betweenness():
+    G = nx.gnp_random_graph(30, 0.2, seed=1)
+    in_mat = nx.to_numpy_array(G)
+
+    start_time = time.time()
+    [cbc, stderr] = netstats.communicability_betweenness(in_mat)
+    print("%s%s%s" % ('communicability_betweenness --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    cbc_nx = nx.communicability_betweenness_centrality(G)
+    assert np.allclose(cbc, [cbc_nx[i] for i in G.nodes()])
+    assert np.all(stderr == 0)
+    [cbc_sampled, stderr_sampled] = netstats.communicability_betweenness(in_mat, n_sources=15)
+    assert np.corrcoef(cbc, cbc_sampled)[0, 1] > 0.95
+    assert np.all(stderr_sampled > 0)
+    assert np.mean(np.abs(cbc_sampled - cbc) < 3 * stderr_sampled) > 0.8
+
+def test_eigenvector_centrality_vector():
+    from scipy import sparse
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
+    G = nx.from_numpy_array(in_mat)
+
+    start_time = time.time()
+    x = netstats.eigenvector_centrality_vector(in_mat)
+    print("%s%s%s" % ('eigenvector_centrality_vector --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    x_nx = nx.eigenvector_centrality(G, max_iter=1000, tol=1e-10)
+    assert np.allclose(x, [x_nx[i] for i in G.nodes()], atol=1e-6)
+    x_nx = nx.eigenvector_centrality(G, max_iter=1000, tol=1e-10, weight='weight')
+    assert np.allclose(netstats.eigenvector_centrality_vector(sparse.csr_matrix(in_mat), weighted=True),
+                       [x_nx[i] for i in G.nodes()], atol=1e-6)
+    # Warm starts from a perturbed or a stale vector converge to the same eigenvector
+    x_warm = netstats.eigenvector_centrality_vector(in_mat, v0=x + 0.01 * np.random.RandomState(1).rand(len(x)))
+    assert np.allclose(x_warm, x)
+    assert np.allclose(netstats.eigenvector_centrality_vector(in_mat, v0=np.zeros(len(x))), x)
+
+def test_betweenness_centrality_vector():
+    G = nx.connected_watts_strogatz_graph(80, 6, 0.1, seed=1)
+
+    start_time = time.time()
+    [bc, stderr] = netstats.betweenness_centrality_vector(G, n_jobs=2)
+    print("%s%s%s" % ('betweenness_centrality_vector --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    bc_nx = nx.betweenness_centrality(G, normalized=True)
+    assert np.allclose(bc, [bc_nx[i] for i in G.nodes()])
+    assert np.all(stderr == 0)
+    [bc_approx, stderr_approx] = netstats.betweenness_centrality_vector(G, k=40, n_jobs=1)
+    assert np.corrcoef(bc, bc_approx)[0, 1] > 0.9
+    assert np.all(stderr_approx >= 0) and np.any(stderr_approx > 0)
+
+def test_pruned_betweenness():
+    G = nx.disjoint_union(nx.gnp_random_graph(30, 0.2, seed=3), nx.path_graph(3))
+    [bc, stderr] = netstats.betweenness_centrality_vector(G, n_jobs=1)
+
+    start_time = time.time()
+    [Gt, pruned_nodes] = netstats.most_important(G, bc=bc)
+    print("%s%s%s" % ('most_important --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    [bc_pruned, _] = netstats.pruned_betweenness(G, Gt, bc, stderr)
+    bc_nx = nx.betweenness_centrality(Gt, normalized=True)
+    assert np.allclose(bc_pruned, [bc_nx[i] for i in Gt.nodes()])
+    # Removing a node from within the kept component changes the betweenness of the others
+    Gt.remove_node(0)
+    assert netstats.pruned_betweenness(G, Gt, bc, stderr) is None
+
+def test_threshold_sweep_metrics():
+    from pynets import thresholding
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_sps_unthresholded_mat.npy')
+    thresholds = [0.9, 0.1, 0.5, 0.3]
+
+    start_time = time.time()
+    sweep = netstats.threshold_sweep_metrics(in_mat, thresholds)
+    print("%s%s%s" % ('threshold_sweep_metrics --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    for i, thr in enumerate(thresholds):
+        conn_matrix_thr = thresholding.threshold_proportional(in_mat, thr)
+        G = nx.from_numpy_array(conn_matrix_thr)
+        assert np.isclose(sweep['density'][i], nx.density(G))
+        assert sweep['number_of_components'][i] == nx.number_connected_components(G)
+        assert sweep['giant_component_size'][i] == max(len(c) for c in nx.connected_components(G))
+        assert np.isclose(sweep['transitivity'][i], nx.transitivity(G))
+        assert np.isclose(sweep['average_clustering'][i], nx.average_clustering(G))
+        assert np.allclose(sweep['degree'][i], [G.degree(v) for v in G.nodes()])
+        assert np.allclose(sweep['strength'][i], np.sum(conn_matrix_thr, axis=1))
+        eigenvector = nx.eigenvector_centrality(G, max_iter=1000, tol=1e-10)
+        assert np.allclose(sweep['eigenvector_centrality'][i], [eigenvector[v] for v in G.nodes()], atol=1e-6)
@@ -68,7 +68,8 @@ def test_plot_conn_mat_nonet_mask():
     str(np.round(time.time() - start_time, 1)), 's'))
 
 
-def test_plot_all_nonet_no_mask():
+def test_plot_all_nonet_no_mask(monkeypatch, tmp_path):
+    monkeypatch.setenv('PYNETS_CACHE_DIR', str(tmp_path))
     # Set example inputs
     base_dir = str(Path(__file__).parent/"examples")
     #base_dir = '/Users/rxh180012/PyNets-development/tests/examples'
@@ -102,7 +103,8 @@ def test_plot_all_nonet_no_mask():
     str(np.round(time.time() - start_time, 1)), 's'))
 
 
-def test_plot_all_nonet_with_mask():
+def test_plot_all_nonet_with_mask(monkeypatch, tmp_path):
+    monkeypatch.setenv('PYNETS_CACHE_DIR', str(tmp_path))
     # Set example inputs
     base_dir = str(Path(__file__).parent/"examples")
     #base_dir = '/Users/rxh180012/PyNets-development/tests/examples'
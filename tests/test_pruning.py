@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Dec 27 16:19:14 2017
+
+@authors: Derek Pisner & Ryan Hammonds
+
+"""
+import numpy as np
+import networkx as nx
+import time
+from pathlib import Path
+from pynets import pruning
+
+
+def test_largest_component_mask():
+    G = nx.disjoint_union_all([nx.path_graph(3), nx.gnp_random_graph(30, 0.2, seed=3), nx.empty_graph(2)])
+    W = nx.to_numpy_array(G)
+
+    start_time = time.time()
+    keep = pruning.largest_component_mask(W)
+    print("%s%s%s" % ('largest_component_mask --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    largest = max(nx.connected_components(G), key=len)
+    assert np.array_equal(np.where(keep)[0], sorted(largest))
+
+
+def test_prune_mask(monkeypatch, tmp_path):
+    from pynets import thresholding
+    monkeypatch.setenv('PYNETS_CACHE_DIR', str(tmp_path))
+    base_dir = str(Path(__file__).parent/"examples")
+    in_mat = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
+    in_mat[:5, :] = 0
+    in_mat[:, :5] = 0
+    coords = [(i, i, i) for i in range(len(in_mat))]
+    label_names = [str(i) for i in range(len(in_mat))]
+
+    start_time = time.time()
+    keep = pruning.prune_mask(in_mat, 1)
+    print("%s%s%s" % ('prune_mask --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    assert not np.any(keep[:5])
+    [conn_matrix, coords_kept, labels_kept] = pruning.apply_mask(keep, in_mat, coords, label_names)
+    assert conn_matrix.shape == (np.sum(keep), np.sum(keep))
+    assert [tuple(c) for c in coords_kept] == [c for c, k in zip(coords, keep) if k]
+    assert labels_kept == [l for l, k in zip(label_names, keep) if k]
+
+    # The cached mask is shared by any weighting of the same graph
+    keep_cached = pruning.prune_mask(2 * in_mat, 1)
+    assert np.array_equal(keep_cached, keep)
+
+    # The importance mask also prunes nodes with low betweenness centrality
+    keep_important = pruning.prune_mask(in_mat, 2, use_cache=False)
+    assert not np.any(keep_important & ~keep)
+    assert np.all(pruning.prune_mask(in_mat, 0))
+
+    # Any conditioning of the same graph shares one mask, and a cached mask never computes betweenness
+    raw = in_mat.copy()
+    raw[6, 7] = raw[7, 6] = np.inf
+    keep_conditioned = pruning.prune_mask(thresholding.condition_matrix(raw, 'cov'), 2)
+    def bc():
+        raise AssertionError('betweenness computed for a cached mask')
+    assert np.array_equal(pruning.prune_mask(thresholding.condition_matrix(raw, 'corr'), 2, bc=bc), keep_conditioned)
+    # nan and inf weights are not edges
+    assert np.array_equal(pruning.prune_mask(raw, 2, bc=bc), keep_conditioned)
@@ -8,18 +8,21 @@ Created on Wed Dec 27 16:19:14 2017
 """
 import numpy as np
 import time
+import pytest
 try:
     import cPickle as pickle
 except ImportError:
     import _pickle as pickle
 from pathlib import Path
-from pynets import thresholding
+from pynets import netstats, thresholding
 
 
-def test_thresh_func():
+def test_thresh_func(tmp_path):
+    import os
+    from pynets import utils
     base_dir = str(Path(__file__).parent/"examples")
     #base_dir = '/Users/rxh180012/PyNets-development/tests/examples'
-    dir_path = base_dir + '/997'
+    dir_path = str(tmp_path)
     dens_thresh = False
     thr = 0.95
     smooth = 2
@@ -36,10 +39,10 @@ def test_thresh_func():
     prune = 1
     atlas_select = 'whole_brain_cluster_labels_PCA200'
     uatlas_select = None
-    labels_file_path = dir_path + '/whole_brain_cluster_labels_PCA200/Default_func_labelnames_wb.pkl'
+    labels_file_path = base_dir + '/997/whole_brain_cluster_labels_PCA200/Default_func_labelnames_wb.pkl'
     labels_file = open(labels_file_path, 'rb')
     label_names = pickle.load(labels_file)
-    coord_file_path = dir_path + '/whole_brain_cluster_labels_PCA200/Default_func_coords_wb.pkl'
+    coord_file_path = base_dir + '/997/whole_brain_cluster_labels_PCA200/Default_func_coords_wb.pkl'
     coord_file = open(coord_file_path, 'rb')
     coords = pickle.load(coord_file)
 
@@ -55,8 +58,173 @@ def test_thresh_func():
     assert conn_matrix_thr is not None
     assert edge_threshold is not None
     assert est_path is not None
+    # The unthresholded matrix is stored once, as the source of the saved estimate
+    unthr_path = utils.create_unthr_path(ID, network, conn_model, roi, dir_path)
+    assert np.array_equal(np.load(unthr_path), conn_matrix)
+    assert len(set(os.stat(os.path.join(dir_path, i)).st_ino for i in os.listdir(dir_path) if i.endswith('.npy'))) == 1
+    assert np.array_equal(utils.load_est(est_path), conn_matrix_thr)
 
 
+def test_density_thresholding():
+    base_dir = str(Path(__file__).parent/"examples")
+    conn_matrix = np.load(base_dir + '/997/997_Default_est_sps_unthresholded_mat.npy')
+    n = len(conn_matrix)
+
+    for thr in [0.05, 0.1, 0.37]:
+        start_time = time.time()
+        conn_matrix_thr = thresholding.density_thresholding(conn_matrix, thr)
+        print("%s%s%s" % ('density_thresholding --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+        n_edges = min(round(thr * n * (n - 1) / 2), np.count_nonzero(np.triu(conn_matrix, 1)))
+        assert np.isclose(thresholding.est_density(conn_matrix_thr), n_edges / (n * (n - 1) / 2))
+        assert np.allclose(conn_matrix_thr, thresholding.threshold_proportional(thresholding.normalize(conn_matrix),
+                                                                                thr))
+    # Matrices sparser than the target density are only normalized
+    sparse_matrix = thresholding.threshold_proportional(conn_matrix, 0.1)
+    assert np.allclose(thresholding.density_thresholding(sparse_matrix, 0.5), thresholding.normalize(sparse_matrix))
+    assert np.array_equal(conn_matrix, np.load(base_dir + '/997/997_Default_est_sps_unthresholded_mat.npy'))
+
+def test_condition_matrix():
+    base_dir = str(Path(__file__).parent/"examples")
+    conn_matrix = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
+
+    start_time = time.time()
+    in_mat = thresholding.condition_matrix(conn_matrix)
+    print("%s%s%s" % ('condition_matrix --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    assert np.allclose(in_mat, thresholding.normalize(thresholding.autofix(conn_matrix)))
+    assert np.array_equal(in_mat, in_mat.T)
+    assert not np.shares_memory(in_mat, conn_matrix)
+
+    in_mat_32 = thresholding.condition_matrix(conn_matrix, dtype=np.float32)
+    assert in_mat_32.dtype == np.float32
+    assert np.allclose(in_mat_32, in_mat, atol=1e-6)
+    work = np.array(conn_matrix)
+    assert thresholding.condition_matrix(work, copy=False) is work
+
+    # nan and inf are removed, and the Fisher transform stays finite
+    dirty = np.array(conn_matrix)
+    dirty[3, 4] = dirty[4, 3] = np.nan
+    dirty[5, 6] = dirty[6, 5] = np.inf
+    z = thresholding.condition_matrix(dirty, conn_model='corr')
+    assert np.all(np.isfinite(z))
+    assert z[3, 4] == 0 and z[5, 6] == 0 and np.all(np.diag(z) == 0)
+
+def test_threshold_sweep(monkeypatch, tmp_path):
+    from pynets import utils
+    monkeypatch.setenv('PYNETS_CACHE_DIR', str(tmp_path / 'cache'))
+    base_dir = str(Path(__file__).parent/"examples")
+    conn_matrix = np.abs(np.load(base_dir + '/997/997_Default_est_sps_unthresholded_mat.npy'))
+    thresholds = [0.1, 0.05, 0.15, 0.15, 0.0, 1.0]
+
+    start_time = time.time()
+    sweep = thresholding.ThresholdSweep(conn_matrix)
+    for [thr, conn_matrix_thr], [_, mask] in zip(sweep.matrices(thresholds), sweep.masks(thresholds)):
+        expected = thresholding.threshold_proportional(conn_matrix, thr)
+        assert np.array_equal(conn_matrix_thr, expected)
+        assert np.array_equal(mask, expected != 0)
+    print("%s%s%s" % ('ThresholdSweep --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    asym = np.random.RandomState(1).rand(10, 10)
+    assert np.array_equal(thresholding.ThresholdSweep(asym).matrix(0.3), thresholding.threshold_proportional(asym, 0.3))
+
+    # Metrics of matrices handed over in memory match those of the saved matrices
+    dir_path = str(tmp_path)
+    out_paths = sweep.extractnetstats([0.15, 0.1], '997', 'Default', 'cov', dir_path, None, 1, 'parc', 0, 0,
+                                      save=True)
+    for thr, out_path in zip([0.15, 0.1], out_paths):
+        est_path = utils.create_est_path('997', 'Default', 'cov', thr, None, dir_path, 'parc', 0, 0,
+                                         'prop').replace('.npy', '.npz')
+        assert np.array_equal(utils.load_est(est_path), sweep.matrix(thr))
+        df = utils.net_metrics_to_dataframe(out_path)
+        df_file = utils.net_metrics_to_dataframe(netstats.extractnetstats('997', 'Default', thr, 'cov', est_path, None,
+                                                                          1, 'parc', 0, 0))
+        assert np.allclose(df.values.astype(float), df_file.values.astype(float), equal_nan=True)
+    # Later thresholds of the same estimate are warm-started from the eigenvector centrality kept in memory
+    assert ('997', 'Default', 'cov', 'None', 1, 'parc', 0, dir_path) in netstats._eigenvector_starts
+    assert not (tmp_path / 'cache' / 'eigenvector').exists()
+
+def test_local_thresholding():
+    import networkx as nx
+    rs = np.random.RandomState(0)
+    conn_matrix = rs.rand(60, 60)
+    conn_matrix = (conn_matrix + conn_matrix.T) / 2
+    n_pairs = 60 * 59 // 2
+    G = nx.from_numpy_array(conn_matrix)
+    mst = nx.to_numpy_array(nx.maximum_spanning_tree(G), nodelist=range(60)) != 0
+
+    for thr in [0.05, 0.2]:
+        start_time = time.time()
+        conn_matrix_thr = thresholding.local_thresholding_prop(conn_matrix, thr)
+        print("%s%s%s" % ('local_thresholding_prop --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+        assert np.count_nonzero(np.triu(conn_matrix_thr, 1)) == int(thr * n_pairs)
+        assert np.all(conn_matrix_thr[mst] == conn_matrix[mst])
+        assert np.all((conn_matrix_thr == 0) | (conn_matrix_thr == conn_matrix))
+        conn_matrix_thr = thresholding.local_thresholding_dens(conn_matrix, thr)
+        assert thresholding.est_density(conn_matrix_thr) >= thr
+        assert np.count_nonzero(np.triu(conn_matrix_thr, 1)) == int(np.ceil(thr * n_pairs))
+
+    # Below the density of the tree, only the tree is kept
+    assert np.array_equal(thresholding.local_thresholding_prop(conn_matrix, 0.01) != 0, mst)
+    # The edges added first are those of the 2-nearest neighbour graph
+    conn_matrix_thr = thresholding.local_thresholding_prop(conn_matrix, 0.04)
+    nng = nx.to_numpy_array(thresholding.knn(conn_matrix, 2), nodelist=range(60)) != 0
+    assert np.all(nng[(conn_matrix_thr != 0) & ~mst])
+
+    # The target edge count is a proportion of the non-NaN weights
+    conn_matrix_nan = conn_matrix.copy()
+    conn_matrix_nan[0, 1:31] = conn_matrix_nan[1:31, 0] = np.nan
+    conn_matrix_thr = thresholding.local_thresholding_prop(conn_matrix_nan, 0.2)
+    assert np.count_nonzero(np.triu(conn_matrix_thr, 1)) == int(0.2 * (n_pairs - 30))
+
+    # A node disconnected from the rest of the graph has no spanning tree
+    conn_matrix_disc = conn_matrix.copy()
+    conn_matrix_disc[0, 1:] = conn_matrix_disc[1:, 0] = 0
+    with pytest.raises(RuntimeWarning):
+        thresholding.local_thresholding_prop(conn_matrix_disc, 0.2)
+    with pytest.raises(RuntimeWarning):
+        thresholding.local_thresholding_dens(conn_matrix_disc, 0.2)
+
+def test_disparity_filter():
+    import networkx as nx
+    from scipy import integrate
+    G = nx.gnp_random_graph(40, 0.3, seed=2)
+    rs = np.random.RandomState(2)
+    for u, v in G.edges():
+        G.edges[u, v]['weight'] = rs.rand()
+    conn_matrix = nx.to_numpy_array(G)
+    alphas = [0.05, 0.2, 0.5]
+
+    start_time = time.time()
+    masks = thresholding.disparity_filter_masks(conn_matrix, alphas)
+    print("%s%s%s" % ('disparity_filter_masks --> finished: ', str(np.round(time.time() - start_time, 1)), 's'))
+    [alpha_out, alpha_in] = thresholding.disparity_alpha(conn_matrix)
+    for u, v in G.edges():
+        k = G.degree(u)
+        p_ij = G[u][v]['weight'] / G.degree(u, weight='weight')
+        alpha_ij = 1 - (k - 1) * integrate.quad(lambda x: (1 - x) ** (k - 2), 0, p_ij)[0]
+        assert np.isclose(alpha_out[u, v], alpha_ij) and np.isclose(alpha_in[v, u], alpha_ij)
+    for alpha_t, mask in zip(alphas, masks):
+        assert np.array_equal(mask, mask.T)
+        B = thresholding.disparity_filter_alpha_cut(thresholding.disparity_filter(G), alpha_t=alpha_t)
+        assert mask.sum() // 2 == B.number_of_edges()
+        assert all(mask[u, v] for u, v in B.edges())
+    assert np.all(masks[1] <= masks[2])
+    assert np.all(thresholding.disparity_filter_masks(conn_matrix, 0.2, cut_mode='and')[0] <= masks[1])
+
+    # A directed edge that is the only one out of its tail and into its head is always kept, while an undirected
+    # edge between two degree-1 nodes is not significant
+    W = np.zeros((4, 4))
+    W[0, 1] = 0.5
+    W[1, 2] = W[2, 3] = W[2, 0] = W[3, 2] = 1
+    [alpha_out, alpha_in] = thresholding.disparity_alpha(W)
+    assert alpha_out[0, 1] == 0 and alpha_in[0, 1] == 0
+    assert alpha_out[1, 2] == 1 and alpha_in[1, 2] == 0.5
+    assert thresholding.disparity_filter_masks(W, 0.01)[0][0, 1]
+    D = thresholding.disparity_filter(nx.from_numpy_array(W, create_using=nx.DiGraph))
+    assert D[0][1]['alpha_out'] == 0 and D[0][1]['alpha_in'] == 0
+    assert thresholding.disparity_filter_alpha_cut(D, alpha_t=0.01).has_edge(0, 1)
+    dyad = np.zeros((3, 3))
+    dyad[0, 1] = dyad[1, 0] = 1
+    assert not np.any(thresholding.disparity_filter_masks(dyad, 0.5)[0])
+
 # def test_thresh_diff():
 #     # Set example inputs
 #     base_dir = str(Path(__file__).parent/"examples")
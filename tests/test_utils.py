@@ -27,6 +27,69 @@ def test_export_to_pandas():
     assert outfile is not None
 
 
+def test_export_to_pandas_npz(tmp_path):
+    import pandas as pd
+    net_mets_file = str(tmp_path) + '/997_net_metrics_cov_0.9_parc_nb_nosm.npz'
+    np.savez(net_mets_file, global_names=np.array(['global_efficiency', 'average_degree_cent']),
+             global_values=np.array([0.5, 0.25]), node_ids=np.array([0, 2, 3]),
+             nodal_names=np.array(['local_efficiency', 'degree_centrality']),
+             nodal_values=np.array([[0.1, 0.2], [0.3, 0.4], [0.5, np.nan]]),
+             rich_club_degrees=np.array([1, 2]), rich_club_values=np.array([0.9, 1.1]))
+
+    df = utils.net_metrics_to_dataframe(net_mets_file)
+    assert df.shape == (1, 10)
+    assert df['3_local_efficiency'][0] == 0.5
+    assert df['2_degree_centrality'][0] == 0.4
+    assert np.isnan(df['3_degree_centrality'][0])
+    assert df['2_rich_club'][0] == 1.1
+
+    outfile = utils.export_to_pandas(net_mets_file, '997', None, None)
+    assert outfile == net_mets_file.split('.npz')[0]
+    df = pd.read_pickle(outfile)
+    assert list(df.columns[:2]) == ['id', 'global_efficiency']
+    assert df['id'][0] == '997'
+
+
+def test_save_est(tmp_path):
+    import os
+    from pynets import thresholding
+    base_dir = str(Path(__file__).parent/"examples")
+    conn_matrix = np.load(base_dir + '/997/997_Default_est_cov_0.1_4.npy')
+    dir_path = str(tmp_path)
+
+    # Proportional thresholds are stored as edge counts over one edge-rank index
+    saved = []
+    for thr in [0.05, 0.2]:
+        conn_matrix_thr = thresholding.threshold_proportional(conn_matrix, thr)
+        est_path = utils.create_est_path('997', 'Default', 'cov', thr, None, dir_path, 'parc', 0, 0, 'prop')
+        est_path = utils.save_est(conn_matrix_thr, est_path, conn_matrix_unthr=conn_matrix)
+        assert est_path.endswith('.npz')
+        with np.load(est_path) as est:
+            assert str(est['format']) == 'rank'
+        assert np.array_equal(utils.load_est(est_path), conn_matrix_thr)
+        saved.append((est_path, conn_matrix_thr))
+    assert len([i for i in os.listdir(dir_path) if i.endswith('_ranks.npz')]) == 1
+
+    # Another estimate of the same subject (e.g. another node size or bootstrap) keeps its own source matrix
+    other = conn_matrix * np.random.RandomState(0).rand(*conn_matrix.shape)
+    other = (other + other.T) / 2
+    other_thr = thresholding.threshold_proportional(other, 0.05)
+    other_path = utils.save_est(other_thr, os.path.join(dir_path, 'other_est.npy'), conn_matrix_unthr=other)
+    assert np.array_equal(utils.load_est(other_path), other_thr)
+    for est_path, conn_matrix_thr in saved:
+        assert np.array_equal(utils.load_est(est_path), conn_matrix_thr)
+
+    # Any other matrix is stored in CSR form
+    dense = np.abs(np.random.RandomState(1).randn(*conn_matrix.shape))
+    for conn_matrix_thr in [thresholding.local_thresholding_prop((dense + dense.T) / 2, 0.05),
+                            np.triu(thresholding.threshold_proportional(conn_matrix, 0.1))]:
+        est_path = utils.save_est(conn_matrix_thr, os.path.join(dir_path, 'other.npy'), conn_matrix_unthr=conn_matrix)
+        with np.load(est_path) as est:
+            assert str(est['format']) == 'csr'
+        assert np.array_equal(utils.load_est(est_path), conn_matrix_thr)
+        assert os.path.getsize(est_path) < conn_matrix_thr.nbytes / 2
+
+
 def test_save_RSN_coords_and_labels_to_pickle():
     base_dir = str(Path(__file__).parent/"examples")
     #base_dir = '/Users/rxh180012/PyNets-development/tests/examples'